@@ -1,24 +1,34 @@
-import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 from app.config import get_settings
 from app.api.v1.router import api_router
+from app.api.deps import get_readiness, init_services, shutdown_services
+from app.core.metrics import render_metrics
+from app.logging_config import setup_logging
 
-# Configuración de logs
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(Path("logs/app.log"))
-    ]
-)
+# Configuración de logs (escritura en segundo plano, ver app/logging_config.py)
+setup_logging()
 
 settings = get_settings()
 
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """
+    Gestiona el ciclo de vida de la aplicación: crea los servicios y los
+    recursos compartidos de los proveedores al arrancar, los calienta en
+    segundo plano y los libera al detenerse
+    """
+    await init_services()
+    try:
+        yield
+    finally:
+        await shutdown_services()
+
 def create_application() -> FastAPI:
     """
     Crea y configura la aplicación FastAPI
@@ -29,6 +39,7 @@ def create_application() -> FastAPI:
         version=settings.VERSION,
         docs_url="/docs",
         redoc_url="/redoc",
+        lifespan=lifespan,
     )
 
     # Configurar CORS
@@ -62,4 +73,17 @@ def create_application() -> FastAPI:
         """Verificar salud de la aplicación"""
         return {"status": "healthy"}
 
+    @application.get("/ready", tags=["Status"])
+    async def readiness_check():
+        """Verificar si la aplicación terminó el calentamiento y puede recibir tráfico"""
+        readiness = get_readiness()
+        if not readiness["ready"]:
+            return JSONResponse(status_code=503, content={"status": "warming_up", **readiness})
+        return {"status": "ready", **readiness}
+
+    @application.get("/metrics", tags=["Status"], response_class=PlainTextResponse)
+    async def metrics():
+        """Métricas de latencia por etapa y resultado de los envíos en formato Prometheus"""
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
     return application
\ No newline at end of file
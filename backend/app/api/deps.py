@@ -1,15 +1,32 @@
+import asyncio
+import logging
+import time
 from fastapi import Depends, HTTPException
-from typing import Dict
+from typing import Any, Awaitable, Dict, Optional
 
+from app.config import get_settings
 from app.core.email_service import EmailService
 from app.core.template_service import TemplateService
 from app.core.attachment_service import AttachmentService
+from app.core.queue_service import EmailQueue
+from app.core.idempotency import IdempotencyStore
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
 
 # Singleton services
 _auth_service = None
 _email_service = None
 _template_service = None
 _attachment_service = None
+_email_queue = None
+_idempotency_store = None
+
+# Estado del calentamiento inicial, consultado por /ready
+_warmup_task: Optional[asyncio.Task] = None
+# Limpieza periódica del almacén de adjuntos
+_store_gc_task: Optional[asyncio.Task] = None
+_readiness: Dict[str, Any] = {"ready": False, "checks": {}}
 
 # def get_auth_service() ->EmailService:
 #     """Obtiene el servicio de autenticación como dependencia"""
@@ -46,4 +63,118 @@ def get_attachment_service() -> AttachmentService:
     global _attachment_service
     if _attachment_service is None:
         _attachment_service = AttachmentService()
-    return _attachment_service
\ No newline at end of file
+    return _attachment_service
+
+def get_email_queue() -> EmailQueue:
+    """Obtiene la cola persistente de correos como dependencia"""
+    global _email_queue
+    if _email_queue is None:
+        _email_queue = EmailQueue()
+    return _email_queue
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Obtiene el almacén de claves de idempotencia como dependencia"""
+    global _idempotency_store
+    if _idempotency_store is None:
+        _idempotency_store = IdempotencyStore()
+    return _idempotency_store
+
+async def init_services() -> None:
+    """
+    Crea los servicios compartidos al arrancar la aplicación, inicia el
+    proveedor de correo y la cola, y lanza el calentamiento en segundo plano
+    """
+    global _warmup_task, _store_gc_task
+    email_service = get_email_service()
+    template_service = get_template_service()
+    attachment_service = get_attachment_service()
+    email_queue = get_email_queue()
+    get_idempotency_store()
+    
+    await email_service.startup()
+    await email_queue.start(email_service)
+    if settings.ATTACHMENT_STORE_GC_INTERVAL > 0:
+        _store_gc_task = asyncio.create_task(
+            _collect_attachment_store(attachment_service, email_queue), name="attachment-store-gc"
+        )
+    
+    _readiness["ready"] = False
+    _readiness["checks"] = {}
+    if settings.WARMUP_ENABLED:
+        _warmup_task = asyncio.create_task(_warm_up(email_service, template_service), name="warm-up")
+    else:
+        _readiness["ready"] = True
+
+async def shutdown_services() -> None:
+    """Detiene la cola y libera los recursos de los servicios compartidos"""
+    global _email_service, _template_service, _attachment_service, _email_queue, _idempotency_store, _warmup_task
+    global _store_gc_task
+    for task in (_warmup_task, _store_gc_task):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    _warmup_task = _store_gc_task = None
+    _readiness["ready"] = False
+    
+    if _email_queue is not None:
+        await _email_queue.stop()
+    if _email_service is not None:
+        await _email_service.shutdown()
+    for service in (_template_service, _attachment_service, _idempotency_store):
+        if service is not None:
+            service.close()
+    _email_service = _template_service = _attachment_service = _email_queue = _idempotency_store = None
+
+def get_readiness() -> Dict[str, Any]:
+    """Devuelve si el calentamiento terminó y el resultado de cada comprobación"""
+    return {"ready": _readiness["ready"], "checks": dict(_readiness["checks"])}
+
+async def _collect_attachment_store(attachment_service: AttachmentService, email_queue: EmailQueue) -> None:
+    """
+    Elimina periódicamente del almacén los adjuntos sin uso (en línea o de archivos
+    eliminados), conservando los que referencian los envíos encolados sin terminar
+    """
+    while True:
+        await asyncio.sleep(settings.ATTACHMENT_STORE_GC_INTERVAL)
+        try:
+            referenced = await asyncio.to_thread(email_queue.referenced_attachment_ids)
+            removed = await asyncio.to_thread(attachment_service.collect_store, referenced)
+            if removed:
+                logger.info("%s adjuntos sin uso eliminados del almacén", removed)
+        except Exception:
+            logger.exception("Error al limpiar el almacén de adjuntos")
+
+async def _warm_up(email_service: EmailService, template_service: TemplateService) -> None:
+    """
+    Calienta el proveedor de correo (sesiones, tokens) y la caché de plantillas.
+    Los fallos se registran en el estado de preparación pero no impiden declarar
+    la aplicación lista: los envíos harán el trabajo pendiente al llegar.
+    """
+    started = time.monotonic()
+    checks = {
+        "email_provider": email_service.warm_up(),
+        "templates": asyncio.to_thread(template_service.warm_up),
+    }
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(_run_check(name, check) for name, check in checks.items())),
+            timeout=settings.WARMUP_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        for name in checks:
+            _readiness["checks"].setdefault(name, {"status": "timeout"})
+        logger.warning("Calentamiento interrumpido tras %gs", settings.WARMUP_TIMEOUT)
+    _readiness["ready"] = True
+    logger.info("Aplicación lista en %.2fs", time.monotonic() - started)
+
+async def _run_check(name: str, check: Awaitable[Any]) -> None:
+    started = time.monotonic()
+    try:
+        result = await check
+    except Exception as e:
+        logger.error("Error en el calentamiento de %s: %s", name, e)
+        _readiness["checks"][name] = {"status": "error", "detail": str(e)}
+        return
+    _readiness["checks"][name] = {"status": "ok", "seconds": round(time.monotonic() - started, 3)}
+    if result is not None:
+        _readiness["checks"][name]["result"] = result
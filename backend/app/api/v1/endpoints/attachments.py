@@ -1,11 +1,17 @@
+import asyncio
 import logging
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import Response
+import mimetypes
+from email.utils import parsedate_to_datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
 
 from app.schemas.attachment import AttachmentListResponse, AttachmentUploadResponse
-from app.core.attachment_service import AttachmentService
+from app.core.attachment_service import AttachmentService, AttachmentTooLargeError
 from app.config import get_settings
 from app.api.deps import get_attachment_service
+from app.utils.upload_stream import MultipartFileStream
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -13,76 +19,153 @@ settings = get_settings()
 
 @router.get("/", response_model=AttachmentListResponse)
 async def list_attachments(
+    limit: Optional[int] = Query(None, ge=1, le=settings.CATALOG_MAX_PAGE_SIZE, description="Número máximo de resultados"),
+    prefix: Optional[str] = Query(None, description="Filtrar por prefijo del nombre"),
+    sort_by: Literal["name", "size", "mtime"] = Query("name", description="Criterio de ordenación"),
+    order: Literal["asc", "desc"] = Query("asc", description="Sentido de la ordenación"),
+    cursor: Optional[str] = Query(None, description="Cursor `next_cursor` de la página anterior"),
     attachment_service: AttachmentService = Depends(get_attachment_service)
 ):
     """
     Lista todos los archivos adjuntos disponibles.
+    
+    Admite paginación: con `limit` la respuesta incluye `next_cursor` mientras queden
+    resultados, que se pasa como `cursor` (con los mismos filtros) para obtener la página siguiente.
     """
     try:
-        return attachment_service.list_attachments()
+        return attachment_service.list_attachments(
+            limit=limit,
+            prefix=prefix,
+            sort_by=sort_by,
+            order=order,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.exception(f"Error al listar archivos adjuntos: {str(e)}")
+        logger.exception("Error al listar archivos adjuntos: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al listar archivos adjuntos: {str(e)}")
 
-@router.post("/upload", response_model=AttachmentUploadResponse)
+# El cuerpo se lee a mano (ver upload_attachment): se documenta aquí el formulario esperado
+_UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+@router.post("/upload", response_model=AttachmentUploadResponse, openapi_extra=_UPLOAD_REQUEST_BODY)
 async def upload_attachment(
-    file: UploadFile = File(...),
+    request: Request,
     attachment_service: AttachmentService = Depends(get_attachment_service)
 ):
     """
-    Sube un nuevo archivo para usar como adjunto.
+    Sube un nuevo archivo (campo `file` de un formulario multipart) para usar como adjunto.
+    
+    El archivo se copia a disco por bloques según llega, sin recibir antes el cuerpo
+    completo, y se rechaza con 413 en cuanto supera el tamaño máximo. La respuesta
+    incluye su `attachment_id`, que puede usarse en los envíos en lugar del contenido en base64.
     """
     try:
-        # Leer contenido
-        content = await file.read()
+        # Rechazar de inmediato las peticiones que declaran un tamaño excesivo
+        # (el margen cubre los delimitadores y cabeceras del multipart)
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > settings.MAX_ATTACHMENT_SIZE + 64 * 1024:
+            raise AttachmentTooLargeError()
         
-        # Verificar tamaño
-        if len(content) > settings.MAX_ATTACHMENT_SIZE:
-            raise HTTPException(
-                status_code=413,
-                detail=f"El archivo excede el tamaño máximo permitido ({settings.MAX_ATTACHMENT_SIZE} bytes)"
-            )
+        upload = MultipartFileStream(request, "file")
+        await upload.open()
         
-        # Guardar archivo
-        attachment_info = attachment_service.save_attachment(file.filename, content)
+        # Guardar archivo mientras se recibe
+        attachment_info = await attachment_service.save_upload(upload.filename, upload.iter_chunks())
         
         return AttachmentUploadResponse(
             success=True,
-            message=f"Archivo '{file.filename}' subido correctamente",
+            message=f"Archivo '{upload.filename}' subido correctamente",
             attachment=attachment_info
         )
+    except AttachmentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # Cuerpo que no es multipart, sin el campo `file` o incompleto
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error al subir archivo adjunto: {str(e)}")
+        logger.exception("Error al subir archivo adjunto: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al subir archivo adjunto: {str(e)}")
 
-@router.get("/{filename}")
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
 async def get_attachment(
     filename: str,
+    request: Request,
     attachment_service: AttachmentService = Depends(get_attachment_service)
 ):
     """
     Descarga un archivo adjunto.
+    
+    El archivo se envía por bloques sin cargarlo en memoria. Admite peticiones `Range`
+    (descargas parciales y reanudables) y validación con `ETag` (SHA-256 del contenido)
+    o `Last-Modified`: si el cliente ya tiene la versión actual se responde 304 sin cuerpo.
     """
     try:
-        content = attachment_service.get_attachment_content(filename)
-        
-        # Determinar el tipo MIME
-        import mimetypes
+        # La primera vez se calcula el hash del archivo; después queda en memoria
+        stored, stats = await asyncio.to_thread(attachment_service.get_attachment_file, filename)
         content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
         
-        return Response(
-            content=content,
+        # Se sirve la copia del almacén: es inmutable, por lo que una subida que
+        # sobrescriba el archivo durante la descarga no altera el contenido enviado
+        response = FileResponse(
+            stored.raw_path,
             media_type=content_type,
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            filename=filename,
+            stat_result=stats,
+            headers={
+                "ETag": f'"{stored.attachment_id}"',
+                "Cache-Control": "no-cache"
+            }
         )
+        
+        if _is_not_modified(request, stored.attachment_id, stats.st_mtime):
+            return Response(
+                status_code=304,
+                headers={
+                    key: response.headers[key]
+                    for key in ("etag", "last-modified", "cache-control")
+                }
+            )
+        return response
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Archivo adjunto '{filename}' no encontrado")
     except Exception as e:
-        logger.exception(f"Error al obtener archivo adjunto {filename}: {str(e)}")
+        logger.exception("Error al obtener archivo adjunto %s: %s", filename, e)
         raise HTTPException(status_code=500, detail=f"Error al obtener archivo adjunto: {str(e)}")
 
+def _is_not_modified(request: Request, attachment_id: str, mtime: float) -> bool:
+    """Evalúa `If-None-Match` y, en su ausencia, `If-Modified-Since` (RFC 9110)"""
+    if_none_match: Optional[str] = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")}
+        return "*" in tags or attachment_id in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified tiene resolución de segundos
+        return int(mtime) <= since.timestamp()
+    return False
+
 @router.delete("/{filename}")
 async def delete_attachment(
     filename: str,
@@ -104,5 +187,5 @@ async def delete_attachment(
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error al eliminar archivo adjunto {filename}: {str(e)}")
+        logger.exception("Error al eliminar archivo adjunto %s: %s", filename, e)
         raise HTTPException(status_code=500, detail=f"Error al eliminar archivo adjunto: {str(e)}")
\ No newline at end of file
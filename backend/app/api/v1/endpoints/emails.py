@@ -1,18 +1,35 @@
 import json
 import logging
 import base64
-from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import hashlib
+import time
+from contextlib import nullcontext
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Union
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, Request, Response, Query
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from app.schemas.email import EmailRequest, EmailResponse, EmailRecipient, Attachment
+from app.schemas.email import (
+    EmailRequest, EmailResponse, EmailRecipient, Attachment, BulkEmailRequest, BulkEmailResponse,
+    EmailJobStatus
+)
+from app.core import metrics
 from app.core.email_service import EmailService
 from app.core.template_service import TemplateService
-from app.api.deps import get_email_service, get_template_service
+from app.core.queue_service import EmailQueue
+from app.core.idempotency import (
+    IdempotencyConflictError, IdempotencyMismatchError, IdempotencyStore, hash_request
+)
+from app.core.template_engine import MissingTemplateVariablesError, compile_template
+from app.config import get_settings
+from app.logging_config import SAMPLED
+from app.api.deps import get_email_service, get_template_service, get_email_queue, get_idempotency_store
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+IDEMPOTENCY_KEY_DESCRIPTION = "Clave única del envío: los reintentos con la misma clave devuelven la respuesta original sin volver a enviar"
 
 class TemplateEmailRequest(BaseModel):
     template_name: str
@@ -28,7 +45,12 @@ class TemplateEmailRequest(BaseModel):
 async def send_email(
     email_data: EmailRequest,
     background_tasks: BackgroundTasks,
-    email_service: EmailService = Depends(get_email_service)
+    response: Response,
+    queued: bool = Query(False, description="Encolar el envío y responder inmediatamente"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description=IDEMPOTENCY_KEY_DESCRIPTION),
+    email_service: EmailService = Depends(get_email_service),
+    email_queue: EmailQueue = Depends(get_email_queue),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store)
     # headers: dict = Depends(get_auth_headers)
 ):
     """
@@ -41,11 +63,21 @@ async def send_email(
     - **cc_recipients**: Lista de destinatarios en copia (opcional)
     - **bcc_recipients**: Lista de destinatarios en copia oculta (opcional)
     - **importance**: Importancia del correo ("low", "normal", "high")
-    - **attachments**: Lista de archivos adjuntos (opcional)
+    - **attachments**: Lista de archivos adjuntos en base64 (`content`) o referenciados por el
+      `attachment_id` devuelto al subirlos (opcional)
     - **save_to_sent_items**: Guardar en elementos enviados (default: true)
     - **template_variables**: Variables para plantillas (opcional)
+    
+    Con `?queued=true` el correo se guarda en la cola persistente y se responde con
+    `202` y el `job_id`, consultable en `GET /emails/jobs/{job_id}`.
+    
+    Con la cabecera `Idempotency-Key`, un reintento con la misma clave y el mismo
+    cuerpo devuelve la respuesta original sin volver a enviar el correo.
     """
-    try:
+    async def send():
+        if queued:
+            return await _enqueue(email_data, email_queue, response)
+        
         result = await email_service.send_email(email_data)
         if not result.success:
             return JSONResponse(
@@ -53,16 +85,27 @@ async def send_email(
                 content={"success": False, "message": result.message}
             )
         return result
+    
+    try:
+        request_hash = hash_request({"queued": queued, "email": email_data.model_dump(mode="json")})
+        return await _run_idempotent("send", idempotency_key, request_hash, idempotency_store, response, send)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.exception(f"Error al enviar correo: {str(e)}")
+        logger.exception("Error al enviar correo: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al enviar correo: {str(e)}")
 
 @router.post("/send-template", response_model=EmailResponse)
 async def send_template_email(
     email_request: TemplateEmailRequest,
     background_tasks: BackgroundTasks,
+    response: Response,
+    queued: bool = Query(False, description="Encolar el envío y responder inmediatamente"),
     email_service: EmailService = Depends(get_email_service),
-    template_service: TemplateService = Depends(get_template_service)
+    template_service: TemplateService = Depends(get_template_service),
+    email_queue: EmailQueue = Depends(get_email_queue),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description=IDEMPOTENCY_KEY_DESCRIPTION),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store)
     #headers: dict = Depends(get_auth_headers)
 ):
     """
@@ -76,54 +119,326 @@ async def send_template_email(
     - **importance**: Importancia del correo ("low", "normal", "high")
     - **template_variables**: Variables para la plantilla en formato JSON (opcional)
     - **attachments**: Lista de objetos Attachment con archivos codificados en Base64 (opcional)
+    
+    Con `?queued=true` el correo se encola y se responde con `202` y el `job_id`.
+    
+    Admite la cabecera `Idempotency-Key`, como `/send`.
     """
     try:
-        # Verificar que la plantilla existe
-        try:
-            template_content = template_service.get_template_content(email_request.template_name)
-        except FileNotFoundError:
-            raise HTTPException(status_code=404, detail=f"Plantilla '{email_request.template_name}' no encontrada")
-        
-        # Convertir listas de destinatarios
-        to_list = [EmailRecipient(email=email.strip()) for email in email_request.to_recipients.split(",")]
-        
-        cc_list = None
-        if email_request.cc_recipients:
-            cc_list = [EmailRecipient(email=email.strip()) for email in email_request.cc_recipients.split(",")]
-        
-        bcc_list = None
-        if email_request.bcc_recipients:
-            bcc_list = [EmailRecipient(email=email.strip()) for email in email_request.bcc_recipients.split(",")]
-        
-        # Aplicar variables a la plantilla
-        if email_request.template_variables:
-            for key, value in email_request.template_variables.items():
-                template_content = template_content.replace(f"{{{key}}}", str(value))
-        
-        # Crear solicitud de correo
-        email_request_obj = EmailRequest(
-            subject=email_request.subject,
-            body=template_content,
-            body_type="HTML",
-            to_recipients=to_list,
-            cc_recipients=cc_list,
-            bcc_recipients=bcc_list,
-            importance=email_request.importance,
-            attachments=email_request.attachments,
-            template_variables=email_request.template_variables
+        request_hash = hash_request({"queued": queued, "email": email_request.model_dump(mode="json")})
+        return await _run_idempotent(
+            "send-template", idempotency_key, request_hash, idempotency_store, response,
+            lambda: _send_template(email_request, queued, response, email_service, template_service, email_queue)
         )
-        
-        # Enviar correo
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error al enviar correo desde plantilla: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error al enviar correo desde plantilla: {str(e)}")
+
+async def _send_template(
+    email_request: TemplateEmailRequest,
+    queued: bool,
+    response: Response,
+    email_service: EmailService,
+    template_service: TemplateService,
+    email_queue: EmailQueue
+) -> Union[EmailResponse, JSONResponse]:
+    """Construye el correo a partir de la plantilla y lo envía o lo encola"""
+    # Verificar que la plantilla existe
+    template_content = _read_template(template_service, email_request.template_name)
+    
+    # Convertir listas de destinatarios
+    to_list = [EmailRecipient(email=email.strip()) for email in email_request.to_recipients.split(",")]
+    
+    cc_list = None
+    if email_request.cc_recipients:
+        cc_list = [EmailRecipient(email=email.strip()) for email in email_request.cc_recipients.split(",")]
+    
+    bcc_list = None
+    if email_request.bcc_recipients:
+        bcc_list = [EmailRecipient(email=email.strip()) for email in email_request.bcc_recipients.split(",")]
+    
+    # Comprobar que la plantilla recibe todas sus variables
+    missing = compile_template(template_content).missing_variables(email_request.template_variables)
+    if missing:
+        if settings.TEMPLATE_STRICT_VARIABLES:
+            raise HTTPException(status_code=422, detail=str(MissingTemplateVariablesError(missing)))
+        logger.warning("Plantilla '%s' sin valor para: %s", email_request.template_name, ', '.join(sorted(missing)))
+    
+    # Las variables se aplican una sola vez, al construir el mensaje en el proveedor
+    # Crear solicitud de correo
+    email_request_obj = EmailRequest(
+        subject=email_request.subject,
+        body=template_content,
+        body_type="HTML",
+        to_recipients=to_list,
+        cc_recipients=cc_list,
+        bcc_recipients=bcc_list,
+        importance=email_request.importance,
+        attachments=email_request.attachments,
+        template_variables=email_request.template_variables
+    )
+    
+    if queued:
+        return await _enqueue(email_request_obj, email_queue, response)
+    
+    # Enviar correo
+    with metrics.template_context(email_request.template_name):
         result = await email_service.send_email(email_request_obj)
-        if not result.success:
-            return JSONResponse(
-                status_code=500,
-                content={"success": False, "message": result.message}
+    if not result.success:
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": result.message}
+        )
+    return result
+
+@router.get("/jobs/{job_id}", response_model=EmailJobStatus)
+async def get_email_job(
+    job_id: str,
+    email_queue: EmailQueue = Depends(get_email_queue)
+):
+    """
+    Consulta el estado de un correo encolado: `pending`, `processing`, `retrying`, `sent` o `dead`.
+    """
+    job = await email_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado")
+    return job
+
+async def _enqueue(email_data: EmailRequest, email_queue: EmailQueue, response: Response) -> EmailResponse:
+    """Guarda el correo en la cola persistente y responde 202 con el identificador del trabajo"""
+    job = await email_queue.enqueue(email_data)
+    logger.info("Correo encolado con trabajo: %s", job.job_id, extra=SAMPLED)
+    response.status_code = 202
+    return EmailResponse(
+        success=True,
+        message="Correo encolado para su envío",
+        job_id=job.job_id
+    )
+
+async def _run_idempotent(
+    scope: str,
+    idempotency_key: Optional[str],
+    request_hash: str,
+    idempotency_store: IdempotencyStore,
+    response: Response,
+    send: Callable[[], Awaitable[Union[EmailResponse, JSONResponse]]]
+) -> Union[EmailResponse, JSONResponse]:
+    """
+    Ejecuta un envío protegido por `Idempotency-Key`.
+    
+    Sin clave se envía directamente. Con clave, si ya se completó se devuelve la
+    respuesta guardada (cabecera `Idempotent-Replayed: true`) sin llamar al
+    proveedor; si no, se reserva, se envía y se guarda la respuesta. Los envíos
+    fallidos liberan la clave para que el cliente pueda reintentarlos.
+    """
+    if not idempotency_key:
+        return await send()
+    
+    stored = await _begin_idempotent(scope, idempotency_key, request_hash, idempotency_store)
+    if stored is not None:
+        return stored
+    
+    try:
+        async with idempotency_store.hold(scope, idempotency_key):
+            result = await send()
+    except BaseException:
+        await idempotency_store.release(scope, idempotency_key)
+        raise
+    
+    if isinstance(result, JSONResponse):
+        status_code, body = result.status_code, json.loads(result.body)
+    else:
+        status_code, body = response.status_code or 200, result.model_dump(mode="json")
+    
+    if 200 <= status_code < 300:
+        await idempotency_store.complete(scope, idempotency_key, status_code, body)
+    else:
+        await idempotency_store.release(scope, idempotency_key)
+    return result
+
+async def _begin_idempotent(
+    scope: str,
+    idempotency_key: str,
+    request_hash: Optional[str],
+    idempotency_store: IdempotencyStore
+) -> Optional[JSONResponse]:
+    """
+    Reserva la clave de idempotencia de un envío
+    
+    Returns:
+        Optional[JSONResponse]: Respuesta guardada si la clave ya se completó
+    
+    Raises:
+        HTTPException: 400 si la clave no es válida, 409 si hay otra petición con la
+            misma clave en curso y 422 si la clave se usó con un cuerpo distinto
+    """
+    if len(idempotency_key) > settings.IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"La cabecera Idempotency-Key admite como máximo {settings.IDEMPOTENCY_KEY_MAX_LENGTH} caracteres"
+        )
+    try:
+        stored = await idempotency_store.begin(scope, idempotency_key, request_hash)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IdempotencyMismatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    if stored is None:
+        return None
+    logger.info("Petición repetida con clave de idempotencia %s: se devuelve la respuesta guardada", idempotency_key)
+    return JSONResponse(
+        status_code=stored.status_code,
+        content=stored.body,
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+@router.post("/send-bulk", response_model=BulkEmailResponse)
+async def send_bulk_email(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description=IDEMPOTENCY_KEY_DESCRIPTION),
+    email_service: EmailService = Depends(get_email_service),
+    template_service: TemplateService = Depends(get_template_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store)
+):
+    """
+    Envía una plantilla HTML a muchos destinatarios con variables personalizadas para cada uno.
+    
+    Acepta dos formatos de cuerpo:
+    
+    - **application/json**: un objeto `BulkEmailRequest` con la lista `recipients`
+    - **application/x-ndjson**: la primera línea es el `BulkEmailRequest` (sin `recipients`)
+      y cada línea siguiente un destinatario `{"email", "name", "template_variables"}`.
+      Los destinatarios se procesan a medida que llegan.
+    
+    Devuelve el identificador del trabajo y el resultado de cada destinatario.
+    
+    Con la cabecera `Idempotency-Key`, repetir la petición con la misma clave y el
+    mismo cuerpo devuelve el resultado original sin volver a enviar a nadie. Para
+    reintentar solo los destinatarios fallidos hay que usar una clave nueva.
+    """
+    scope = "send-bulk"
+    # Huella del cuerpo tal como llega: con NDJSON solo se conoce al terminar de leerlo
+    digest = hashlib.sha256()
+    try:
+        if idempotency_key:
+            stored = await _begin_idempotent(scope, idempotency_key, None, idempotency_store)
+            if stored is not None:
+                # El cuerpo se lee solo para comprobar que coincide con el de la petición original
+                async for chunk in request.stream():
+                    digest.update(chunk)
+                try:
+                    await idempotency_store.check_replay(scope, idempotency_key, digest.hexdigest())
+                except IdempotencyMismatchError as e:
+                    raise HTTPException(status_code=422, detail=str(e))
+                return stored
+        
+        try:
+            # La reserva se renueva mientras dura el envío, aunque supere IDEMPOTENCY_LOCK_TIMEOUT
+            hold = idempotency_store.hold(scope, idempotency_key) if idempotency_key else nullcontext()
+            async with hold:
+                result = await _send_bulk(request, digest, email_service, template_service)
+        except BaseException:
+            if idempotency_key:
+                await idempotency_store.release(scope, idempotency_key)
+            raise
+        
+        if idempotency_key:
+            await idempotency_store.complete(
+                scope, idempotency_key, 200, result.model_dump(mode="json"), request_hash=digest.hexdigest()
             )
         return result
-        
+    
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error al enviar correo desde plantilla: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error al enviar correo desde plantilla: {str(e)}")
\ No newline at end of file
+        logger.exception("Error en el envío masivo: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error en el envío masivo: {str(e)}")
+
+async def _send_bulk(
+    request: Request,
+    digest: "hashlib._Hash",
+    email_service: EmailService,
+    template_service: TemplateService
+) -> BulkEmailResponse:
+    """Lee el cuerpo del envío masivo (JSON o NDJSON) y envía la plantilla a cada destinatario"""
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type:
+            lines = _read_ndjson(request, digest)
+            header = await anext(lines, None)
+            if header is None:
+                raise HTTPException(status_code=400, detail="El cuerpo NDJSON está vacío")
+            bulk_request = BulkEmailRequest.model_validate(header)
+            recipients = _chain(bulk_request.recipients, lines)
+        else:
+            body = await request.body()
+            digest.update(body)
+            bulk_request = BulkEmailRequest.model_validate(json.loads(body))
+            recipients = bulk_request.recipients
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"JSON inválido: {str(e)}")
+    
+    # La plantilla se lee una sola vez para todo el envío
+    template_content = _read_template(template_service, bulk_request.template_name)
+    
+    with metrics.template_context(bulk_request.template_name):
+        return await email_service.send_bulk(bulk_request, template_content, recipients)
+
+def _read_template(template_service: TemplateService, template_name: str) -> str:
+    """Lee una plantilla midiendo la lectura; responde 404 si no existe"""
+    started = time.perf_counter()
+    try:
+        template_content = template_service.get_template_content(template_name)
+    except FileNotFoundError:
+        # Sin métrica: el nombre lo elige el cliente y no debe crear series nuevas
+        raise HTTPException(status_code=404, detail=f"Plantilla '{template_name}' no encontrada")
+    metrics.observe_stage(
+        metrics.STAGE_TEMPLATE_READ, settings.EMAIL_PROVIDER, time.perf_counter() - started, template=template_name
+    )
+    return template_content
+
+async def _read_ndjson(request: Request, digest: Optional["hashlib._Hash"] = None):
+    """
+    Lee el cuerpo de la petición línea a línea sin cargarlo completo en memoria,
+    actualizando `digest` con los bytes recibidos
+    """
+    buffer = b""
+    async for chunk in request.stream():
+        if digest is not None:
+            digest.update(chunk)
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_ndjson_line(line)
+    if buffer.strip():
+        yield _parse_ndjson_line(buffer)
+
+def _parse_ndjson_line(line: bytes) -> Any:
+    """Decodifica una línea NDJSON; las líneas inválidas se devuelven como texto para reportarlas"""
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return line.decode("utf-8", errors="replace")
+
+async def _chain(first: List[Any], rest):
+    """Encadena los destinatarios incluidos en la cabecera con los recibidos por streaming"""
+    for item in first:
+        yield item
+    async for item in rest:
+        yield item
+
+@router.get("/provider/stats")
+async def get_provider_stats(
+    email_service: EmailService = Depends(get_email_service)
+):
+    """
+    Devuelve estadísticas de las conexiones del proveedor de correo
+    (conexiones activas e inactivas del pool).
+    """
+    return email_service.get_provider_stats()
@@ -1,29 +1,57 @@
 import json
 import logging
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
 from fastapi.responses import HTMLResponse, JSONResponse
 
 from app.schemas.template import TemplateListResponse, TemplateUploadResponse, TemplatePreviewRequest
 from app.core.template_service import TemplateService
+from app.core.template_engine import MissingTemplateVariablesError
+from app.config import get_settings
 from app.api.deps import get_template_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 @router.get("/", response_model=TemplateListResponse)
 async def list_templates(
+    limit: Optional[int] = Query(None, ge=1, le=settings.CATALOG_MAX_PAGE_SIZE, description="Número máximo de resultados"),
+    prefix: Optional[str] = Query(None, description="Filtrar por prefijo del nombre"),
+    sort_by: Literal["name", "size", "mtime"] = Query("name", description="Criterio de ordenación"),
+    order: Literal["asc", "desc"] = Query("asc", description="Sentido de la ordenación"),
+    cursor: Optional[str] = Query(None, description="Cursor `next_cursor` de la página anterior"),
     template_service: TemplateService = Depends(get_template_service)
 ):
     """
     Lista todas las plantillas HTML disponibles.
+    
+    Admite paginación: con `limit` la respuesta incluye `next_cursor` mientras queden
+    resultados, que se pasa como `cursor` (con los mismos filtros) para obtener la página siguiente.
     """
     try:
-        return template_service.list_templates()
+        return template_service.list_templates(
+            limit=limit,
+            prefix=prefix,
+            sort_by=sort_by,
+            order=order,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.exception(f"Error al listar plantillas: {str(e)}")
+        logger.exception("Error al listar plantillas: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al listar plantillas: {str(e)}")
 
+@router.get("/cache/stats")
+async def get_template_cache_stats(
+    template_service: TemplateService = Depends(get_template_service)
+):
+    """
+    Devuelve las estadísticas de la caché de plantillas (aciertos, fallos y tamaño).
+    """
+    return template_service.get_cache_stats()
+
 @router.get("/{template_name}", response_class=HTMLResponse)
 async def get_template(
     template_name: str,
@@ -37,7 +65,7 @@ async def get_template(
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Plantilla '{template_name}' no encontrada")
     except Exception as e:
-        logger.exception(f"Error al obtener plantilla {template_name}: {str(e)}")
+        logger.exception("Error al obtener plantilla %s: %s", template_name, e)
         raise HTTPException(status_code=500, detail=f"Error al obtener plantilla: {str(e)}")
 
 @router.post("/upload", response_model=TemplateUploadResponse)
@@ -68,7 +96,7 @@ async def upload_template(
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error al subir plantilla: {str(e)}")
+        logger.exception("Error al subir plantilla: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al subir plantilla: {str(e)}")
 
 @router.delete("/{template_name}")
@@ -88,7 +116,7 @@ async def delete_template(
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error al eliminar plantilla {template_name}: {str(e)}")
+        logger.exception("Error al eliminar plantilla %s: %s", template_name, e)
         raise HTTPException(status_code=500, detail=f"Error al eliminar plantilla: {str(e)}")
 
 @router.post("/preview", response_class=HTMLResponse)
@@ -106,6 +134,8 @@ async def preview_template(
         )
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Plantilla '{preview_data.template_name}' no encontrada")
+    except MissingTemplateVariablesError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        logger.exception(f"Error al previsualizar plantilla: {str(e)}")
+        logger.exception("Error al previsualizar plantilla: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al previsualizar plantilla: {str(e)}")
\ No newline at end of file
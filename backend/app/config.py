@@ -12,11 +12,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 ATTACHMENTS_DIR = BASE_DIR / "attachments"
 LOGS_DIR = BASE_DIR / "logs"
+DATA_DIR = BASE_DIR / "data"
 
 # Crear directorios si no existen
 TEMPLATES_DIR.mkdir(exist_ok=True)
 ATTACHMENTS_DIR.mkdir(exist_ok=True)
 LOGS_DIR.mkdir(exist_ok=True)
+DATA_DIR.mkdir(exist_ok=True)
 
 class Settings(BaseSettings):
     # Información de la aplicación
@@ -26,11 +28,63 @@ class Settings(BaseSettings):
     DESCRIPTION: str = "Backend para envío de correos utilizando Microsoft Graph API"
     # Variables generales
     EMAIL_PROVIDER: str = os.getenv("EMAIL_PROVIDER", "titan")
+    # Enrutado entre varios proveedores/cuentas (EMAIL_PROVIDER=router)
+    # JSON con una lista de rutas, p. ej.:
+    # [{"name": "titan-1", "provider": "titan", "weight": 2, "sender_email": "...", "sender_password": "..."},
+    #  {"name": "outlook", "provider": "outlook", "weight": 1}]
+    EMAIL_ROUTES: str = os.getenv("EMAIL_ROUTES", "")
+    EMAIL_ROUTING_STRATEGY: str = "weighted"  # weighted | least_in_flight
+    ROUTING_FAILURE_THRESHOLD: int = 3  # fallos consecutivos que abren el circuito de una ruta
+    ROUTING_OPEN_SECONDS: float = 30.0  # segundos que una ruta abierta deja de recibir envíos
+    ROUTING_SLOW_CALL_SECONDS: float = 10.0  # envíos más lentos cuentan como fallo para el circuito
+    # Envíos masivos
+    BULK_SEND_BATCH_SIZE: int = 100  # mensajes entregados al proveedor en cada lote
+    # Cola persistente de envíos en segundo plano
+    QUEUE_DB_PATH: Path = DATA_DIR / "email_queue.db"
+    QUEUE_WORKERS: int = 4
+    QUEUE_MAX_ATTEMPTS: int = 5
+    QUEUE_RETRY_BASE_DELAY: float = 5.0  # segundos, se duplica en cada reintento
+    QUEUE_RETRY_MAX_DELAY: float = 300.0  # segundos
+    QUEUE_POLL_INTERVAL: float = 1.0  # segundos
+    QUEUE_LEASE_TIMEOUT: float = 60.0  # segundos sin renovarse tras los que un trabajo en curso se da por abandonado
+    QUEUE_SENT_RETENTION: float = 7 * 24 * 3600  # segundos que se conservan los trabajos enviados antes de eliminarlos
+    # Claves de idempotencia (cabecera Idempotency-Key) de los endpoints de envío
+    IDEMPOTENCY_DB_PATH: Path = DATA_DIR / "idempotency.db"
+    IDEMPOTENCY_TTL: float = 24 * 3600  # segundos que se guarda la respuesta de cada clave
+    IDEMPOTENCY_LOCK_TIMEOUT: float = 600.0  # segundos sin renovarse tras los que una clave en curso se da por abandonada
+    IDEMPOTENCY_KEY_MAX_LENGTH: int = 255
+    # Limitación de envíos por proveedor y cuenta (token bucket adaptativo)
+    RATE_LIMIT_ENABLED: bool = True
+    TITAN_RATE_LIMIT_PER_SECOND: float = 5.0
+    TITAN_RATE_LIMIT_BURST: int = 10
+    OUTLOOK_RATE_LIMIT_PER_SECOND: float = 4.0
+    OUTLOOK_RATE_LIMIT_BURST: int = 20  # cubre un lote $batch completo
+    RATE_LIMIT_MIN_FACTOR: float = 0.1  # tasa mínima tras limitaciones, fracción de la configurada
+    RATE_LIMIT_BACKOFF_FACTOR: float = 0.5  # reducción de la tasa en cada limitación
+    RATE_LIMIT_RECOVERY_STEP: float = 0.05  # fracción de la tasa configurada recuperada por envío correcto
+    RATE_LIMIT_DEFAULT_BACKOFF: float = 5.0  # segundos de pausa ante SMTP 4xx o 429 sin Retry-After
+    RATE_LIMIT_MAX_RETRIES: int = 3  # reintentos de un envío limitado por el servidor
     # Microsoft Graph API
     MS_GRAPH_ENDPOINT: str = "https://graph.microsoft.com/v1.0"
+    # Cliente HTTP compartido para Graph API
+    OUTLOOK_HTTP2: bool = True  # usa el paquete `h2` de requirements.txt
+    OUTLOOK_HTTP_MAX_CONNECTIONS: int = 20
+    OUTLOOK_HTTP_MAX_KEEPALIVE: int = 10
+    OUTLOOK_HTTP_KEEPALIVE_EXPIRY: float = 30.0  # segundos
+    OUTLOOK_HTTP_CONNECT_TIMEOUT: float = 10.0  # segundos
+    OUTLOOK_HTTP_TIMEOUT: float = 30.0  # segundos
+    # Envíos por lotes con JSON $batch de Graph API
+    OUTLOOK_BATCH_SIZE: int = 20  # peticiones sendMail por llamada a $batch (máximo de Graph: 20)
+    OUTLOOK_BATCH_MAX_BYTES: int = 3 * 1024 * 1024 + 512 * 1024  # cuerpo de cada llamada a $batch (límite de Graph: 4 MB)
+    OUTLOOK_BATCH_MAX_RETRIES: int = 3  # reintentos de las peticiones fallidas de un lote
+    OUTLOOK_BATCH_RETRY_DELAY: float = 1.0  # segundos, se duplica en cada reintento si no hay Retry-After
+    # Adjuntos grandes: se suben por bloques con sesiones de carga en lugar de contentBytes
+    OUTLOOK_LARGE_ATTACHMENT_THRESHOLD: int = 3 * 1024 * 1024  # 3 MB (límite de Graph para contentBytes)
+    OUTLOOK_UPLOAD_CHUNK_SIZE: int = 10 * 320 * 1024  # múltiplo de 320 KiB, como exige Graph
     APPLICATION_ID: str = os.getenv("APPLICATION_ID", "")
     CLIENT_SECRET: str = os.getenv("CLIENT_SECRET", "")
     TENANT_ID: str = os.getenv("TENANT_ID", "consumers")
+    MS_TOKEN_REFRESH_MARGIN: int = 300  # segundos antes de expirar en que se renueva el token
 
 
     # Titan Email
@@ -38,6 +92,18 @@ class Settings(BaseSettings):
     TITAN_SMTP_PORT: int = 587
     TITAN_SENDER_EMAIL: str = os.getenv("SENDER_EMAIL", "")
     TITAN_SENDER_PASSWORD: str = os.getenv("SENDER_PASSWORD", "")
+    TITAN_SMTP_STARTTLS: bool = True  # desactivar solo con servidores locales (relays internos, benchmarks)
+    # Pool de conexiones SMTP
+    TITAN_SMTP_POOL_SIZE: int = 5
+    TITAN_SMTP_POOL_IDLE_TIMEOUT: float = 60.0  # segundos
+    TITAN_SMTP_MAX_CONCURRENCY: int = 5  # envíos SMTP simultáneos
+    TITAN_SMTP_WARMUP_CONNECTIONS: int = 1  # sesiones abiertas al arrancar (0 desactiva)
+    # Envíos por lotes: los mensajes idénticos se entregan en un solo sobre con varios RCPT TO
+    # (con destinatarios ocultos: el encabezado To pasa a ser "undisclosed-recipients")
+    TITAN_SMTP_ENVELOPE_BATCHING: bool = False
+    TITAN_SMTP_MAX_RCPT_PER_ENVELOPE: int = 50
+    # Envíos masivos: memoria máxima para los adjuntos serializados una sola vez por lote
+    TITAN_BULK_SHARED_PARTS_MAX_BYTES: int = 32 * 1024 * 1024
 
     SCOPES: list = ["Mail.ReadWrite", "Mail.Send", "User.Read"]
     BASE_DIR: Path = BASE_DIR
@@ -46,15 +112,44 @@ class Settings(BaseSettings):
     
     # Configuración de log
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # Los logs se escriben en un hilo aparte; logs/app.log en JSON con rotación por tamaño
+    LOG_CONSOLE_FORMAT: str = "text"  # "text" o "json"
+    LOG_FILE_MAX_BYTES: int = 10 * 1024 * 1024  # 10 MB por archivo
+    LOG_FILE_BACKUP_COUNT: int = 5
+    LOG_QUEUE_MAX_SIZE: int = 10000  # registros pendientes de escribir; los que no caben se descartan
+    LOG_SAMPLE_RATE: float = 1.0  # fracción de los registros INFO por envío que se conservan (1 = todos, p. ej. 0.1 con mucho volumen)
     
     # Paths
     TEMPLATES_DIR: Path = TEMPLATES_DIR
     ATTACHMENTS_DIR: Path = ATTACHMENTS_DIR
     LOGS_DIR: Path = LOGS_DIR
+    DATA_DIR: Path = DATA_DIR
+    
+    # Plantillas
+    TEMPLATE_ESCAPE_HTML: bool = False  # escapar como HTML los valores de las variables
+    TEMPLATE_STRICT_VARIABLES: bool = False  # rechazar envíos con variables de plantilla sin valor
+    TEMPLATE_CACHE_MAX_BYTES: int = 16 * 1024 * 1024  # 16 MB
     
     # Limitaciones
     MAX_ATTACHMENT_SIZE: int = 10 * 1024 * 1024  # 10 MB
     
+    # Almacén de adjuntos pre-codificados (direccionado por SHA-256)
+    ATTACHMENT_STORE_DIR: Path = ATTACHMENTS_DIR / ".store"
+    ATTACHMENT_STORE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 64 MB
+    ATTACHMENT_STORE_RETENTION: float = 24 * 3600  # segundos sin usarse tras los que se elimina un adjunto sin archivo ni envíos pendientes
+    ATTACHMENT_STORE_GC_INTERVAL: float = 3600.0  # segundos entre limpiezas del almacén (0 desactiva)
+    
+    # Índice persistente de adjuntos y plantillas
+    CATALOG_DB_PATH: Path = DATA_DIR / "catalog.db"
+    CATALOG_SCAN_INTERVAL: float = 30.0  # segundos entre revisiones de los directorios (0 desactiva)
+    CATALOG_MAX_PAGE_SIZE: int = 1000
+    
+    # Arranque: calentamiento de proveedores y plantillas antes de declarar la aplicación lista
+    WARMUP_ENABLED: bool = True
+    WARMUP_TIMEOUT: float = 60.0  # segundos; pasado ese tiempo la aplicación se declara lista igualmente
+    # Métricas por etapa del envío (expuestas en /metrics)
+    METRICS_ENABLED: bool = True
+    
     class Config:
         case_sensitive = True
 
@@ -1,17 +1,30 @@
 import os
+import asyncio
+import hashlib
 import logging
 import mimetypes
-import base64
+import tempfile
+import threading
 from pathlib import Path
-from typing import List
+from typing import AsyncIterable, BinaryIO, Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
 
 from app.config import get_settings
+from app.core.attachment_store import StoredAttachment, get_attachment_store
+from app.core.catalog import FileCatalog
 from app.schemas.attachment import AttachmentInfo, AttachmentListResponse
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+class AttachmentTooLargeError(ValueError):
+    """Error lanzado cuando un archivo supera MAX_ATTACHMENT_SIZE"""
+    
+    def __init__(self):
+        super().__init__(f"El archivo excede el tamaño máximo permitido ({settings.MAX_ATTACHMENT_SIZE} bytes)")
+
 class AttachmentService:
     """Servicio para la gestión de archivos adjuntos"""
     
@@ -19,100 +32,275 @@ class AttachmentService:
         self.attachments_dir = settings.ATTACHMENTS_DIR
         # Asegurar que el directorio existe
         self.attachments_dir.mkdir(exist_ok=True)
+        self.store = get_attachment_store()
+        # nombre -> (mtime_ns, tamaño, identificador en el almacén de adjuntos)
+        self._attachment_ids: Dict[str, Tuple[int, int, str]] = {}
+        self._ids_lock = threading.Lock()
+        # Índice de los archivos del directorio para los listados
+        self.catalog = FileCatalog("attachments", self.attachments_dir)
+        self.catalog.start()
+    
+    def close(self) -> None:
+        """Detiene la revisión del directorio de adjuntos"""
+        self.catalog.close()
     
-    def list_attachments(self) -> AttachmentListResponse:
-        """Lista todos los archivos adjuntos disponibles"""
-        attachments = []
-        
-        for file_path in self.attachments_dir.glob("*"):
-            if file_path.is_file():
-                # Obtener tipo MIME
-                mime_type = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
-                
-                # Obtener estadísticas del archivo
-                stats = file_path.stat()
-                attachment_info = AttachmentInfo(
-                    filename=file_path.name,
-                    content_type=mime_type,
-                    size=stats.st_size,
-                    path=str(file_path.relative_to(settings.BASE_DIR))
-                )
-                attachments.append(attachment_info)
-        
-        return AttachmentListResponse(attachments=attachments)
+    def list_attachments(
+        self,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        sort_by: str = "name",
+        order: str = "asc",
+        cursor: Optional[str] = None
+    ) -> AttachmentListResponse:
+        """
+        Lista los archivos adjuntos disponibles a partir del índice
+        
+        Args:
+            limit: Número máximo de resultados (None para todos)
+            prefix: Filtrar por prefijo del nombre
+            sort_by: Criterio de ordenación (`name`, `size` o `mtime`)
+            order: `asc` o `desc`
+            cursor: Cursor devuelto por la página anterior
+        
+        Raises:
+            ValueError: Si el criterio de ordenación o el cursor no son válidos
+        """
+        page = self.catalog.query(limit=limit, prefix=prefix, sort_by=sort_by, order=order, cursor=cursor)
+        relative_dir = self.attachments_dir.relative_to(settings.BASE_DIR)
+        
+        attachments = [
+            AttachmentInfo(
+                filename=entry.name,
+                content_type=entry.content_type,
+                size=entry.size,
+                path=str(relative_dir / entry.name)
+            )
+            for entry in page.entries
+        ]
+        return AttachmentListResponse(attachments=attachments, next_cursor=page.next_cursor)
     
     def save_attachment(self, filename: str, content: bytes) -> AttachmentInfo:
         """Guarda un nuevo archivo adjunto"""
         # Verificar tamaño
         if len(content) > settings.MAX_ATTACHMENT_SIZE:
-            logger.warning(f"Archivo adjunto demasiado grande: {filename} ({len(content)} bytes)")
-            raise ValueError(f"El archivo excede el tamaño máximo permitido ({settings.MAX_ATTACHMENT_SIZE} bytes)")
+            logger.warning("Archivo adjunto demasiado grande: %s (%s bytes)", filename, len(content))
+            raise AttachmentTooLargeError()
         
         file_path = self.attachments_dir / filename
         
         try:
-            with open(file_path, "wb") as f:
-                f.write(content)
+            # Escribir en un temporal y renombrar: nunca se sobrescribe el archivo en su sitio
+            fd, tmp_path = tempfile.mkstemp(dir=self.attachments_dir, prefix=".upload-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            
+            # Guardar la versión pre-codificada en el almacén de adjuntos
+            attachment_id = self.store.put_bytes(content)
             
             # Obtener tipo MIME
             mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
             
             # Obtener estadísticas actualizadas
             stats = file_path.stat()
+            self.catalog.upsert(filename, stats)
+            self._remember_attachment_id(filename, stats, attachment_id)
             return AttachmentInfo(
                 filename=filename,
                 content_type=mime_type,
                 size=stats.st_size,
-                path=str(file_path.relative_to(settings.BASE_DIR))
+                path=str(file_path.relative_to(settings.BASE_DIR)),
+                attachment_id=attachment_id
             )
         except Exception as e:
-            logger.exception(f"Error al guardar archivo adjunto {filename}: {str(e)}")
+            logger.exception("Error al guardar archivo adjunto %s: %s", filename, e)
             raise
     
+    async def save_upload(self, filename: str, chunks: AsyncIterable[bytes]) -> AttachmentInfo:
+        """
+        Guarda un archivo subido copiándolo por bloques a un temporal según llega,
+        sin cargarlo entero en memoria. El tamaño se comprueba y el SHA-256 se
+        calcula mientras se copia, de modo que un archivo demasiado grande se
+        rechaza sin terminar de recibirlo; al terminar, el temporal se renombra
+        de forma atómica dentro de ATTACHMENTS_DIR.
+        
+        Args:
+            filename: Nombre del archivo
+            chunks: Contenido del archivo por bloques, tal como se recibe
+            
+        Returns:
+            AttachmentInfo: Información del adjunto guardado
+            
+        Raises:
+            AttachmentTooLargeError: Si el archivo supera MAX_ATTACHMENT_SIZE
+        """
+        file_path = self.attachments_dir / filename
+        digest = hashlib.sha256()
+        size = 0
+        
+        fd, tmp_path = tempfile.mkstemp(dir=self.attachments_dir, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # Los bloques de la red son pequeños: se agrupan antes de escribirlos
+                buffer = bytearray()
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > settings.MAX_ATTACHMENT_SIZE:
+                        logger.warning("Archivo adjunto demasiado grande: %s (más de %s bytes)", filename, settings.MAX_ATTACHMENT_SIZE)
+                        raise AttachmentTooLargeError()
+                    buffer += chunk
+                    if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                        # Hash y escritura fuera del event loop
+                        await asyncio.to_thread(_write_chunk, f, digest, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(_write_chunk, f, digest, bytes(buffer))
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        
+        # Guardar la versión pre-codificada en el almacén de adjuntos
+        attachment_id = digest.hexdigest()
+        await asyncio.to_thread(self.store.put_file, file_path, attachment_id)
+        
+        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        stats = file_path.stat()
+        self.catalog.upsert(filename, stats)
+        self._remember_attachment_id(filename, stats, attachment_id)
+        logger.info("Archivo adjunto guardado: %s (%s bytes)", filename, size)
+        return AttachmentInfo(
+            filename=filename,
+            content_type=mime_type,
+            size=stats.st_size,
+            path=str(file_path.relative_to(settings.BASE_DIR)),
+            attachment_id=attachment_id
+        )
+    
     def delete_attachment(self, filename: str) -> bool:
         """Elimina un archivo adjunto existente"""
         file_path = self.attachments_dir / filename
         
         if not file_path.exists():
-            logger.warning(f"Intento de eliminar archivo inexistente: {filename}")
+            logger.warning("Intento de eliminar archivo inexistente: %s", filename)
             return False
         
         try:
             file_path.unlink()
-            logger.info(f"Archivo adjunto eliminado: {filename}")
+            self.catalog.remove(filename)
+            # La copia del almacén se elimina en la siguiente limpieza, salvo que la
+            # referencien envíos encolados u otro archivo con el mismo contenido
+            with self._ids_lock:
+                known = self._attachment_ids.pop(filename, None)
+            if known:
+                self.store.release(known[2])
+            logger.info("Archivo adjunto eliminado: %s", filename)
             return True
         except Exception as e:
-            logger.exception(f"Error al eliminar archivo adjunto {filename}: {str(e)}")
+            logger.exception("Error al eliminar archivo adjunto %s: %s", filename, e)
             raise
     
-    def get_attachment_content(self, filename: str) -> bytes:
-        """Obtiene el contenido de un archivo adjunto"""
-        file_path = self.attachments_dir / filename
+    def get_attachment_file(self, filename: str) -> Tuple[StoredAttachment, os.stat_result]:
+        """
+        Obtiene la copia inmutable de un adjunto en el almacén para servirla por bloques
         
-        if not file_path.exists():
-            logger.error(f"Archivo adjunto no encontrado: {filename}")
-            raise FileNotFoundError(f"Archivo adjunto '{filename}' no encontrado")
+        Args:
+            filename: Nombre del archivo
+        
+        Returns:
+            Tuple[StoredAttachment, os.stat_result]: Adjunto en el almacén (su identificador
+            es el SHA-256 del contenido) y estadísticas de esa misma copia, de modo que
+            tamaño, fecha y contenido servidos corresponden siempre a la misma versión
+        
+        Raises:
+            FileNotFoundError: Si el archivo no existe
+        """
+        stored = self.store.get(self.get_attachment_id(filename))
+        return stored, stored.raw_path.stat()
+    
+    def get_attachment_id(self, filename: str) -> str:
+        """
+        Obtiene el identificador en el almacén de un archivo adjunto, guardándolo
+        allí la primera vez; mientras el archivo no cambie no se vuelve a leer
+        """
+        file_path = self.attachments_dir / filename
         
         try:
-            with open(file_path, "rb") as f:
-                return f.read()
-        except Exception as e:
-            logger.exception(f"Error al leer archivo adjunto {filename}: {str(e)}")
-            raise
+            stats = file_path.stat()
+        except FileNotFoundError:
+            logger.error("Archivo adjunto no encontrado: %s", filename)
+            raise FileNotFoundError(f"Archivo adjunto '{filename}' no encontrado") from None
+        
+        with self._ids_lock:
+            known = self._attachment_ids.get(filename)
+        if known and known[:2] == (stats.st_mtime_ns, stats.st_size):
+            # El almacén pudo eliminar su copia en una limpieza: se recupera del archivo
+            return known[2] if self.store.exists(known[2]) else self.store.put_file(file_path, known[2])
+        
+        attachment_id = self.store.put_file(file_path)
+        self._remember_attachment_id(filename, stats, attachment_id)
+        return attachment_id
+    
+    def collect_store(self, referenced: Iterable[str] = ()) -> int:
+        """
+        Elimina del almacén los adjuntos que llevan más de ATTACHMENT_STORE_RETENTION
+        segundos sin usarse y no corresponden a ningún archivo del directorio ni a
+        `referenced` (adjuntos de envíos encolados sin terminar)
+        
+        Returns:
+            int: Número de adjuntos eliminados
+        """
+        keep = set(referenced)
+        with os.scandir(self.attachments_dir) as entries:
+            for entry in entries:
+                # Los nombres con punto son el almacén y los temporales de subida
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                try:
+                    keep.add(self._file_attachment_id(entry.name))
+                except FileNotFoundError:
+                    continue
+        return self.store.collect(keep, settings.ATTACHMENT_STORE_RETENTION)
+    
+    def _file_attachment_id(self, filename: str) -> str:
+        """SHA-256 de un archivo del directorio, sin copiarlo al almacén"""
+        file_path = self.attachments_dir / filename
+        stats = file_path.stat()
+        with self._ids_lock:
+            known = self._attachment_ids.get(filename)
+        if known and known[:2] == (stats.st_mtime_ns, stats.st_size):
+            return known[2]
+        attachment_id = self.store.hash_file(file_path)
+        self._remember_attachment_id(filename, stats, attachment_id)
+        return attachment_id
+    
+    def _remember_attachment_id(self, filename: str, stats: os.stat_result, attachment_id: str) -> None:
+        with self._ids_lock:
+            self._attachment_ids[filename] = (stats.st_mtime_ns, stats.st_size, attachment_id)
     
     def get_attachment_as_base64(self, filename: str) -> str:
         """Obtiene el contenido de un archivo adjunto en formato Base64"""
-        content = self.get_attachment_content(filename)
-        return base64.b64encode(content).decode('utf-8')
+        return self.store.get_base64(self.get_attachment_id(filename))
     
     def create_attachment_dict(self, filename: str) -> dict:
         """Crea un diccionario con la información del adjunto para Microsoft Graph API"""
-        content = self.get_attachment_content(filename)
         mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
         
         return {
             '@odata.type': '#microsoft.graph.fileAttachment',
             'name': filename,
             'contentType': mime_type,
-            'contentBytes': base64.b64encode(content).decode('utf-8')
-        }
\ No newline at end of file
+            'contentBytes': self.get_attachment_as_base64(filename)
+        }
+
+def _write_chunk(f: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+    """Actualiza el hash y escribe un bloque de una subida"""
+    digest.update(chunk)
+    f.write(chunk)
@@ -0,0 +1,332 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# base64 MIME: líneas de 76 caracteres, que codifican 57 bytes cada una.
+# Leer el archivo en múltiplos de 57 bytes permite codificarlo por bloques
+# sin romper el ajuste de línea.
+_MIME_LINE_BYTES = 57
+_ENCODE_CHUNK_SIZE = _MIME_LINE_BYTES * 16 * 1024
+_HASH_CHUNK_SIZE = 1024 * 1024
+_ATTACHMENT_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class StoredAttachment(NamedTuple):
+    """Adjunto guardado en el almacén"""
+    attachment_id: str
+    size: int
+    raw_path: Path
+    encoded_path: Path
+
+class AttachmentStore:
+    """
+    Almacén de adjuntos direccionado por contenido (SHA-256).
+    
+    Cada adjunto se guarda una sola vez en bruto y ya codificado en base64 MIME
+    (líneas de 76 caracteres), de modo que los envíos lo referencian por su
+    identificador sin volver a leerlo ni codificarlo. Las versiones codificadas
+    más usadas se mantienen además en una caché LRU en memoria.
+    
+    La fecha de modificación de cada adjunto marca su último uso: volver a
+    guardarlo la renueva, y `collect` elimina los que llevan demasiado tiempo
+    sin usarse y nadie referencia (adjuntos en línea, archivos eliminados).
+    """
+    
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root or settings.ATTACHMENT_STORE_DIR)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.cache_max_bytes = settings.ATTACHMENT_STORE_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        # Evita que la limpieza elimine un adjunto mientras se reutiliza
+        self._gc_lock = threading.Lock()
+        self._encoded_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._encoded_cache_bytes = 0
+        # Huella del base64 recibido en línea -> identificador, para no decodificarlo de nuevo
+        self._inline_ids: "OrderedDict[bytes, str]" = OrderedDict()
+    
+    def put_bytes(self, content: bytes) -> str:
+        """
+        Guarda un contenido en el almacén si no existe
+        
+        Args:
+            content: Contenido en bruto
+        
+        Returns:
+            str: Identificador del adjunto (SHA-256 del contenido)
+        """
+        attachment_id = hashlib.sha256(content).hexdigest()
+        raw_path, encoded_path = self._paths(attachment_id)
+        if not self._reuse(attachment_id):
+            raw_path.parent.mkdir(exist_ok=True)
+            self._write_atomic(raw_path, lambda f: f.write(content))
+            self._write_atomic(encoded_path, lambda f: f.write(base64.encodebytes(content)))
+        return attachment_id
+    
+    def put_base64(self, content_b64: str) -> str:
+        """
+        Guarda un adjunto recibido en base64 (por ejemplo, en línea en un `EmailRequest`)
+        
+        Args:
+            content_b64: Contenido codificado en base64
+        
+        Returns:
+            str: Identificador del adjunto
+        """
+        fingerprint = hashlib.blake2b(content_b64.encode("ascii", errors="ignore"), digest_size=20).digest()
+        with self._lock:
+            attachment_id = self._inline_ids.get(fingerprint)
+            if attachment_id:
+                self._inline_ids.move_to_end(fingerprint)
+        if attachment_id and self._reuse(attachment_id):
+            return attachment_id
+        
+        attachment_id = self.put_bytes(base64.b64decode(content_b64))
+        with self._lock:
+            self._inline_ids[fingerprint] = attachment_id
+            if len(self._inline_ids) > 1024:
+                self._inline_ids.popitem(last=False)
+        return attachment_id
+    
+    def put_file(self, file_path: Path, attachment_id: Optional[str] = None) -> str:
+        """
+        Guarda un archivo en el almacén leyéndolo por bloques
+        
+        Args:
+            file_path: Archivo a guardar
+            attachment_id: SHA-256 del archivo si ya se conoce
+        
+        Returns:
+            str: Identificador del adjunto
+        """
+        if attachment_id is None:
+            attachment_id = self.hash_file(file_path)
+        raw_path, encoded_path = self._paths(attachment_id)
+        if self._reuse(attachment_id):
+            return attachment_id
+        
+        raw_path.parent.mkdir(exist_ok=True)
+        if not raw_path.exists():
+            # Copia propia: el original puede sobrescribirse o eliminarse más tarde
+            self._write_atomic(raw_path, lambda f: self._copy_file(file_path, f))
+        self._write_atomic(encoded_path, lambda f: self._encode_file(raw_path, f))
+        return attachment_id
+    
+    def exists(self, attachment_id: str) -> bool:
+        """Indica si un adjunto está en el almacén"""
+        if not _ATTACHMENT_ID_RE.match(attachment_id):
+            return False
+        return self._paths(attachment_id)[1].exists()
+    
+    def get(self, attachment_id: str) -> StoredAttachment:
+        """
+        Obtiene la información de un adjunto del almacén
+        
+        Raises:
+            FileNotFoundError: Si el adjunto no existe
+        """
+        if not _ATTACHMENT_ID_RE.match(attachment_id):
+            raise FileNotFoundError(f"Adjunto '{attachment_id}' no encontrado")
+        raw_path, encoded_path = self._paths(attachment_id)
+        try:
+            size = raw_path.stat().st_size
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Adjunto '{attachment_id}' no encontrado") from None
+        return StoredAttachment(attachment_id, size, raw_path, encoded_path)
+    
+    def open_raw(self, attachment_id: str) -> BinaryIO:
+        """Abre el contenido en bruto de un adjunto para leerlo por bloques"""
+        return open(self.get(attachment_id).raw_path, "rb")
+    
+    def get_mime_base64(self, attachment_id: str) -> str:
+        """
+        Obtiene el adjunto codificado en base64 MIME (líneas de 76 caracteres)
+        
+        Args:
+            attachment_id: Identificador del adjunto
+        
+        Returns:
+            str: Contenido codificado, listo como payload de una parte MIME
+        """
+        with self._lock:
+            encoded = self._encoded_cache.get(attachment_id)
+            if encoded is not None:
+                self._encoded_cache.move_to_end(attachment_id)
+                return encoded
+        
+        stored = self.get(attachment_id)
+        encoded = stored.encoded_path.read_text(encoding="ascii")
+        self._cache_encoded(attachment_id, encoded)
+        return encoded
+    
+    def get_base64(self, attachment_id: str) -> str:
+        """Obtiene el adjunto en base64 sin saltos de línea (por ejemplo, `contentBytes` de Graph API)"""
+        return self.get_mime_base64(attachment_id).replace("\n", "")
+    
+    def iter_mime_base64(self, attachment_id: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Recorre el adjunto codificado en base64 MIME por bloques, sin cargarlo en memoria
+        (si ya está en la caché se recorre la copia en memoria)
+        
+        Args:
+            attachment_id: Identificador del adjunto
+            chunk_size: Tamaño aproximado de cada bloque en bytes
+        """
+        with self._lock:
+            encoded = self._encoded_cache.get(attachment_id)
+        if encoded is not None:
+            for start in range(0, len(encoded), chunk_size):
+                yield encoded[start:start + chunk_size].encode("ascii")
+            return
+        
+        stored = self.get(attachment_id)
+        with open(stored.encoded_path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    
+    def release(self, attachment_id: str) -> None:
+        """Marca un adjunto como sin uso: la siguiente limpieza lo elimina si nada lo referencia"""
+        if not _ATTACHMENT_ID_RE.match(attachment_id):
+            return
+        with self._gc_lock:
+            try:
+                os.utime(self._paths(attachment_id)[0], (0, 0))
+            except FileNotFoundError:
+                pass
+    
+    def collect(self, keep: Iterable[str], max_age: float) -> int:
+        """
+        Elimina los adjuntos que llevan más de `max_age` segundos sin usarse,
+        salvo los indicados en `keep` (archivos existentes, envíos pendientes)
+        
+        Args:
+            keep: Identificadores que deben conservarse
+            max_age: Segundos sin usarse tras los que se elimina un adjunto
+        
+        Returns:
+            int: Número de adjuntos eliminados
+        """
+        keep = set(keep)
+        cutoff = time.time() - max_age
+        removed = 0
+        for directory in self.root.iterdir():
+            if not directory.is_dir():
+                continue
+            for raw_path in directory.iterdir():
+                attachment_id = raw_path.name
+                if not _ATTACHMENT_ID_RE.match(attachment_id) or attachment_id in keep:
+                    continue
+                with self._gc_lock:
+                    try:
+                        if raw_path.stat().st_mtime > cutoff:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    for path in self._paths(attachment_id):
+                        try:
+                            path.unlink()
+                        except FileNotFoundError:
+                            pass
+                self._forget(attachment_id)
+                removed += 1
+        return removed
+    
+    @staticmethod
+    def hash_file(file_path: Path) -> str:
+        """Calcula el SHA-256 de un archivo leyéndolo por bloques"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(_HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _paths(self, attachment_id: str):
+        directory = self.root / attachment_id[:2]
+        return directory / attachment_id, directory / f"{attachment_id}.b64"
+    
+    def _reuse(self, attachment_id: str) -> bool:
+        """Si el adjunto ya está guardado, renueva su fecha de último uso y devuelve True"""
+        raw_path, encoded_path = self._paths(attachment_id)
+        with self._gc_lock:
+            if not encoded_path.exists():
+                return False
+            try:
+                os.utime(raw_path)
+            except FileNotFoundError:
+                return False
+        return True
+    
+    def _forget(self, attachment_id: str) -> None:
+        """Quita de las cachés en memoria un adjunto eliminado del almacén"""
+        with self._lock:
+            encoded = self._encoded_cache.pop(attachment_id, None)
+            if encoded is not None:
+                self._encoded_cache_bytes -= len(encoded)
+            for fingerprint in [key for key, value in self._inline_ids.items() if value == attachment_id]:
+                del self._inline_ids[fingerprint]
+    
+    def _cache_encoded(self, attachment_id: str, encoded: str) -> None:
+        size = len(encoded)
+        if size > self.cache_max_bytes:
+            return
+        with self._lock:
+            if attachment_id in self._encoded_cache:
+                return
+            self._encoded_cache[attachment_id] = encoded
+            self._encoded_cache_bytes += size
+            while self._encoded_cache_bytes > self.cache_max_bytes:
+                _, evicted = self._encoded_cache.popitem(last=False)
+                self._encoded_cache_bytes -= len(evicted)
+    
+    @staticmethod
+    def _write_atomic(target: Path, write) -> None:
+        """Escribe un archivo del almacén a través de un temporal renombrado al final"""
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+    
+    @staticmethod
+    def _copy_file(source: Path, destination: BinaryIO) -> None:
+        with open(source, "rb") as f:
+            shutil.copyfileobj(f, destination, _HASH_CHUNK_SIZE)
+    
+    @staticmethod
+    def _encode_file(source: Path, destination: BinaryIO) -> None:
+        with open(source, "rb") as f:
+            while True:
+                chunk = f.read(_ENCODE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                destination.write(base64.encodebytes(chunk))
+
+@lru_cache()
+def get_attachment_store() -> AttachmentStore:
+    """Devuelve el almacén de adjuntos compartido por los servicios y proveedores"""
+    return AttachmentStore()
@@ -0,0 +1,289 @@
+import base64
+import json
+import logging
+import mimetypes
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Columna de ordenación de cada criterio admitido en los listados
+SORT_COLUMNS = {
+    "name": "name",
+    "size": "size",
+    "mtime": "mtime_ns",
+}
+
+# Carácter mayor que cualquier otro: cota superior del filtro por prefijo
+_MAX_CHAR = "\U0010ffff"
+
+class CatalogEntry(NamedTuple):
+    """Archivo registrado en el catálogo"""
+    name: str
+    size: int
+    mtime_ns: int
+    content_type: str
+
+class CatalogPage(NamedTuple):
+    """Página de resultados de un listado"""
+    entries: List[CatalogEntry]
+    next_cursor: Optional[str]
+
+class FileCatalog:
+    """
+    Índice persistente (SQLite) de los archivos de un directorio.
+    
+    Los listados se resuelven con consultas indexadas en lugar de recorrer el
+    directorio y hacer `stat()` de cada archivo en cada petición. El índice se
+    actualiza desde los servicios al guardar o eliminar archivos y un hilo de
+    fondo revisa periódicamente el directorio para recoger los cambios hechos
+    por fuera de la API.
+    """
+    
+    def __init__(self, catalog: str, directory: Path, suffix: str = "", db_path: Optional[Path] = None):
+        """
+        Args:
+            catalog: Nombre del catálogo (varios catálogos comparten la base de datos)
+            directory: Directorio indexado
+            suffix: Extensión de los archivos indexados (vacío para todos)
+            db_path: Ruta de la base de datos
+        """
+        self.catalog = catalog
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.db_path = Path(db_path or settings.CATALOG_DB_PATH)
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._init_db()
+        
+        self._stop_watcher = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+    
+    def _init_db(self) -> None:
+        """Crea el esquema del catálogo si no existe"""
+        with self._db_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS catalog_files (
+                    catalog TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    content_type TEXT NOT NULL,
+                    PRIMARY KEY (catalog, name)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_catalog_files_size ON catalog_files (catalog, size, name)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_catalog_files_mtime ON catalog_files (catalog, mtime_ns, name)"
+            )
+    
+    def start(self, scan_interval: Optional[float] = None) -> None:
+        """
+        Sincroniza el índice con el directorio y arranca la revisión periódica
+        
+        Args:
+            scan_interval: Segundos entre revisiones (0 para no revisar)
+        """
+        changes = self.sync()
+        if changes:
+            logger.info("Catálogo '%s' sincronizado: %s cambios", self.catalog, changes)
+        
+        interval = settings.CATALOG_SCAN_INTERVAL if scan_interval is None else scan_interval
+        if interval > 0 and self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch,
+                args=(interval,),
+                name=f"catalog-{self.catalog}-watcher",
+                daemon=True
+            )
+            self._watcher.start()
+    
+    def close(self) -> None:
+        """Detiene la revisión periódica y cierra la base de datos"""
+        self._stop_watcher.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+        with self._db_lock:
+            self._conn.close()
+    
+    def upsert(self, name: str, stats: os.stat_result) -> None:
+        """Registra o actualiza un archivo del directorio"""
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalog_files (catalog, name, size, mtime_ns, content_type) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.catalog, name, stats.st_size, stats.st_mtime_ns, _guess_type(name))
+            )
+    
+    def remove(self, name: str) -> None:
+        """Elimina un archivo del índice"""
+        with self._db_lock:
+            self._conn.execute(
+                "DELETE FROM catalog_files WHERE catalog = ? AND name = ?",
+                (self.catalog, name)
+            )
+    
+    def sync(self) -> int:
+        """
+        Reconcilia el índice con el contenido actual del directorio
+        
+        Returns:
+            int: Número de archivos añadidos, actualizados o eliminados
+        """
+        on_disk: Dict[str, os.stat_result] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Se ignoran los ocultos (temporales de subidas, almacén de adjuntos...)
+                if entry.name.startswith(".") or not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    if entry.is_file():
+                        on_disk[entry.name] = entry.stat()
+                except FileNotFoundError:
+                    continue
+        
+        with self._db_lock:
+            indexed = {
+                name: (size, mtime_ns)
+                for name, size, mtime_ns in self._conn.execute(
+                    "SELECT name, size, mtime_ns FROM catalog_files WHERE catalog = ?",
+                    (self.catalog,)
+                )
+            }
+            changed = [
+                (self.catalog, name, stats.st_size, stats.st_mtime_ns, _guess_type(name))
+                for name, stats in on_disk.items()
+                if indexed.get(name) != (stats.st_size, stats.st_mtime_ns)
+            ]
+            removed = [(self.catalog, name) for name in indexed.keys() - on_disk.keys()]
+            if not changed and not removed:
+                return 0
+            
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO catalog_files (catalog, name, size, mtime_ns, content_type) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    changed
+                )
+                self._conn.executemany(
+                    "DELETE FROM catalog_files WHERE catalog = ? AND name = ?",
+                    removed
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(changed) + len(removed)
+    
+    def query(
+        self,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        sort_by: str = "name",
+        order: str = "asc",
+        cursor: Optional[str] = None
+    ) -> CatalogPage:
+        """
+        Lista los archivos del índice con paginación por cursor
+        
+        Args:
+            limit: Número máximo de resultados (None para todos)
+            prefix: Filtrar por prefijo del nombre
+            sort_by: Criterio de ordenación (`name`, `size` o `mtime`)
+            order: `asc` o `desc`
+            cursor: Cursor devuelto por la página anterior
+        
+        Returns:
+            CatalogPage: Resultados y cursor de la página siguiente (None si no hay más)
+        
+        Raises:
+            ValueError: Si el criterio de ordenación o el cursor no son válidos
+        """
+        column = SORT_COLUMNS.get(sort_by)
+        if column is None:
+            raise ValueError(f"Criterio de ordenación no válido: {sort_by}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Orden no válido: {order}")
+        
+        sql = "SELECT name, size, mtime_ns, content_type FROM catalog_files WHERE catalog = ?"
+        params: List[Any] = [self.catalog]
+        
+        if prefix:
+            # Rango sobre el nombre: aprovecha el índice y no interpreta comodines
+            sql += " AND name >= ? AND name < ?"
+            params += [prefix, prefix + _MAX_CHAR]
+        
+        # Paginación por clave: se continúa tras el último (valor, nombre) devuelto
+        comparison = ">" if order == "asc" else "<"
+        if cursor:
+            value, name = _decode_cursor(cursor, sort_by)
+            if column == "name":
+                sql += f" AND name {comparison} ?"
+                params.append(name)
+            else:
+                sql += f" AND ({column}, name) {comparison} (?, ?)"
+                params += [value, name]
+        
+        direction = order.upper()
+        if column == "name":
+            sql += f" ORDER BY name {direction}"
+        else:
+            sql += f" ORDER BY {column} {direction}, name {direction}"
+        if limit is not None:
+            # Se pide uno más para saber si hay página siguiente
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        
+        entries = [CatalogEntry(*row) for row in rows]
+        next_cursor = None
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            last = entries[-1]
+            next_cursor = _encode_cursor(sort_by, getattr(last, column), last.name)
+        return CatalogPage(entries, next_cursor)
+    
+    def _watch(self, interval: float) -> None:
+        """Revisa periódicamente el directorio en busca de cambios hechos fuera de la API"""
+        while not self._stop_watcher.wait(interval):
+            try:
+                changes = self.sync()
+                if changes:
+                    logger.info("Catálogo '%s': %s cambios detectados en %s", self.catalog, changes, self.directory)
+            except Exception:
+                logger.exception("Error al sincronizar el catálogo '%s'", self.catalog)
+
+def _guess_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+def _encode_cursor(sort_by: str, value: Any, name: str) -> str:
+    raw = json.dumps([sort_by, value, name], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str, sort_by: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort_by, value, name = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor no válido") from None
+    if cursor_sort_by != sort_by or not isinstance(name, str):
+        raise ValueError("El cursor no corresponde a este listado")
+    return value, name
@@ -1,9 +1,19 @@
 import logging
-from typing import List, Dict, Any, Optional
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Union, Iterable, AsyncIterable
+
+from pydantic import ValidationError
 
 from app.config import get_settings
-from app.schemas.email import EmailRequest, EmailResponse
+from app.logging_config import SAMPLED
+from app.schemas.email import (
+    EmailRequest, EmailResponse, EmailRecipient, BulkEmailRequest, BulkEmailResponse,
+    BulkRecipient, BulkRecipientResult
+)
+from app.core import metrics
 from app.core.providers import get_email_provider
+from app.core.template_engine import MissingTemplateVariablesError, register_template
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -17,7 +27,26 @@ class EmailService:
     def __init__(self):
         # Obtener el proveedor de correo configurado
         self.provider = get_email_provider()
-        logger.info(f"Servicio de correo inicializado con proveedor: {settings.EMAIL_PROVIDER}")
+        logger.info("Servicio de correo inicializado con proveedor: %s", settings.EMAIL_PROVIDER)
+    
+    async def startup(self) -> None:
+        """Inicializa los recursos del proveedor de correo"""
+        await self.provider.startup()
+    
+    async def warm_up(self) -> None:
+        """Prepara el proveedor de correo para los primeros envíos"""
+        await self.provider.warm_up()
+    
+    async def shutdown(self) -> None:
+        """Libera los recursos del proveedor de correo"""
+        await self.provider.shutdown()
+    
+    def get_provider_stats(self) -> Dict[str, Any]:
+        """Devuelve las estadísticas de conexiones del proveedor"""
+        return {
+            "provider": settings.EMAIL_PROVIDER,
+            "stats": self.provider.get_stats()
+        }
     
     async def send_email(self, email_data: EmailRequest) -> EmailResponse:
         """
@@ -29,22 +58,158 @@ class EmailService:
         Returns:
             EmailResponse: Resultado del envío
         """
+        started = time.perf_counter()
         try:
-            logger.info(f"Preparando correo con asunto: {email_data.subject}")
+            logger.info("Preparando correo con asunto: %s", email_data.subject, extra=SAMPLED)
             
             # Delegar el envío al proveedor específico
             result = await self.provider.send_email(email_data)
+            metrics.observe_send(settings.EMAIL_PROVIDER, result.success, time.perf_counter() - started)
             
             if result.success:
-                logger.info(f"Correo enviado exitosamente mediante proveedor: {settings.EMAIL_PROVIDER}")
+                logger.info("Correo enviado exitosamente mediante proveedor: %s", settings.EMAIL_PROVIDER, extra=SAMPLED)
             else:
-                logger.error(f"Error al enviar correo: {result.message}")
+                logger.error("Error al enviar correo: %s", result.message)
             
             return result
         
         except Exception as e:
-            logger.exception(f"Error inesperado al enviar correo: {str(e)}")
+            metrics.observe_send(settings.EMAIL_PROVIDER, False, time.perf_counter() - started)
+            logger.exception("Error inesperado al enviar correo: %s", e)
             return EmailResponse(
                 success=False,
                 message=f"Error inesperado al enviar correo: {str(e)}"
-            )
\ No newline at end of file
+            )
+    
+    async def send_bulk(
+        self,
+        bulk_request: BulkEmailRequest,
+        template_content: str,
+        recipients: Union[Iterable[Any], AsyncIterable[Any]]
+    ) -> BulkEmailResponse:
+        """
+        Envía una misma plantilla a muchos destinatarios personalizando las variables de cada uno.
+        Los destinatarios se entregan al proveedor en lotes de `BULK_SEND_BATCH_SIZE`,
+        de modo que la plantilla, los adjuntos y las conexiones se reutilizan en todo el envío.
+        
+        Args:
+            bulk_request: Datos comunes del envío (plantilla, asunto, adjuntos)
+            template_content: Contenido de la plantilla ya leído
+            recipients: Destinatarios (`BulkRecipient` o diccionarios), síncronos o asíncronos
+            
+        Returns:
+            BulkEmailResponse: Identificador del trabajo y resultado por destinatario
+        """
+        job_id = uuid.uuid4().hex
+        # Registrada durante todo el envío: cada mensaje reutiliza esta compilación
+        # aunque la plantilla no quepa en la caché de TemplateService
+        compiled = register_template(template_content)
+        batch_size = max(1, settings.BULK_SEND_BATCH_SIZE)
+        logger.info("Iniciando envío masivo %s con plantilla: %s", job_id, bulk_request.template_name)
+        
+        # Los resultados conservan el orden de entrada aunque los inválidos se resuelvan antes
+        results: List[Optional[BulkRecipientResult]] = []
+        batch: List[EmailRequest] = []
+        batch_positions: List[int] = []
+        
+        async def flush() -> None:
+            try:
+                responses = list(await self.provider.send_batch(batch))
+            except Exception as e:
+                # El lote completo falla, pero el resto del envío continúa
+                logger.exception("Error inesperado al enviar un lote del envío masivo %s: %s", job_id, e)
+                responses = [
+                    EmailResponse(success=False, message=f"Error inesperado al enviar correo: {str(e)}")
+                    for _ in batch
+                ]
+            # Mensajes sin respuesta del proveedor: se cuentan como fallidos
+            missing = EmailResponse(success=False, message="Error al enviar correo: el proveedor no devolvió resultado")
+            responses += [None] * (len(batch) - len(responses))
+            for position, message, response in zip(batch_positions, batch, responses):
+                response = response or missing
+                results[position] = BulkRecipientResult(
+                    email=message.to_recipients[0].email,
+                    success=response.success,
+                    message=response.message,
+                    email_id=response.email_id
+                )
+            batch.clear()
+            batch_positions.clear()
+        
+        async for recipient in _iterate(recipients):
+            try:
+                if not isinstance(recipient, BulkRecipient):
+                    recipient = BulkRecipient.model_validate(recipient)
+            except ValidationError as e:
+                email = recipient.get("email", "") if isinstance(recipient, dict) else ""
+                results.append(BulkRecipientResult(
+                    email=str(email),
+                    success=False,
+                    message=f"Destinatario inválido: {e.errors()[0]['msg']}"
+                ))
+                continue
+            
+            message = self._build_bulk_message(bulk_request, template_content, recipient)
+            if settings.TEMPLATE_STRICT_VARIABLES:
+                missing = compiled.missing_variables(message.template_variables)
+                if missing:
+                    results.append(BulkRecipientResult(
+                        email=recipient.email,
+                        success=False,
+                        message=str(MissingTemplateVariablesError(missing))
+                    ))
+                    continue
+            
+            batch_positions.append(len(results))
+            results.append(None)
+            batch.append(message)
+            if len(batch) >= batch_size:
+                await flush()
+        
+        if batch:
+            await flush()
+        
+        sent = sum(1 for result in results if result.success)
+        for result in results:
+            metrics.observe_send(settings.EMAIL_PROVIDER, result.success, template=bulk_request.template_name)
+        logger.info("Envío masivo %s finalizado: %d enviados, %d fallidos", job_id, sent, len(results) - sent)
+        
+        return BulkEmailResponse(
+            job_id=job_id,
+            total=len(results),
+            sent=sent,
+            failed=len(results) - sent,
+            results=results
+        )
+    
+    def _build_bulk_message(
+        self,
+        bulk_request: BulkEmailRequest,
+        template_content: str,
+        recipient: BulkRecipient
+    ) -> EmailRequest:
+        """Crea el correo de un destinatario combinando las variables comunes con las suyas"""
+        variables = dict(bulk_request.template_variables or {})
+        if recipient.template_variables:
+            variables.update(recipient.template_variables)
+        
+        # La plantilla se envía sin renderizar: el proveedor aplica las variables una sola vez
+        return EmailRequest(
+            subject=bulk_request.subject,
+            body=template_content,
+            body_type="HTML",
+            to_recipients=[EmailRecipient(email=recipient.email, name=recipient.name)],
+            importance=bulk_request.importance,
+            attachments=bulk_request.attachments,
+            save_to_sent_items=bulk_request.save_to_sent_items,
+            template_variables=variables or None
+        )
+
+async def _iterate(items: Union[Iterable[Any], AsyncIterable[Any]]):
+    """Recorre de forma uniforme iterables síncronos y asíncronos"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
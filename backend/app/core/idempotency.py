@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+from typing import Any, AsyncIterator, NamedTuple, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Estados de una clave de idempotencia
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+
+# Segundos entre purgas de claves expiradas
+_PURGE_INTERVAL = 60.0
+
+class IdempotencyConflictError(Exception):
+    """La clave ya se está usando en una petición que todavía no ha terminado"""
+
+class IdempotencyMismatchError(ValueError):
+    """La clave ya se usó con una petición distinta"""
+
+class StoredResponse(NamedTuple):
+    """Respuesta guardada de una petición completada"""
+    status_code: int
+    body: Any
+
+def hash_request(payload: Any) -> str:
+    """
+    Calcula la huella de una petición a partir de su contenido serializado en
+    JSON canónico (claves ordenadas)
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    """
+    Almacén persistente (SQLite) de claves `Idempotency-Key`.
+    
+    Cada clave se registra con la huella de la petición al empezar a procesarla
+    y con la respuesta al terminar. Un reintento con la misma clave y la misma
+    petición recibe la respuesta guardada sin volver a enviar el correo; con una
+    petición distinta se rechaza. Las claves expiran a los IDEMPOTENCY_TTL
+    segundos. Mientras se procesa la petición la reserva se renueva (`hold`);
+    solo las que dejan de renovarse (proceso detenido a mitad de un envío)
+    pueden reutilizarse pasados IDEMPOTENCY_LOCK_TIMEOUT segundos.
+    """
+    
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path or settings.IDEMPOTENCY_DB_PATH)
+        self.ttl = settings.IDEMPOTENCY_TTL
+        self.lock_timeout = settings.IDEMPOTENCY_LOCK_TIMEOUT
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._init_db()
+        self._last_purge = 0.0
+    
+    def _init_db(self) -> None:
+        """Crea el esquema del almacén si no existe"""
+        with self._db_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    request_hash TEXT,
+                    status TEXT NOT NULL,
+                    status_code INTEGER,
+                    response TEXT,
+                    created_at REAL NOT NULL,  -- reserva o última renovación mientras está en curso
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (scope, key)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)"
+            )
+    
+    def close(self) -> None:
+        """Cierra la base de datos"""
+        with self._db_lock:
+            self._conn.close()
+    
+    async def begin(self, scope: str, key: str, request_hash: Optional[str]) -> Optional[StoredResponse]:
+        """
+        Reserva una clave antes de procesar la petición
+        
+        Args:
+            scope: Endpoint al que pertenece la clave
+            key: Valor de la cabecera `Idempotency-Key`
+            request_hash: Huella de la petición (None si solo se conoce al terminar,
+                como en los envíos masivos por streaming)
+        
+        Returns:
+            Optional[StoredResponse]: Respuesta guardada si la clave ya se completó
+            (la petición no debe procesarse de nuevo); None si se ha reservado
+        
+        Raises:
+            IdempotencyConflictError: Si otra petición con la clave sigue en curso
+            IdempotencyMismatchError: Si la clave se usó con una petición distinta
+        """
+        return await asyncio.to_thread(self._begin, scope, key, request_hash)
+    
+    @asynccontextmanager
+    async def hold(self, scope: str, key: str) -> AsyncIterator[None]:
+        """
+        Mantiene reservada una clave mientras se ejecuta el bloque. La reserva se
+        renueva cada tercio de IDEMPOTENCY_LOCK_TIMEOUT, de modo que un envío largo
+        (un envío masivo limitado por el proveedor) no se da por abandonado y un
+        reintento no puede quedarse con la clave mientras sigue en curso.
+        
+        Example:
+            async with idempotency_store.hold(scope, key):
+                result = await send()
+        """
+        renewal = asyncio.create_task(self._renew_periodically(scope, key))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            with suppress(asyncio.CancelledError):
+                await renewal
+    
+    async def complete(
+        self,
+        scope: str,
+        key: str,
+        status_code: int,
+        body: Any,
+        request_hash: Optional[str] = None
+    ) -> None:
+        """
+        Guarda la respuesta de una petición reservada con `begin`
+        
+        Args:
+            scope: Endpoint al que pertenece la clave
+            key: Valor de la cabecera `Idempotency-Key`
+            status_code: Código HTTP de la respuesta
+            body: Cuerpo de la respuesta (serializable en JSON)
+            request_hash: Huella de la petición, si no se indicó en `begin`
+        """
+        response = json.dumps(body, ensure_ascii=False, default=str)
+        await asyncio.to_thread(self._complete, scope, key, status_code, response, request_hash)
+    
+    async def release(self, scope: str, key: str) -> None:
+        """Libera una clave reservada cuya petición falló, para que pueda reintentarse"""
+        await asyncio.to_thread(self._release, scope, key)
+    
+    async def check_replay(self, scope: str, key: str, request_hash: str) -> None:
+        """
+        Comprueba que una petición repetida coincide con la original
+        
+        Raises:
+            IdempotencyMismatchError: Si la clave se usó con una petición distinta
+        """
+        row = await asyncio.to_thread(self._fetch, scope, key)
+        if row is not None and row[0] is not None and row[0] != request_hash:
+            raise IdempotencyMismatchError("La clave de idempotencia ya se usó con una petición distinta")
+    
+    def _begin(self, scope: str, key: str, request_hash: Optional[str]) -> Optional[StoredResponse]:
+        now = time.time()
+        self._purge_expired(now)
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT request_hash, status, status_code, response, created_at, expires_at "
+                    "FROM idempotency_keys WHERE scope = ? AND key = ?",
+                    (scope, key)
+                ).fetchone()
+                
+                if row is not None and row[5] > now:
+                    stored_hash, status, status_code, response, created_at, _ = row
+                    if request_hash is not None and stored_hash is not None and stored_hash != request_hash:
+                        raise IdempotencyMismatchError("La clave de idempotencia ya se usó con una petición distinta")
+                    if status == STATUS_COMPLETED:
+                        self._conn.execute("COMMIT")
+                        return StoredResponse(status_code, json.loads(response))
+                    if now - created_at < self.lock_timeout:
+                        raise IdempotencyConflictError("Hay una petición con la misma clave de idempotencia en curso")
+                    logger.warning("Clave de idempotencia abandonada en curso, se reutiliza: %s", key)
+                
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys "
+                    "(scope, key, request_hash, status, status_code, response, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, NULL, NULL, ?, ?)",
+                    (scope, key, request_hash, STATUS_IN_PROGRESS, now, now + self.ttl)
+                )
+                self._conn.execute("COMMIT")
+                return None
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    async def _renew_periodically(self, scope: str, key: str) -> None:
+        interval = max(self.lock_timeout / 3, 0.1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._renew, scope, key)
+            except Exception as e:
+                # Se reintenta en la siguiente renovación, antes de que la clave se dé por abandonada
+                logger.warning("No se pudo renovar la clave de idempotencia %s: %s", key, e)
+    
+    def _renew(self, scope: str, key: str) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE idempotency_keys SET created_at = ?, expires_at = MAX(expires_at, ?) "
+                "WHERE scope = ? AND key = ? AND status = ?",
+                (now, now + self.ttl, scope, key, STATUS_IN_PROGRESS)
+            )
+    
+    def _complete(self, scope: str, key: str, status_code: int, response: str, request_hash: Optional[str]) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE idempotency_keys SET status = ?, status_code = ?, response = ?, "
+                "request_hash = COALESCE(request_hash, ?), expires_at = ? WHERE scope = ? AND key = ?",
+                (STATUS_COMPLETED, status_code, response, request_hash, now + self.ttl, scope, key)
+            )
+    
+    def _release(self, scope: str, key: str) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status = ?",
+                (scope, key, STATUS_IN_PROGRESS)
+            )
+    
+    def _fetch(self, scope: str, key: str):
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT request_hash, status FROM idempotency_keys WHERE scope = ? AND key = ?",
+                (scope, key)
+            ).fetchone()
+    
+    def _purge_expired(self, now: float) -> None:
+        """Elimina las claves expiradas, como mucho una vez por minuto"""
+        if now - self._last_purge < _PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        with self._db_lock:
+            deleted = self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,)
+            ).rowcount
+        if deleted:
+            logger.info("%s claves de idempotencia expiradas eliminadas", deleted)
@@ -0,0 +1,240 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Etapas de un envío. Cada etapa registra solo su propio tiempo: el de las etapas
+# medidas dentro de ella (render dentro de build, login dentro de transport) se
+# descuenta, de modo que las duraciones de las etapas pueden sumarse
+STAGE_AUTH = "auth"  # obtención del token de Graph / conexión y login SMTP
+STAGE_TEMPLATE_READ = "template_read"  # lectura de la plantilla (caché o disco)
+STAGE_RENDER = "render"  # aplicación de las variables (HTML y texto plano)
+STAGE_BUILD = "build"  # construcción del mensaje MIME o del JSON de Graph, sin render
+STAGE_TRANSPORT = "transport"  # DATA por SMTP / POST a Graph, sin el login de las sesiones nuevas
+STAGE_QUEUE_WAIT = "queue_wait"  # espera en la cola persistente desde que el trabajo está listo
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_ERROR = "error"
+
+# Etiqueta de plantilla de los envíos sin plantilla (cuerpo libre, cola)
+NO_TEMPLATE = "none"
+
+# Límites de los histogramas en segundos, de submilisegundos a varios minutos (espera en cola)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0
+)
+
+# Plantilla del envío en curso; la fijan los endpoints y la heredan las tareas y hilos que crean
+_current_template: ContextVar[str] = ContextVar("metrics_template", default=NO_TEMPLATE)
+# Etapa abierta en el contexto actual, a la que se descuenta el tiempo de las etapas anidadas
+_current_stage: ContextVar[Optional["Stage"]] = ContextVar("metrics_stage", default=None)
+
+class _Metric:
+    """Base de las métricas: nombre, ayuda y etiquetas en formato Prometheus"""
+    
+    metric_type = ""
+    
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._render_samples())
+        return lines
+    
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def _format_labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter(_Metric):
+    """Contador monótono por combinación de etiquetas"""
+    
+    metric_type = "counter"
+    
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+    
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._format_labels(labels)} {_format_value(value)}" for labels, value in values]
+
+class Histogram(_Metric):
+    """
+    Histograma con límites fijos por combinación de etiquetas. Cada
+    observación solo busca su intervalo e incrementa un contador; los
+    acumulados que exige el formato de Prometheus se calculan al exportar.
+    """
+    
+    metric_type = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Por serie: [cuentas por intervalo (+Inf al final), suma]
+        self._series: Dict[Tuple[str, ...], List] = {}
+    
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        
+        bounds = [f'le="{_format_value(bound)}"' for bound in self.buckets] + ['le="+Inf"']
+        lines = []
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+class Stage:
+    """
+    Medición de una etapa: registra su duración al salir del bloque `with`,
+    descontando la de las etapas medidas dentro del bloque. El resultado es
+    `error` si el bloque lanza una excepción o si se marca con `failed()` (por
+    ejemplo, una respuesta HTTP de error).
+    """
+    
+    __slots__ = ("stage", "provider", "template", "outcome", "_started", "_nested", "_parent", "_token")
+    
+    def __init__(self, stage: str, provider: str, template: Optional[str] = None):
+        self.stage = stage
+        self.provider = provider
+        self.template = template
+        self.outcome = OUTCOME_SUCCESS
+        self._started = 0.0
+        self._nested = 0.0
+        self._parent: Optional[Stage] = None
+        self._token = None
+    
+    def failed(self) -> None:
+        self.outcome = OUTCOME_ERROR
+    
+    def __enter__(self) -> "Stage":
+        self._parent = _current_stage.get()
+        self._token = _current_stage.set(self)
+        self._started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        elapsed = time.perf_counter() - self._started
+        _current_stage.reset(self._token)
+        if self._parent is not None:
+            self._parent._nested += elapsed
+        if exc_type is not None:
+            self.outcome = OUTCOME_ERROR
+        observe_stage(self.stage, self.provider, max(0.0, elapsed - self._nested), self.outcome, self.template)
+
+STAGE_SECONDS = Histogram(
+    "smart_emails_stage_duration_seconds",
+    "Duración de cada etapa de un envío en segundos",
+    ("stage", "provider", "outcome", "template")
+)
+SENDS_TOTAL = Counter(
+    "smart_emails_sends_total",
+    "Correos procesados por proveedor, resultado y plantilla",
+    ("provider", "outcome", "template")
+)
+SEND_SECONDS = Histogram(
+    "smart_emails_send_duration_seconds",
+    "Duración total de un envío en el servicio de correo en segundos",
+    ("provider", "outcome", "template")
+)
+
+_METRICS: Tuple[_Metric, ...] = (SENDS_TOTAL, SEND_SECONDS, STAGE_SECONDS)
+
+def stage(stage_name: str, provider: str, template: Optional[str] = None) -> Stage:
+    """
+    Mide una etapa de un envío
+    
+    Args:
+        stage_name: Etapa (`STAGE_*`)
+        provider: Proveedor que la ejecuta (`titan`, `outlook`)
+        template: Plantilla del envío (por defecto, la del contexto actual)
+    
+    Example:
+        with metrics.stage(metrics.STAGE_TRANSPORT, "outlook") as span:
+            response = await client.post(...)
+            if response.status_code != 202:
+                span.failed()
+    """
+    return Stage(stage_name, provider, template)
+
+def observe_stage(
+    stage_name: str,
+    provider: str,
+    seconds: float,
+    outcome: str = OUTCOME_SUCCESS,
+    template: Optional[str] = None
+) -> None:
+    """Registra la duración de una etapa ya medida"""
+    if settings.METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage_name, provider, outcome, template or _current_template.get())
+
+def observe_send(provider: str, success: bool, seconds: Optional[float] = None, template: Optional[str] = None) -> None:
+    """Registra el resultado de un envío y, si se indica, su duración total"""
+    if not settings.METRICS_ENABLED:
+        return
+    outcome = OUTCOME_SUCCESS if success else OUTCOME_ERROR
+    template = template or _current_template.get()
+    SENDS_TOTAL.inc(provider, outcome, template)
+    if seconds is not None:
+        SEND_SECONDS.observe(seconds, provider, outcome, template)
+
+@contextmanager
+def template_context(template_name: Optional[str]) -> Iterator[None]:
+    """Etiqueta con la plantilla indicada las métricas registradas dentro del bloque"""
+    token = _current_template.set(template_name or NO_TEMPLATE)
+    try:
+        yield
+    finally:
+        _current_template.reset(token)
+
+def render_metrics() -> str:
+    """Exporta todas las métricas en el formato de texto de Prometheus (0.0.4)"""
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
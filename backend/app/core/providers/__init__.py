@@ -2,6 +2,7 @@ from app.config import get_settings
 from app.core.providers.base import BaseEmailProvider
 from app.core.providers.titan.email_provider import TitanEmailProvider
 from app.core.providers.outlook.email_provider import OutlookEmailProvider
+from app.core.providers.router import RoutingEmailProvider
 
 def get_email_provider() -> BaseEmailProvider:
     """
@@ -9,6 +10,9 @@ def get_email_provider() -> BaseEmailProvider:
     
     Returns:
         BaseEmailProvider: Implementación del proveedor de correo según configuración
+    
+    Raises:
+        ValueError: Si EMAIL_PROVIDER no es un proveedor conocido
     """
     settings = get_settings()
     provider_name = settings.EMAIL_PROVIDER.lower()
@@ -17,6 +21,8 @@ def get_email_provider() -> BaseEmailProvider:
         return TitanEmailProvider()
     elif provider_name == "outlook":
         return OutlookEmailProvider()
+    elif provider_name == "router":
+        # Varias cuentas y proveedores definidos en EMAIL_ROUTES
+        return RoutingEmailProvider.from_settings()
     else:
-        # Por defecto, usar Titan como proveedor
-        return TitanEmailProvider()
\ No newline at end of file
+        raise ValueError(f"Proveedor de correo no válido: {settings.EMAIL_PROVIDER} (titan, outlook o router)")
\ No newline at end of file
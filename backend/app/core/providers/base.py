@@ -1,5 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 from app.schemas.email import EmailRequest, EmailResponse, Attachment
 
@@ -22,15 +23,75 @@ class BaseEmailProvider(ABC):
         """
         pass
     
-    @abstractmethod
-    def process_attachments(self, attachments: List[Attachment]) -> Any:
+    async def send_batch(self, messages: List[EmailRequest]) -> List[EmailResponse]:
         """
-        Procesa los archivos adjuntos en el formato requerido por el proveedor.
+        Envía un lote de correos. Los proveedores pueden sobrescribirlo para
+        reutilizar recursos comunes a todo el lote (adjuntos, conexiones).
         
         Args:
-            attachments: Lista de archivos adjuntos
+            messages: Correos a enviar
             
         Returns:
-            Any: Representación de los adjuntos en el formato del proveedor
+            List[EmailResponse]: Resultado de cada envío, en el mismo orden
+        """
+        return list(await asyncio.gather(*(self.send_email(message) for message in messages)))
+    
+    async def startup(self) -> None:
+        """
+        Inicializa los recursos de larga duración del proveedor (conexiones, clientes HTTP).
+        Se invoca al arrancar la aplicación.
+        """
+        pass
+    
+    async def warm_up(self) -> None:
         """
-        pass
\ No newline at end of file
+        Prepara el proveedor para los primeros envíos (conexiones abiertas,
+        tokens obtenidos). Se invoca tras `startup`, en segundo plano; un error
+        aquí no impide enviar, solo se pierde la ventaja del calentamiento.
+        """
+        pass
+    
+    async def shutdown(self) -> None:
+        """
+        Libera los recursos del proveedor. Se invoca al detener la aplicación.
+        """
+        pass
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Devuelve estadísticas de las conexiones del proveedor.
+        
+        Returns:
+            Dict[str, Any]: Estadísticas específicas del proveedor
+        """
+        return {}
+
+def attachments_key(attachments: Optional[List[Attachment]]) -> Optional[Tuple]:
+    """
+    Clave de una lista de adjuntos según su contenido (identificador o contenido
+    en línea, nombre y tipo). Los mensajes de un envío masivo reciben cada uno
+    su propia copia de la lista, de modo que los adjuntos comunes del lote se
+    reconocen por esta clave y no por la identidad de la lista.
+    
+    Returns:
+        Optional[Tuple]: Clave de los adjuntos (None si no hay adjuntos)
+    """
+    if not attachments:
+        return None
+    return tuple(
+        (
+            attachment.attachment_id,
+            None if attachment.attachment_id else attachment.content,
+            attachment.filename,
+            attachment.content_type
+        )
+        for attachment in attachments
+    )
+
+def is_permanent_error(error: BaseException) -> bool:
+    """
+    Indica si un error de envío se repetiría en cualquier reintento porque
+    depende de los datos del mensaje (adjunto inexistente, variables de
+    plantilla ausentes, contenido no válido) y no del servidor o la red.
+    """
+    return isinstance(error, (FileNotFoundError, ValueError))
@@ -1,50 +1,157 @@
-import os
+import asyncio
 import logging
+import threading
+import time
 from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
 import msal
 from fastapi import HTTPException
 
 from app.config import get_settings
+from app.utils.file_utils import atomic_write_text
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+class _CachedToken(NamedTuple):
+    """Token de acceso en caché junto con su instante de expiración (reloj monotónico)"""
+    access_token: str
+    expires_at: float
+
 class OutlookAuth:
     """Clase para manejar la autenticación con Microsoft Graph API para Outlook"""
     
-    def __init__(self):
+    def __init__(self, refresh_token_path: Optional[Path] = None):
+        """
+        Args:
+            refresh_token_path: Archivo del refresh token de la cuenta (por defecto
+                `refresh_token.txt` en BASE_DIR)
+        """
         self.application_id = settings.APPLICATION_ID
         self.client_secret = settings.CLIENT_SECRET
         self.tenant_id = settings.TENANT_ID
         self.scopes = settings.SCOPES
-        self.refresh_token_path = Path(settings.BASE_DIR / "refresh_token.txt")
+        self.refresh_token_path = Path(refresh_token_path or settings.BASE_DIR / "refresh_token.txt")
+        self.refresh_margin = settings.MS_TOKEN_REFRESH_MARGIN
+        
+        self._client: Optional[msal.ConfidentialClientApplication] = None
+        self._refresh_token: Optional[str] = None
+        self._token_cache: Dict[Tuple[str, Tuple[str, ...]], _CachedToken] = {}
+        # Un único refresco en vuelo: las peticiones concurrentes esperan su resultado
+        self._refresh_lock = threading.Lock()
+        self._background_refresh: Optional[threading.Thread] = None
     
-    def get_access_token(self):
-        """Obtiene un token de acceso para Microsoft Graph API"""
-        try:
-            client = msal.ConfidentialClientApplication(
+    @property
+    def _cache_key(self) -> Tuple[str, Tuple[str, ...]]:
+        return (self.tenant_id, tuple(sorted(self.scopes)))
+    
+    def _get_client(self) -> msal.ConfidentialClientApplication:
+        """Obtiene la aplicación MSAL, creándola una sola vez"""
+        if self._client is None:
+            self._client = msal.ConfidentialClientApplication(
                 client_id=self.application_id,
                 client_credential=self.client_secret,
                 authority=f'https://login.microsoftonline.com/{self.tenant_id}/'
             )
+        return self._client
+    
+    def _load_refresh_token(self) -> Optional[str]:
+        """Lee el refresh token del disco solo la primera vez"""
+        if self._refresh_token is None and self.refresh_token_path.exists():
+            with open(self.refresh_token_path, 'r') as f:
+                self._refresh_token = f.read().strip() or None
+        return self._refresh_token
+    
+    def _store_refresh_token(self, refresh_token: str) -> None:
+        """Guarda el refresh token en memoria y en disco de forma atómica"""
+        if refresh_token == self._refresh_token:
+            return
+        self._refresh_token = refresh_token
+        atomic_write_text(self.refresh_token_path, refresh_token)
+    
+    def _get_cached_token(self) -> Optional[_CachedToken]:
+        """Devuelve el token en caché si todavía no ha expirado"""
+        cached = self._token_cache.get(self._cache_key)
+        if cached and cached.expires_at > time.monotonic():
+            return cached
+        return None
+    
+    def _needs_refresh(self, cached: _CachedToken) -> bool:
+        """Indica si el token está dentro del margen de refresco previo a su expiración"""
+        return cached.expires_at - time.monotonic() <= self.refresh_margin
+    
+    def get_access_token(self) -> str:
+        """
+        Obtiene un token de acceso para Microsoft Graph API.
+        
+        Devuelve el token en caché mientras sea válido; si está a punto de
+        expirar lanza un refresco en segundo plano y, si ya expiró, lo renueva
+        una sola vez aunque haya varias peticiones esperando.
+        """
+        cached = self._get_cached_token()
+        if cached:
+            if self._needs_refresh(cached):
+                self._schedule_background_refresh()
+            return cached.access_token
+        
+        with self._refresh_lock:
+            # Otra petición pudo renovar el token mientras se esperaba el lock
+            cached = self._get_cached_token()
+            if cached:
+                return cached.access_token
+            return self._acquire_token().access_token
+    
+    async def get_access_token_async(self) -> str:
+        """
+        Versión asíncrona de `get_access_token`: la petición de red al endpoint
+        de tokens se ejecuta fuera del event loop
+        """
+        cached = self._get_cached_token()
+        if cached and not self._needs_refresh(cached):
+            return cached.access_token
+        return await asyncio.to_thread(self.get_access_token)
+    
+    def _schedule_background_refresh(self) -> None:
+        """Renueva el token en un hilo en segundo plano si no hay otro refresco en curso"""
+        if self._background_refresh is not None and self._background_refresh.is_alive():
+            return
+        self._background_refresh = threading.Thread(
+            target=self._refresh_in_background, name="outlook-token-refresh", daemon=True
+        )
+        self._background_refresh.start()
+    
+    def _refresh_in_background(self) -> None:
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            cached = self._get_cached_token()
+            if cached and not self._needs_refresh(cached):
+                return
+            self._acquire_token()
+        except Exception:
+            # El token actual sigue siendo válido; se reintentará en la siguiente petición
+            logger.exception("Error al renovar el token en segundo plano")
+        finally:
+            self._refresh_lock.release()
+    
+    def _acquire_token(self) -> _CachedToken:
+        """Solicita un nuevo token al endpoint de Microsoft y lo guarda en caché"""
+        try:
+            client = self._get_client()
             
             # Intentar usar un refresh token si existe
-            refresh_token = None
-            if self.refresh_token_path.exists():
-                with open(self.refresh_token_path, 'r') as f:
-                    refresh_token = f.read().strip()
+            refresh_token = self._load_refresh_token()
             
             if refresh_token:
                 logger.info("Intentando obtener token con refresh token")
                 token_response = client.acquire_token_by_refresh_token(refresh_token, self.scopes)
                 if 'access_token' in token_response:
                     if 'refresh_token' in token_response:
-                        with open(self.refresh_token_path, 'w') as f:
-                            f.write(token_response['refresh_token'])
+                        self._store_refresh_token(token_response['refresh_token'])
                     logger.info("Token obtenido correctamente con refresh token")
-                    return token_response['access_token']
+                    return self._cache_token(token_response)
                 else:
-                    logger.warning("No se pudo obtener token con refresh token. Error: %s", 
+                    logger.warning("No se pudo obtener token con refresh token. Error: %s",
                                   token_response.get('error_description', 'Unknown error'))
             
             # Si no hay refresh token o falló, usamos credenciales de cliente (sin interacción del usuario)
@@ -53,20 +160,40 @@ class OutlookAuth:
             
             if 'access_token' in token_response:
                 logger.info("Token obtenido correctamente con credenciales de cliente")
-                return token_response['access_token']
+                return self._cache_token(token_response)
             else:
                 error_message = token_response.get('error_description', 'Unknown error')
                 logger.error("Error al obtener token: %s", error_message)
                 raise HTTPException(status_code=401, detail=f"Error acquiring token: {error_message}")
-                
+        
+        except HTTPException:
+            raise
         except Exception as e:
             logger.exception("Error en el proceso de autenticación")
             raise HTTPException(status_code=500, detail=f"Authentication error: {str(e)}")
-
+    
+    def _cache_token(self, token_response: dict) -> _CachedToken:
+        """Guarda en caché un token respetando su `expires_in`"""
+        expires_in = int(token_response.get('expires_in', 3600))
+        cached = _CachedToken(
+            access_token=token_response['access_token'],
+            expires_at=time.monotonic() + expires_in
+        )
+        self._token_cache[self._cache_key] = cached
+        return cached
+    
     def get_auth_headers(self):
         """Obtiene los encabezados de autorización para las solicitudes a Microsoft Graph API"""
         access_token = self.get_access_token()
         return {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
-        }
\ No newline at end of file
+        }
+    
+    async def get_auth_headers_async(self):
+        """Versión asíncrona de `get_auth_headers`"""
+        access_token = await self.get_access_token_async()
+        return {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
@@ -1,22 +1,126 @@
+import asyncio
+import importlib.util
+import json
 import logging
 import mimetypes
-from typing import List, Dict, Any, Optional
+from pathlib import Path
+from typing import List, Dict, Any, Mapping, NamedTuple, Optional, Tuple, Union
 import httpx
 
 from app.config import get_settings
-from app.core.providers.base import BaseEmailProvider
+from app.logging_config import SAMPLED
+from app.core import metrics
+from app.core.attachment_store import get_attachment_store
+from app.core.rate_limiter import get_rate_limiter
+from app.core.providers.base import BaseEmailProvider, attachments_key, is_permanent_error
 from app.core.providers.outlook.auth import OutlookAuth
 from app.schemas.email import EmailRequest, EmailResponse, Attachment
+from app.utils.helpers import apply_template_variables
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+# Máximo de peticiones por llamada a $batch admitido por Graph API
+GRAPH_BATCH_MAX_REQUESTS = 20
+# Partes fijas de cada petición del cuerpo de $batch; la carga de sendMail va ya serializada
+_BATCH_REQUEST_PREFIX = b'{"id":"%d","method":"POST","url":"/me/sendMail","headers":{"Content-Type":"application/json"},"body":'
+_BATCH_BODY_OVERHEAD = len(b'{"requests":[]}')
+# Respuestas tras las que una petición puede reintentarse (limitación o error transitorio)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Los bloques de una sesión de carga deben ser múltiplos de 320 KiB
+UPLOAD_CHUNK_UNIT = 320 * 1024
+
+class LargeAttachment(NamedTuple):
+    """Adjunto que supera el límite de contentBytes y se sube con una sesión de carga"""
+    attachment_id: str
+    name: str
+    content_type: str
+    size: int
+
+GraphAttachment = Union[Dict[str, Any], LargeAttachment]
+
 class OutlookEmailProvider(BaseEmailProvider):
     """Implementación del proveedor de correo utilizando Microsoft Graph API para Outlook"""
     
-    def __init__(self):
-        self.auth = OutlookAuth()
+    def __init__(self, account: Optional[str] = None, refresh_token_path: Optional[Path] = None):
+        """
+        Args:
+            account: Nombre del buzón, para distinguir su límite de envíos (por defecto `me`)
+            refresh_token_path: Archivo del refresh token del buzón (por defecto `refresh_token.txt`)
+        """
+        self.account = account or "me"
+        self.auth = OutlookAuth(refresh_token_path)
         self.ms_graph_endpoint = settings.MS_GRAPH_ENDPOINT
+        self.attachment_store = get_attachment_store()
+        self._client: Optional[httpx.AsyncClient] = None
+        # Límite de envíos del buzón, adaptado a las respuestas 429 de Graph API
+        self.rate_limiter = get_rate_limiter("outlook", self.account)
+    
+    async def startup(self) -> None:
+        """Crea el cliente HTTP compartido por todos los envíos"""
+        self._get_client()
+    
+    async def warm_up(self) -> None:
+        """Crea la aplicación MSAL y obtiene el token de acceso por adelantado"""
+        await self.auth.get_access_token_async()
+        logger.info("Token de Graph API obtenido para el buzón %s", self.account)
+    
+    async def shutdown(self) -> None:
+        """Cierra el cliente HTTP y sus conexiones"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Obtiene el cliente HTTP de larga duración del proveedor, creándolo si no existe
+        
+        Returns:
+            httpx.AsyncClient: Cliente con conexiones keep-alive reutilizables
+        """
+        if self._client is None or self._client.is_closed:
+            http2 = settings.OUTLOOK_HTTP2
+            if http2 and importlib.util.find_spec("h2") is None:
+                logger.warning("HTTP/2 deshabilitado: el paquete 'h2' no está instalado")
+                http2 = False
+            
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=settings.OUTLOOK_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OUTLOOK_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.OUTLOOK_HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(
+                    settings.OUTLOOK_HTTP_TIMEOUT,
+                    connect=settings.OUTLOOK_HTTP_CONNECT_TIMEOUT
+                )
+            )
+            logger.info("Cliente HTTP para Graph API creado (HTTP/2: %s)", http2)
+        return self._client
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Devuelve estadísticas del pool de conexiones del cliente HTTP
+        
+        Returns:
+            Dict[str, Any]: Conexiones activas e inactivas del pool
+        """
+        if self._client is None or self._client.is_closed:
+            return {"client": "closed", "active_connections": 0, "idle_connections": 0}
+        
+        # httpx no expone el pool públicamente; se consulta el pool de httpcore del transporte
+        pool = getattr(self._client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "client": "open",
+            "http2": settings.OUTLOOK_HTTP2 and importlib.util.find_spec("h2") is not None,
+            "max_connections": settings.OUTLOOK_HTTP_MAX_CONNECTIONS,
+            "active_connections": len(connections) - idle,
+            "idle_connections": idle,
+            "rate_limit": self.rate_limiter.get_stats()
+        }
     
     async def send_email(self, email_data: EmailRequest) -> EmailResponse:
         """
@@ -25,67 +129,449 @@ class OutlookEmailProvider(BaseEmailProvider):
         Args:
             email_data: Datos del correo a enviar
             
+        Returns:
+            EmailResponse: Resultado del envío
+        """
+        return await self._send(email_data)
+    
+    async def send_batch(self, messages: List[EmailRequest]) -> List[EmailResponse]:
+        """
+        Envía un lote de correos agrupándolos en llamadas JSON `$batch` de Graph API
+        (hasta 20 peticiones sendMail y `OUTLOOK_BATCH_MAX_BYTES` por llamada) y
+        procesando una sola vez los adjuntos compartidos por varios mensajes
+        
+        Args:
+            messages: Correos a enviar
+            
+        Returns:
+            List[EmailResponse]: Resultado de cada envío, en el mismo orden
+        """
+        batch_size = min(GRAPH_BATCH_MAX_REQUESTS, max(1, settings.OUTLOOK_BATCH_SIZE))
+        if len(messages) <= 1 or batch_size == 1:
+            return list(await asyncio.gather(*[self._send(email_data) for email_data in messages]))
+        
+        # Los mensajes de un envío masivo comparten los mismos adjuntos
+        processed: Dict[Tuple, Optional[List[GraphAttachment]]] = {}
+        results: List[Optional[EmailResponse]] = [None] * len(messages)
+        prepared: List[Tuple[int, bytes]] = []
+        individual: List[Tuple[int, Optional[List[GraphAttachment]]]] = []
+        for index, email_data in enumerate(messages):
+            try:
+                graph_attachments = None
+                if email_data.attachments:
+                    key = attachments_key(email_data.attachments)
+                    if key not in processed:
+                        # La lectura de los adjuntos del almacén no debe detener el event loop
+                        processed[key] = await asyncio.to_thread(self.process_attachments, email_data.attachments)
+                    graph_attachments = processed[key]
+                if _large_attachments(graph_attachments):
+                    # Los adjuntos grandes requieren borrador y sesión de carga: no caben en $batch
+                    individual.append((index, graph_attachments))
+                    continue
+                with metrics.stage(metrics.STAGE_BUILD, "outlook"):
+                    # Se serializa una vez: el tamaño decide el reparto en llamadas y sirve para los reintentos
+                    payload = json.dumps(
+                        self._create_payload(email_data, graph_attachments), ensure_ascii=False, separators=(",", ":")
+                    ).encode("utf-8")
+                if _batch_request_size(index, payload) + _BATCH_BODY_OVERHEAD > settings.OUTLOOK_BATCH_MAX_BYTES:
+                    # Adjuntos en línea cerca del límite de contentBytes: solo caben en un sendMail propio
+                    individual.append((index, graph_attachments))
+                    continue
+                prepared.append((index, payload))
+            except Exception as e:
+                logger.exception("Error al preparar el correo %s del lote: %s", index, e)
+                results[index] = EmailResponse(success=False, message=f"Error al enviar correo: {str(e)}")
+        
+        chunks = _split_batches(prepared, batch_size, settings.OUTLOOK_BATCH_MAX_BYTES)
+        outcomes = await asyncio.gather(
+            *[self._send_graph_batch(chunk) for chunk in chunks],
+            *[self._send_individually(index, messages[index], graph_attachments) for index, graph_attachments in individual]
+        )
+        for outcome in outcomes:
+            for index, response in outcome.items():
+                results[index] = response
+        return results
+    
+    async def _send_individually(
+        self,
+        index: int,
+        email_data: EmailRequest,
+        graph_attachments: Optional[List[GraphAttachment]]
+    ) -> Dict[int, EmailResponse]:
+        """Envía fuera de $batch un mensaje del lote (adjuntos con sesión de carga)"""
+        return {index: await self._send(email_data, graph_attachments)}
+    
+    async def _send_graph_batch(self, requests: List[Tuple[int, bytes]]) -> Dict[int, EmailResponse]:
+        """
+        Envía hasta 20 peticiones sendMail en una llamada a `$batch`, reintentando
+        solo las que fallan por limitación o error transitorio del servidor
+        
+        Args:
+            requests: Pares (posición del mensaje en el lote, carga de sendMail en JSON)
+            
+        Returns:
+            Dict[int, EmailResponse]: Resultado de cada mensaje por su posición
+        """
+        pending = dict(requests)
+        results: Dict[int, EmailResponse] = {}
+        errors: Dict[int, str] = {}
+        attempt = 0
+        
+        while pending:
+            retry_after = 0.0
+            throttled = False
+            failed: Dict[int, bytes] = {}
+            try:
+                await self.rate_limiter.acquire(len(pending))
+                with metrics.stage(metrics.STAGE_AUTH, "outlook"):
+                    headers = await self.auth.get_auth_headers_async()
+                body = b'{"requests":[' + b",".join(
+                    _BATCH_REQUEST_PREFIX % index + payload + b"}" for index, payload in pending.items()
+                ) + b"]}"
+                logger.info("Enviando lote de %d correos mediante $batch", len(pending), extra=SAMPLED)
+                with metrics.stage(metrics.STAGE_TRANSPORT, "outlook") as transport:
+                    response = await self._get_client().post(
+                        f'{self.ms_graph_endpoint}/$batch',
+                        headers={**headers, "Content-Type": "application/json"},
+                        content=body
+                    )
+                    if response.status_code != 200:
+                        transport.failed()
+            except httpx.HTTPError as e:
+                # Error de red: se reintenta el lote completo
+                logger.warning("Error de conexión al enviar lote: %s", e)
+                failed = pending
+                errors.update((index, f"Error al enviar correo: {str(e)}") for index in pending)
+            except Exception as e:
+                # Error de autenticación u otro no recuperable: falla todo el lote
+                logger.exception("Error al enviar lote: %s", e)
+                for index in pending:
+                    results[index] = EmailResponse(success=False, message=f"Error al enviar correo: {str(e)}")
+                break
+            else:
+                if response.status_code != 200:
+                    error_msg = f"Error al enviar correo: {response.status_code} - {response.text}"
+                    logger.error(error_msg)
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        for index in pending:
+                            results[index] = EmailResponse(success=False, message=error_msg)
+                        break
+                    failed = pending
+                    errors.update((index, error_msg) for index in pending)
+                    retry_after = _retry_after(response.headers) or 0.0
+                    throttled = response.status_code == 429
+                else:
+                    try:
+                        data = response.json()
+                        if not isinstance(data, dict) or not isinstance(data.get("responses", []), list):
+                            raise ValueError("no contiene una lista de respuestas")
+                        sub_responses = data.get("responses", [])
+                    except ValueError as e:
+                        # Sin respuestas por petición no se sabe cuáles se enviaron: no se reintentan
+                        error_msg = f"Error al enviar correo: respuesta de $batch no válida ({str(e)})"
+                        logger.error(error_msg)
+                        for index in pending:
+                            results[index] = EmailResponse(success=False, message=error_msg)
+                        break
+                    answered = set()
+                    unknown_ids = 0
+                    for sub_response in sub_responses:
+                        index = _sub_response_index(sub_response, pending)
+                        if index is None:
+                            unknown_ids += 1
+                            continue
+                        answered.add(index)
+                        status = sub_response.get("status")
+                        if status == 202:
+                            self.rate_limiter.on_success()
+                            results[index] = EmailResponse(
+                                success=True,
+                                message="Correo enviado exitosamente",
+                                email_id=None  # Graph API no devuelve ID de correo en esta operación
+                            )
+                            continue
+                        
+                        error_msg = f"Error al enviar correo: {status} - {_graph_error_message(sub_response.get('body'))}"
+                        if status in RETRYABLE_STATUS_CODES:
+                            failed[index] = pending[index]
+                            errors[index] = error_msg
+                            retry_after = max(retry_after, _retry_after(sub_response.get("headers") or {}) or 0.0)
+                            throttled = throttled or status == 429
+                        else:
+                            logger.error(error_msg)
+                            results[index] = EmailResponse(
+                                success=False,
+                                message=error_msg,
+                                retryable=False if _is_permanent_status(status) else None
+                            )
+                    
+                    unanswered = pending.keys() - answered
+                    if unknown_ids and unanswered:
+                        # Respuestas con un id desconocido: no se sabe a qué peticiones corresponden
+                        # ni si se enviaron, así que las peticiones sin respuesta no se reintentan
+                        error_msg = "Error al enviar correo: respuesta de $batch con id desconocido"
+                        logger.error("%s (%s respuestas)", error_msg, unknown_ids)
+                        for index in unanswered:
+                            results[index] = EmailResponse(success=False, message=error_msg)
+                    else:
+                        # Peticiones sin respuesta en el lote: se reintentan
+                        for index in unanswered:
+                            failed[index] = pending[index]
+                            errors[index] = "Error al enviar correo: sin respuesta en el lote"
+            
+            pending = failed
+            if not pending:
+                break
+            attempt += 1
+            if attempt > settings.OUTLOOK_BATCH_MAX_RETRIES:
+                for index in pending:
+                    results[index] = EmailResponse(success=False, message=errors[index])
+                break
+            
+            if throttled:
+                # Graph limitó el buzón: el limitador pausa los envíos (también los
+                # de otros lotes) durante el Retry-After y reduce la tasa
+                delay = self.rate_limiter.on_throttle(retry_after or None)
+            else:
+                delay = max(retry_after, settings.OUTLOOK_BATCH_RETRY_DELAY * (2 ** (attempt - 1)))
+                await asyncio.sleep(delay)
+            logger.warning("Reintentando %s correos del lote en %.1fs (intento %s)", len(pending), delay, attempt)
+        
+        return results
+    
+    async def _send(self, email_data: EmailRequest, graph_attachments: Optional[List[GraphAttachment]] = None) -> EmailResponse:
+        """
+        Envía un correo mediante el endpoint /me/sendMail
+        
+        Args:
+            email_data: Datos del correo a enviar
+            graph_attachments: Adjuntos ya procesados en formato de Graph API (opcional)
+            
         Returns:
             EmailResponse: Resultado del envío
         """
         try:
             # Obtener encabezados de autenticación
-            headers = self.auth.get_auth_headers()
+            with metrics.stage(metrics.STAGE_AUTH, "outlook"):
+                headers = await self.auth.get_auth_headers_async()
             
-            # Crear el cuerpo del mensaje
-            message = self._create_message_body(email_data)
+            # Los adjuntos grandes se envían mediante un borrador y sesiones de carga
+            if graph_attachments is None and email_data.attachments:
+                # La lectura de los adjuntos del almacén no debe detener el event loop
+                graph_attachments = await asyncio.to_thread(self.process_attachments, email_data.attachments)
+            large_attachments = _large_attachments(graph_attachments)
+            if large_attachments:
+                # Borrador, sesiones de carga y envío: se miden juntos como transporte
+                with metrics.stage(metrics.STAGE_TRANSPORT, "outlook") as transport:
+                    result = await self._send_with_upload_sessions(email_data, graph_attachments, large_attachments, headers)
+                    if not result.success:
+                        transport.failed()
+                return result
             
             # Preparar la carga para la API
-            payload = {
-                "message": message,
-                "saveToSentItems": email_data.save_to_sent_items
-            }
+            with metrics.stage(metrics.STAGE_BUILD, "outlook"):
+                payload = self._create_payload(email_data, graph_attachments)
             
-            logger.info(f"Enviando correo con asunto: {email_data.subject}")
+            logger.info("Enviando correo con asunto: %s", email_data.subject, extra=SAMPLED)
             
-            # Configurar cliente HTTP con timeout
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f'{self.ms_graph_endpoint}/me/sendMail',
-                    headers=headers,
-                    json=payload
-                )
-                
-                # Verificar respuesta
-                if response.status_code == 202:
-                    logger.info("Correo enviado exitosamente")
-                    return EmailResponse(
-                        success=True,
-                        message="Correo enviado exitosamente",
-                        email_id=None  # Graph API no devuelve ID de correo en esta operación
-                    )
-                else:
-                    error_msg = f"Error al enviar correo: {response.status_code} - {response.text}"
-                    logger.error(error_msg)
-                    return EmailResponse(
-                        success=False,
-                        message=error_msg
+            # Reutilizar el cliente HTTP compartido (conexiones keep-alive)
+            client = self._get_client()
+            attempt = 0
+            while True:
+                await self.rate_limiter.acquire()
+                with metrics.stage(metrics.STAGE_TRANSPORT, "outlook") as transport:
+                    response = await client.post(
+                        f'{self.ms_graph_endpoint}/me/sendMail',
+                        headers=headers,
+                        json=payload
                     )
-                
+                    if response.status_code != 202:
+                        transport.failed()
+                if response.status_code != 429 or attempt >= settings.RATE_LIMIT_MAX_RETRIES:
+                    break
+                # Buzón limitado: se espera el Retry-After indicado y se reintenta
+                attempt += 1
+                self.rate_limiter.on_throttle(_retry_after(response.headers))
+            
+            # Verificar respuesta
+            if response.status_code == 202:
+                self.rate_limiter.on_success()
+                logger.info("Correo enviado exitosamente", extra=SAMPLED)
+                return EmailResponse(
+                    success=True,
+                    message="Correo enviado exitosamente",
+                    email_id=None  # Graph API no devuelve ID de correo en esta operación
+                )
+            else:
+                error_msg = f"Error al enviar correo: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                return EmailResponse(
+                    success=False,
+                    message=error_msg,
+                    retryable=False if _is_permanent_status(response.status_code) else None
+                )
+            
         except httpx.HTTPStatusError as e:
-            logger.exception(f"HTTP error al enviar correo: {str(e)}")
+            logger.exception("HTTP error al enviar correo: %s", e)
             return EmailResponse(
                 success=False,
                 message=f"HTTP error al enviar correo: {str(e)}"
             )
         except Exception as e:
-            logger.exception(f"Error al enviar correo: {str(e)}")
+            logger.exception("Error al enviar correo: %s", e)
+            return EmailResponse(
+                success=False,
+                message=f"Error al enviar correo: {str(e)}",
+                retryable=False if is_permanent_error(e) else None
+            )
+    
+    async def _send_with_upload_sessions(
+        self,
+        email_data: EmailRequest,
+        graph_attachments: List[GraphAttachment],
+        large_attachments: List[LargeAttachment],
+        headers: Dict[str, str]
+    ) -> EmailResponse:
+        """
+        Envía un correo con adjuntos grandes: crea un borrador con el resto del
+        mensaje, sube cada adjunto grande por bloques con una sesión de carga y
+        envía el borrador. El contenido de los adjuntos se lee del almacén bloque
+        a bloque, por lo que la memoria usada no depende de su tamaño.
+        
+        Graph guarda siempre en Elementos enviados los borradores enviados, por lo
+        que en este caso no se aplica `save_to_sent_items`.
+        
+        Args:
+            email_data: Datos del correo a enviar
+            graph_attachments: Adjuntos ya procesados
+            large_attachments: Adjuntos que se suben con sesión de carga
+            headers: Encabezados de autenticación
+            
+        Returns:
+            EmailResponse: Resultado del envío
+        """
+        client = self._get_client()
+        await self.rate_limiter.acquire()
+        
+        logger.info("Creando borrador para el correo con asunto: %s", email_data.subject)
+        response = await client.post(
+            f'{self.ms_graph_endpoint}/me/messages',
+            headers=headers,
+            json=self._create_message_body(email_data, graph_attachments)
+        )
+        if response.status_code != 201:
+            error_msg = f"Error al crear el borrador: {response.status_code} - {response.text}"
+            logger.error(error_msg)
             return EmailResponse(
                 success=False,
-                message=f"Error al enviar correo: {str(e)}"
+                message=error_msg,
+                retryable=False if _is_permanent_status(response.status_code) else None
+            )
+        try:
+            message_id = response.json()["id"]
+        except (ValueError, KeyError, TypeError):
+            error_msg = f"Error al crear el borrador: respuesta sin identificador ({response.text[:200]})"
+            logger.error(error_msg)
+            return EmailResponse(success=False, message=error_msg)
+        
+        try:
+            for attachment in large_attachments:
+                await self._upload_attachment(client, headers, message_id, attachment)
+            
+            logger.info("Enviando correo con asunto: %s", email_data.subject, extra=SAMPLED)
+            response = await client.post(
+                f'{self.ms_graph_endpoint}/me/messages/{message_id}/send',
+                headers=headers
             )
+            if response.status_code != 202:
+                raise RuntimeError(f"{response.status_code} - {response.text}")
+        except Exception as e:
+            error_msg = f"Error al enviar correo: {str(e)}"
+            logger.error(error_msg)
+            await self._delete_draft(client, headers, message_id)
+            return EmailResponse(success=False, message=error_msg)
+        
+        self.rate_limiter.on_success()
+        logger.info("Correo enviado exitosamente", extra=SAMPLED)
+        return EmailResponse(
+            success=True,
+            message="Correo enviado exitosamente",
+            email_id=None  # El identificador del borrador deja de ser válido al enviarlo
+        )
+    
+    async def _upload_attachment(
+        self,
+        client: httpx.AsyncClient,
+        headers: Dict[str, str],
+        message_id: str,
+        attachment: LargeAttachment
+    ) -> None:
+        """
+        Sube un adjunto a un borrador por bloques mediante una sesión de carga
+        
+        Raises:
+            RuntimeError: Si Graph rechaza la sesión o alguno de los bloques
+        """
+        response = await client.post(
+            f'{self.ms_graph_endpoint}/me/messages/{message_id}/attachments/createUploadSession',
+            headers=headers,
+            json={
+                "AttachmentItem": {
+                    "attachmentType": "file",
+                    "name": attachment.name,
+                    "size": attachment.size,
+                    "contentType": attachment.content_type
+                }
+            }
+        )
+        if response.status_code != 201:
+            raise RuntimeError(f"no se pudo crear la sesión de carga de '{attachment.name}': {response.status_code} - {response.text}")
+        upload_url = response.json()["uploadUrl"]
+        
+        chunk_size = max(UPLOAD_CHUNK_UNIT, settings.OUTLOOK_UPLOAD_CHUNK_SIZE // UPLOAD_CHUNK_UNIT * UPLOAD_CHUNK_UNIT)
+        logger.info("Subiendo adjunto '%s' (%d bytes) en bloques de %d bytes", attachment.name, attachment.size, chunk_size)
+        
+        with self.attachment_store.open_raw(attachment.attachment_id) as f:
+            offset = 0
+            while offset < attachment.size:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    raise RuntimeError(f"el adjunto '{attachment.name}' es más corto de lo esperado")
+                end = offset + len(chunk) - 1
+                # La URL de la sesión ya está autorizada: no se envía el token
+                response = await client.put(
+                    upload_url,
+                    content=chunk,
+                    headers={
+                        "Content-Type": "application/octet-stream",
+                        "Content-Range": f"bytes {offset}-{end}/{attachment.size}"
+                    }
+                )
+                if response.status_code not in (200, 201):
+                    raise RuntimeError(f"error al subir '{attachment.name}' (bytes {offset}-{end}): {response.status_code} - {response.text}")
+                offset = end + 1
+    
+    async def _delete_draft(self, client: httpx.AsyncClient, headers: Dict[str, str], message_id: str) -> None:
+        """Elimina un borrador que no pudo enviarse"""
+        try:
+            await client.delete(f'{self.ms_graph_endpoint}/me/messages/{message_id}', headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning("No se pudo eliminar el borrador %s: %s", message_id, e)
     
-    def _create_message_body(self, email_data: EmailRequest) -> dict:
+    def _create_payload(self, email_data: EmailRequest, graph_attachments: Optional[List[GraphAttachment]] = None) -> Dict[str, Any]:
+        """Crea la carga de una petición sendMail"""
+        return {
+            "message": self._create_message_body(email_data, graph_attachments),
+            "saveToSentItems": email_data.save_to_sent_items
+        }
+    
+    def _create_message_body(self, email_data: EmailRequest, graph_attachments: Optional[List[GraphAttachment]] = None) -> dict:
         """
         Crea el cuerpo del mensaje para la API de Microsoft Graph
         
         Args:
             email_data: Datos del correo
+            graph_attachments: Adjuntos ya procesados en formato de Graph API (opcional)
             
         Returns:
             dict: Diccionario con el cuerpo del mensaje en formato de Graph API
@@ -102,13 +588,17 @@ class OutlookEmailProvider(BaseEmailProvider):
             bcc_recipients = [{"emailAddress": {"address": r.email, "name": r.name}} for r in email_data.bcc_recipients]
         
         # Procesar adjuntos
-        attachments = self.process_attachments(email_data.attachments) if email_data.attachments else []
+        attachments = graph_attachments
+        if attachments is None:
+            attachments = self.process_attachments(email_data.attachments) if email_data.attachments else []
         
         # Aplicar variables de plantilla si están disponibles
-        content = email_data.body
-        if email_data.template_variables:
-            for key, value in email_data.template_variables.items():
-                content = content.replace(f"{{{key}}}", str(value))
+        with metrics.stage(metrics.STAGE_RENDER, "outlook"):
+            content = apply_template_variables(
+                email_data.body,
+                email_data.template_variables,
+                escape=settings.TEMPLATE_ESCAPE_HTML and email_data.body_type.upper() == "HTML"
+            )
         
         # Crear el mensaje
         message = {
@@ -127,12 +617,14 @@ class OutlookEmailProvider(BaseEmailProvider):
         if bcc_recipients:
             message['bccRecipients'] = bcc_recipients
         
+        # Los adjuntos grandes se suben después con sesiones de carga
+        attachments = [attachment for attachment in attachments if isinstance(attachment, dict)]
         if attachments:
             message['attachments'] = attachments
         
         return message
     
-    def process_attachments(self, attachments: List[Attachment]) -> List[Dict[str, Any]]:
+    def process_attachments(self, attachments: List[Attachment]) -> List[GraphAttachment]:
         """
         Procesa los archivos adjuntos para Microsoft Graph API
         
@@ -140,7 +632,8 @@ class OutlookEmailProvider(BaseEmailProvider):
             attachments: Lista de archivos adjuntos
             
         Returns:
-            List[Dict[str, Any]]: Lista de adjuntos en formato de Graph API
+            List[GraphAttachment]: Lista de adjuntos en formato de Graph API; los que
+            superan `OUTLOOK_LARGE_ATTACHMENT_THRESHOLD` se devuelven como `LargeAttachment`
         """
         if not attachments:
             return []
@@ -150,11 +643,107 @@ class OutlookEmailProvider(BaseEmailProvider):
         for attachment in attachments:
             mime_type = attachment.content_type or mimetypes.guess_type(attachment.filename)[0] or 'application/octet-stream'
             
+            if attachment.attachment_id:
+                size = self.attachment_store.get(attachment.attachment_id).size
+            else:
+                size = _decoded_size(attachment.content)
+            
+            if size > settings.OUTLOOK_LARGE_ATTACHMENT_THRESHOLD:
+                # Se sube desde el almacén; el contenido en línea se guarda allí primero
+                attachment_id = attachment.attachment_id or self.attachment_store.put_base64(attachment.content)
+                graph_attachments.append(LargeAttachment(
+                    attachment_id=attachment_id,
+                    name=attachment.filename,
+                    content_type=mime_type,
+                    size=self.attachment_store.get(attachment_id).size
+                ))
+                continue
+            
+            # Los adjuntos referenciados por id se leen ya codificados del almacén
+            content_bytes = attachment.content
+            if attachment.attachment_id:
+                content_bytes = self.attachment_store.get_base64(attachment.attachment_id)
+            
             graph_attachments.append({
                 '@odata.type': '#microsoft.graph.fileAttachment',
                 'name': attachment.filename,
                 'contentType': mime_type,
-                'contentBytes': attachment.content
+                'contentBytes': content_bytes
             })
         
-        return graph_attachments
\ No newline at end of file
+        return graph_attachments
+
+def _split_batches(
+    prepared: List[Tuple[int, bytes]],
+    max_requests: int,
+    max_bytes: int
+) -> List[List[Tuple[int, bytes]]]:
+    """
+    Reparte las peticiones en llamadas a $batch sin superar el número de
+    peticiones ni el tamaño del cuerpo
+    """
+    chunks: List[List[Tuple[int, bytes]]] = []
+    chunk: List[Tuple[int, bytes]] = []
+    size = _BATCH_BODY_OVERHEAD
+    for index, payload in prepared:
+        request_size = _batch_request_size(index, payload)
+        if chunk and (len(chunk) >= max_requests or size + request_size > max_bytes):
+            chunks.append(chunk)
+            chunk, size = [], _BATCH_BODY_OVERHEAD
+        chunk.append((index, payload))
+        size += request_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _batch_request_size(index: int, payload: bytes) -> int:
+    """Bytes que ocupa una petición sendMail en el cuerpo de $batch (con su separador)"""
+    return len(_BATCH_REQUEST_PREFIX % index) + len(payload) + 2
+
+def _large_attachments(graph_attachments: Optional[List[GraphAttachment]]) -> List[LargeAttachment]:
+    """Adjuntos que deben subirse con sesión de carga"""
+    return [attachment for attachment in graph_attachments or [] if isinstance(attachment, LargeAttachment)]
+
+def _decoded_size(content_b64: str) -> int:
+    """Tamaño aproximado del contenido de una cadena base64 sin decodificarla"""
+    return len(content_b64) * 3 // 4
+
+def _sub_response_index(sub_response: Any, pending: Mapping[int, bytes]) -> Optional[int]:
+    """
+    Posición en el lote de una respuesta de `$batch`, o None si su id falta,
+    no es numérico o no corresponde a ninguna petición pendiente
+    """
+    if not isinstance(sub_response, dict):
+        return None
+    try:
+        index = int(sub_response.get("id"))
+    except (TypeError, ValueError):
+        return None
+    return index if index in pending else None
+
+def _is_permanent_status(status_code: Optional[int]) -> bool:
+    """
+    Indica si una respuesta de Graph rechaza el mensaje en sí (4xx), de modo que
+    reintentarlo no cambiará el resultado. Los errores de autenticación y permisos
+    dependen de la cuenta y no cuentan como definitivos.
+    """
+    if status_code is None or not 400 <= status_code < 500:
+        return False
+    return status_code not in RETRYABLE_STATUS_CODES and status_code not in (401, 403, 408)
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Segundos indicados en el encabezado Retry-After (None si no está o no es numérico)"""
+    for name, value in headers.items():
+        if name.lower() == "retry-after":
+            try:
+                return max(0.0, float(value))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def _graph_error_message(body: Any) -> str:
+    """Extrae el mensaje de error de la respuesta de Graph API"""
+    if isinstance(body, dict) and isinstance(body.get("error"), dict):
+        error = body["error"]
+        return f"{error.get('code', '')}: {error.get('message', '')}".strip(": ")
+    return str(body)
@@ -0,0 +1,358 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from app.config import get_settings
+from app.core.providers.base import BaseEmailProvider
+from app.core.providers.outlook.email_provider import OutlookEmailProvider
+from app.core.providers.titan.email_provider import TitanEmailProvider
+from app.schemas.email import EmailRequest, EmailResponse
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Proveedores que pueden usarse como rutas; el resto de claves de cada ruta
+# se pasan a su constructor (cuenta, contraseña, buzón...)
+ROUTE_PROVIDERS: Dict[str, Callable[..., BaseEmailProvider]] = {
+    "titan": TitanEmailProvider,
+    "outlook": OutlookEmailProvider,
+}
+
+ROUTING_STRATEGIES = ("weighted", "least_in_flight")
+
+class CircuitBreaker:
+    """
+    Circuito de salud de una ruta.
+    
+    Tras `failure_threshold` fallos consecutivos el circuito se abre y la ruta
+    deja de recibir envíos durante `open_seconds`; pasado ese tiempo queda
+    semiabierto y admite un único envío de prueba que lo cierra si tiene éxito
+    o lo vuelve a abrir si falla.
+    """
+    
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+    
+    def allows(self) -> bool:
+        """Indica si la ruta puede recibir un envío ahora"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self._opened_at >= self.open_seconds
+        return not self._probe_in_flight
+    
+    def on_dispatch(self) -> None:
+        """Registra que se ha asignado un envío a la ruta"""
+        if self.state == "open" and self.allows():
+            self.state = "half_open"
+        if self.state == "half_open":
+            self._probe_in_flight = True
+    
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probe_in_flight = False
+        self.state = "closed"
+    
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+class _Route:
+    """Back-end de envío con su peso, su circuito y sus contadores"""
+    
+    def __init__(self, name: str, provider: BaseEmailProvider, weight: int):
+        self.name = name
+        self.provider = provider
+        self.weight = max(1, weight)
+        self.breaker = CircuitBreaker(settings.ROUTING_FAILURE_THRESHOLD, settings.ROUTING_OPEN_SECONDS)
+        self.in_flight = 0
+        # Peso acumulado del reparto round-robin ponderado suave
+        self.current_weight = 0
+        self.sent = 0
+        self.failed = 0
+        self.failovers = 0
+
+class RoutingEmailProvider(BaseEmailProvider):
+    """
+    Proveedor que reparte los envíos entre varios back-ends (varias cuentas de
+    Titan, buzones de Outlook...).
+    
+    Los envíos se reparten por peso (`weighted`) o hacia la ruta con menos
+    envíos en curso en proporción a su peso (`least_in_flight`). Cada ruta tiene
+    un circuito de salud: los errores y los envíos lentos lo abren y, mientras
+    está abierto, la ruta no recibe tráfico. Un envío fallido por un error del
+    back-end se reintenta en la siguiente ruta disponible.
+    """
+    
+    def __init__(self, routes: List[_Route], strategy: str = "weighted"):
+        """
+        Args:
+            routes: Rutas de envío
+            strategy: Estrategia de reparto (`weighted` o `least_in_flight`)
+        
+        Raises:
+            ValueError: Si no hay rutas o la estrategia no es válida
+        """
+        if not routes:
+            raise ValueError("El proveedor de enrutado necesita al menos una ruta")
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Estrategia de enrutado no válida: {strategy}")
+        self.routes = routes
+        self.strategy = strategy
+    
+    @classmethod
+    def from_settings(cls) -> "RoutingEmailProvider":
+        """
+        Crea el proveedor con las rutas definidas en EMAIL_ROUTES
+        
+        Raises:
+            ValueError: Si EMAIL_ROUTES no es una lista de rutas válida
+        """
+        try:
+            definitions = json.loads(settings.EMAIL_ROUTES or "[]")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"EMAIL_ROUTES no es un JSON válido: {str(e)}") from None
+        if not isinstance(definitions, list):
+            raise ValueError("EMAIL_ROUTES debe ser una lista de rutas")
+        
+        routes: List[_Route] = []
+        for index, definition in enumerate(definitions):
+            if not isinstance(definition, dict):
+                raise ValueError(f"Ruta {index} de EMAIL_ROUTES no válida: debe ser un objeto")
+            options = dict(definition)
+            provider_name = str(options.pop("provider", "")).lower()
+            name = str(options.pop("name", f"{provider_name}-{index}"))
+            weight = options.pop("weight", 1)
+            
+            factory = ROUTE_PROVIDERS.get(provider_name)
+            if factory is None:
+                raise ValueError(f"Proveedor de la ruta '{name}' no válido: {provider_name or '(vacío)'}")
+            if any(route.name == name for route in routes):
+                raise ValueError(f"Nombre de ruta duplicado en EMAIL_ROUTES: {name}")
+            if not isinstance(weight, int) or weight < 1:
+                raise ValueError(f"Peso de la ruta '{name}' no válido: {weight}")
+            try:
+                provider = factory(**options)
+            except TypeError as e:
+                raise ValueError(f"Opciones de la ruta '{name}' no válidas: {str(e)}") from None
+            routes.append(_Route(name, provider, weight))
+        
+        return cls(routes, settings.EMAIL_ROUTING_STRATEGY)
+    
+    async def startup(self) -> None:
+        """Inicializa los recursos de todas las rutas"""
+        await asyncio.gather(*(route.provider.startup() for route in self.routes))
+    
+    async def warm_up(self) -> None:
+        """Calienta todas las rutas; el fallo de una no impide calentar las demás"""
+        results = await asyncio.gather(
+            *(route.provider.warm_up() for route in self.routes),
+            return_exceptions=True
+        )
+        failed = []
+        for route, result in zip(self.routes, results):
+            if isinstance(result, Exception):
+                logger.error("Error al calentar la ruta '%s': %s", route.name, result)
+                failed.append(route.name)
+        if failed:
+            raise RuntimeError(f"Rutas sin calentar: {', '.join(failed)}")
+    
+    async def shutdown(self) -> None:
+        """Libera los recursos de todas las rutas"""
+        results = await asyncio.gather(
+            *(route.provider.shutdown() for route in self.routes),
+            return_exceptions=True
+        )
+        for route, result in zip(self.routes, results):
+            if isinstance(result, Exception):
+                logger.error("Error al detener la ruta '%s': %s", route.name, result)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve el estado de cada ruta y las estadísticas de su proveedor"""
+        return {
+            "strategy": self.strategy,
+            "routes": [
+                {
+                    "name": route.name,
+                    "provider": type(route.provider).__name__,
+                    "weight": route.weight,
+                    "state": route.breaker.state,
+                    "in_flight": route.in_flight,
+                    "sent": route.sent,
+                    "failed": route.failed,
+                    "failovers": route.failovers,
+                    "stats": route.provider.get_stats()
+                }
+                for route in self.routes
+            ]
+        }
+    
+    async def send_email(self, email_data: EmailRequest) -> EmailResponse:
+        """
+        Envía un correo por la ruta elegida, pasando a la siguiente si falla
+        
+        Args:
+            email_data: Datos del correo a enviar
+        
+        Returns:
+            EmailResponse: Resultado del envío
+        """
+        tried: Set[_Route] = set()
+        response: Optional[EmailResponse] = None
+        while True:
+            route = self._select(tried)
+            if route is None:
+                return response or _no_route_response()
+            route.breaker.on_dispatch()
+            tried.add(route)
+            
+            response = (await self._dispatch(route, [email_data]))[0]
+            if not _is_backend_failure(response):
+                return response
+            route.failovers += 1
+            logger.warning("Envío fallido en la ruta '%s', probando otra ruta: %s", route.name, response.message)
+    
+    async def send_batch(self, messages: List[EmailRequest]) -> List[EmailResponse]:
+        """
+        Reparte un lote entre las rutas disponibles y reintenta en otra ruta los
+        mensajes que fallan por un error del back-end
+        
+        Args:
+            messages: Correos a enviar
+        
+        Returns:
+            List[EmailResponse]: Resultado de cada envío, en el mismo orden
+        """
+        results: List[Optional[EmailResponse]] = [None] * len(messages)
+        tried: List[Set[_Route]] = [set() for _ in messages]
+        pending = list(range(len(messages)))
+        
+        while pending:
+            # Cada ruta recibe su parte del lote como un sub-lote propio
+            assignments: Dict[_Route, List[int]] = {}
+            assigned: Dict[_Route, int] = {}
+            for index in pending:
+                route = self._select(tried[index], assigned)
+                if route is None:
+                    results[index] = results[index] or _no_route_response()
+                    continue
+                assignments.setdefault(route, []).append(index)
+                assigned[route] = assigned.get(route, 0) + 1
+            if not assignments:
+                break
+            
+            for route in assignments:
+                route.breaker.on_dispatch()
+            outcomes = await asyncio.gather(*(
+                self._dispatch(route, [messages[index] for index in indices])
+                for route, indices in assignments.items()
+            ))
+            
+            pending = []
+            for (route, indices), responses in zip(assignments.items(), outcomes):
+                for index, response in zip(indices, responses):
+                    results[index] = response
+                    if _is_backend_failure(response):
+                        tried[index].add(route)
+                        route.failovers += 1
+                        pending.append(index)
+            if pending:
+                logger.warning("%s envíos del lote fallidos, probando otras rutas", len(pending))
+        
+        return results
+    
+    def _select(self, exclude: Set[_Route], assigned: Optional[Dict[_Route, int]] = None) -> Optional[_Route]:
+        """
+        Elige la ruta del siguiente envío entre las que tienen el circuito cerrado
+        
+        Args:
+            exclude: Rutas ya probadas para este envío
+            assigned: Envíos ya asignados a cada ruta en el reparto en curso
+        
+        Returns:
+            Optional[_Route]: Ruta elegida (None si no queda ninguna disponible)
+        """
+        candidates = [route for route in self.routes if route not in exclude and route.breaker.allows()]
+        if not candidates:
+            return None
+        
+        if self.strategy == "least_in_flight":
+            assigned = assigned or {}
+            return min(
+                candidates,
+                key=lambda route: ((route.in_flight + assigned.get(route, 0)) / route.weight, -route.weight)
+            )
+        
+        # Round-robin ponderado suave: reparte según el peso sin ráfagas a una sola ruta
+        total = 0
+        chosen = candidates[0]
+        for route in candidates:
+            route.current_weight += route.weight
+            total += route.weight
+            if route.current_weight > chosen.current_weight:
+                chosen = route
+        chosen.current_weight -= total
+        return chosen
+    
+    async def _dispatch(self, route: _Route, messages: List[EmailRequest]) -> List[EmailResponse]:
+        """
+        Envía mensajes por una ruta y actualiza su circuito según el resultado
+        
+        Returns:
+            List[EmailResponse]: Resultado de cada envío, en el mismo orden
+        """
+        route.in_flight += len(messages)
+        started = time.monotonic()
+        try:
+            if len(messages) == 1:
+                responses = [await route.provider.send_email(messages[0])]
+            else:
+                responses = await route.provider.send_batch(messages)
+        except Exception as e:
+            logger.exception("Error inesperado en la ruta '%s': %s", route.name, e)
+            responses = [
+                EmailResponse(success=False, message=f"Error inesperado en la ruta '{route.name}': {str(e)}")
+                for _ in messages
+            ]
+        finally:
+            route.in_flight -= len(messages)
+        
+        # En los lotes se compara el tiempo medio por mensaje
+        elapsed = (time.monotonic() - started) / len(messages)
+        failures = sum(1 for response in responses if _is_backend_failure(response))
+        route.sent += len(messages) - failures
+        route.failed += failures
+        
+        if failures == len(messages) or elapsed > settings.ROUTING_SLOW_CALL_SECONDS:
+            route.breaker.record_failure()
+            if route.breaker.state == "open":
+                reason = "errores" if failures else f"lentitud ({elapsed:.1f}s por envío)"
+                logger.warning("Circuito de la ruta '%s' abierto por %s", route.name, reason)
+        else:
+            route.breaker.record_success()
+        return responses
+
+def _is_backend_failure(response: EmailResponse) -> bool:
+    """
+    Indica si un envío falló por el back-end. Los rechazos de destinatarios los
+    decide el servidor de destino, y los errores definitivos (`retryable=False`)
+    dependen del propio mensaje: ninguno se reintenta en otra ruta ni cuenta
+    para el circuito.
+    """
+    return not response.success and not response.refused_recipients and response.retryable is not False
+
+def _no_route_response() -> EmailResponse:
+    return EmailResponse(
+        success=False,
+        message="Error al enviar correo: no hay rutas de envío disponibles"
+    )
@@ -1,6 +1,8 @@
 import logging
 from smtplib import SMTP
+from typing import Optional
 from app.config import get_settings
+from app.core import metrics
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -8,11 +10,24 @@ logger = logging.getLogger(__name__)
 class TitanAuth:
     """Clase para manejar la autenticación con Titan Email SMTP"""
     
-    def __init__(self):
-        self.smtp_server = settings.TITAN_SMTP_SERVER
-        self.smtp_port = settings.TITAN_SMTP_PORT
-        self.sender_email = settings.TITAN_SENDER_EMAIL
-        self.sender_password = settings.TITAN_SENDER_PASSWORD
+    def __init__(
+        self,
+        sender_email: Optional[str] = None,
+        sender_password: Optional[str] = None,
+        smtp_server: Optional[str] = None,
+        smtp_port: Optional[int] = None
+    ):
+        """
+        Args:
+            sender_email: Cuenta remitente (por defecto TITAN_SENDER_EMAIL)
+            sender_password: Contraseña de la cuenta (por defecto TITAN_SENDER_PASSWORD)
+            smtp_server: Servidor SMTP (por defecto TITAN_SMTP_SERVER)
+            smtp_port: Puerto SMTP (por defecto TITAN_SMTP_PORT)
+        """
+        self.smtp_server = smtp_server or settings.TITAN_SMTP_SERVER
+        self.smtp_port = smtp_port or settings.TITAN_SMTP_PORT
+        self.sender_email = sender_email or settings.TITAN_SENDER_EMAIL
+        self.sender_password = sender_password if sender_password is not None else settings.TITAN_SENDER_PASSWORD
     
     def get_smtp_connection(self) -> SMTP:
         """
@@ -25,21 +40,23 @@ class TitanAuth:
             Exception: Si hay un error en la autenticación o conexión
         """
         try:
-            logger.info(f"Conectando al servidor SMTP de Titan: {self.smtp_server}:{self.smtp_port}")
-            
-            # Crear la conexión SMTP
-            smtp_conn = SMTP(self.smtp_server, self.smtp_port)
-            
-            # Iniciar TLS para conexión segura
-            smtp_conn.starttls()
+            logger.info("Conectando al servidor SMTP de Titan: %s:%s", self.smtp_server, self.smtp_port)
             
-            # Autenticar con las credenciales
-            logger.info(f"Autenticando con el usuario: {self.sender_email}")
-            smtp_conn.login(self.sender_email, self.sender_password)
+            with metrics.stage(metrics.STAGE_AUTH, "titan"):
+                # Crear la conexión SMTP
+                smtp_conn = SMTP(self.smtp_server, self.smtp_port)
+                
+                # Iniciar TLS para conexión segura
+                if settings.TITAN_SMTP_STARTTLS:
+                    smtp_conn.starttls()
+                
+                # Autenticar con las credenciales
+                logger.info("Autenticando con el usuario: %s", self.sender_email)
+                smtp_conn.login(self.sender_email, self.sender_password)
             
             logger.info("Conexión SMTP establecida correctamente")
             return smtp_conn
         
         except Exception as e:
-            logger.exception(f"Error al establecer conexión SMTP: {str(e)}")
+            logger.exception("Error al establecer conexión SMTP: %s", e)
             raise
\ No newline at end of file
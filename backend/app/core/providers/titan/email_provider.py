@@ -1,17 +1,27 @@
-import base64
+import asyncio
+import contextvars
 import logging
 import mimetypes
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from email.mime.image import MIMEImage
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import formataddr
-from typing import List, Dict, Any, Optional
+from smtplib import SMTPAuthenticationError, SMTPException, SMTPRecipientsRefused, SMTPResponseException
+from typing import List, Dict, Any, Optional, Tuple
 
 from app.config import get_settings
-from app.core.providers.base import BaseEmailProvider
+from app.logging_config import SAMPLED
+from app.core import metrics
+from app.core.attachment_store import get_attachment_store
+from app.core.rate_limiter import get_rate_limiter
+from app.core.providers.base import BaseEmailProvider, attachments_key, is_permanent_error
 from app.core.providers.titan.auth import TitanAuth
-from app.schemas.email import EmailRequest, EmailResponse, Attachment
+from app.core.providers.titan.mime import (
+    AttachmentPart, BulkMimeAssembler, MimePart, MultipartPart, TextPart, send_streaming
+)
+from app.core.providers.titan.pool import SMTPConnectionPool
+from app.core.template_engine import compile_template
+from app.schemas.email import EmailRequest, EmailResponse, Attachment, RefusedRecipient
+from app.utils.helpers import apply_template_variables
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -19,10 +29,62 @@ logger = logging.getLogger(__name__)
 class TitanEmailProvider(BaseEmailProvider):
     """Implementación del proveedor de correo utilizando Titan Email"""
     
-    def __init__(self):
-        self.auth = TitanAuth()
-        self.sender_email = settings.TITAN_SENDER_EMAIL
-        self.sender_name = settings.APP_NAME
+    def __init__(
+        self,
+        sender_email: Optional[str] = None,
+        sender_password: Optional[str] = None,
+        sender_name: Optional[str] = None,
+        smtp_server: Optional[str] = None,
+        smtp_port: Optional[int] = None
+    ):
+        """
+        Args:
+            sender_email: Cuenta remitente (por defecto TITAN_SENDER_EMAIL)
+            sender_password: Contraseña de la cuenta (por defecto TITAN_SENDER_PASSWORD)
+            sender_name: Nombre visible del remitente (por defecto APP_NAME)
+            smtp_server: Servidor SMTP (por defecto TITAN_SMTP_SERVER)
+            smtp_port: Puerto SMTP (por defecto TITAN_SMTP_PORT)
+        """
+        self.auth = TitanAuth(sender_email, sender_password, smtp_server, smtp_port)
+        self.sender_email = self.auth.sender_email
+        self.sender_name = sender_name if sender_name is not None else settings.APP_NAME
+        self.attachment_store = get_attachment_store()
+        self.pool = SMTPConnectionPool(
+            self.auth.get_smtp_connection,
+            max_size=settings.TITAN_SMTP_POOL_SIZE,
+            idle_timeout=settings.TITAN_SMTP_POOL_IDLE_TIMEOUT
+        )
+        # Límite de envíos de la cuenta remitente, adaptado a las respuestas 4xx del servidor
+        self.rate_limiter = get_rate_limiter("titan", self.sender_email)
+        # smtplib es bloqueante: los envíos se ejecutan en un pool de hilos
+        # dedicado y acotado para no detener el event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.TITAN_SMTP_MAX_CONCURRENCY),
+            thread_name_prefix="titan-smtp"
+        )
+        # Mensajes construidos con las partes comunes de su lote ya serializadas
+        self._shared_parts_messages = 0
+    
+    async def warm_up(self) -> None:
+        """Abre por adelantado sesiones SMTP autenticadas en el pool"""
+        loop = asyncio.get_running_loop()
+        idle = await loop.run_in_executor(
+            self._executor, self.pool.warm_up, settings.TITAN_SMTP_WARMUP_CONNECTIONS
+        )
+        logger.info("Pool SMTP de %s calentado: %s sesiones abiertas", self.sender_email, idle)
+    
+    async def shutdown(self) -> None:
+        """Cierra las sesiones SMTP del pool y el pool de hilos de envío"""
+        await asyncio.to_thread(self._executor.shutdown, True)
+        self.pool.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve estadísticas del pool de conexiones SMTP, del limitador de envíos y de los lotes"""
+        return {
+            **self.pool.get_stats(),
+            "rate_limit": self.rate_limiter.get_stats(),
+            "bulk_shared_parts_messages": self._shared_parts_messages
+        }
     
     async def send_email(self, email_data: EmailRequest) -> EmailResponse:
         """
@@ -30,78 +92,392 @@ class TitanEmailProvider(BaseEmailProvider):
         
         Args:
             email_data: Datos del correo a enviar
+        
+        Returns:
+            EmailResponse: Resultado del envío
+        """
+        return await self._send(email_data)
+    
+    async def send_batch(self, messages: List[EmailRequest]) -> List[EmailResponse]:
+        """
+        Envía un lote de correos procesando una sola vez los adjuntos compartidos
+        por varios mensajes y reutilizando las sesiones SMTP del pool.
+        
+        Con `TITAN_SMTP_ENVELOPE_BATCHING` los mensajes cuyo contenido renderizado
+        es idéntico se entregan en un único sobre (un DATA con varios RCPT TO).
+        
+        Args:
+            messages: Correos a enviar
+        
+        Returns:
+            List[EmailResponse]: Resultado de cada envío, en el mismo orden
+        """
+        # Los mensajes de un envío masivo comparten los mismos adjuntos
+        loop = asyncio.get_running_loop()
+        processed: Dict[Tuple, Optional[List[AttachmentPart]]] = {}
+        message_parts: List[Optional[List[AttachmentPart]]] = []
+        for email_data in messages:
+            attachment_parts = None
+            if email_data.attachments:
+                key = attachments_key(email_data.attachments)
+                if key not in processed:
+                    try:
+                        processed[key] = await loop.run_in_executor(
+                            self._executor, self.process_attachments, email_data.attachments
+                        )
+                    except Exception as e:
+                        # Cada mensaje reintentará procesarlos y reportará el error en su resultado
+                        logger.error("Error al procesar los adjuntos del lote: %s", e)
+                        processed[key] = None
+                attachment_parts = processed[key]
+            message_parts.append(attachment_parts)
+        
+        message_assemblers = await self._prepare_assemblers(messages, processed)
+        self._shared_parts_messages += sum(1 for assembler in message_assemblers if assembler is not None)
+        
+        if not settings.TITAN_SMTP_ENVELOPE_BATCHING:
+            return list(await asyncio.gather(*[
+                self._send(email_data, attachment_parts, assembler)
+                for email_data, attachment_parts, assembler in zip(messages, message_parts, message_assemblers)
+            ]))
+        
+        envelopes = self._group_envelopes(messages, message_parts)
+        outcomes = await asyncio.gather(*[
+            self._send_envelope(
+                [messages[index] for index in envelope], message_parts[envelope[0]], message_assemblers[envelope[0]]
+            )
+            for envelope in envelopes
+        ])
+        
+        results: List[Optional[EmailResponse]] = [None] * len(messages)
+        for envelope, responses in zip(envelopes, outcomes):
+            for index, response in zip(envelope, responses):
+                results[index] = response
+        return results
+    
+    async def _prepare_assemblers(
+        self,
+        messages: List[EmailRequest],
+        processed: Dict[Tuple, Optional[List[AttachmentPart]]]
+    ) -> List[Optional[BulkMimeAssembler]]:
+        """
+        Prepara un ensamblador por cada grupo de mensajes del lote que comparte
+        adjuntos, para serializar una sola vez las partes invariables
+        
+        Returns:
+            List[Optional[BulkMimeAssembler]]: Ensamblador de cada mensaje (None si
+            el mensaje no comparte sus partes con ningún otro)
+        """
+        loop = asyncio.get_running_loop()
+        group_keys = [attachments_key(email_data.attachments) for email_data in messages]
+        assemblers: Dict[Optional[Tuple], BulkMimeAssembler] = {}
+        for key, count in Counter(group_keys).items():
+            attachment_parts = processed.get(key) if key is not None else []
+            if count < 2 or attachment_parts is None:
+                continue
+            try:
+                assemblers[key] = await loop.run_in_executor(
+                    self._executor, BulkMimeAssembler, attachment_parts, settings.TITAN_BULK_SHARED_PARTS_MAX_BYTES
+                )
+            except Exception as e:
+                # Los mensajes del grupo se construyen por separado, como sin ensamblador
+                logger.error("Error al preparar las partes comunes del lote: %s", e)
+        return [assemblers.get(key) for key in group_keys]
+    
+    def _group_envelopes(
+        self,
+        messages: List[EmailRequest],
+        message_parts: List[Optional[List[AttachmentPart]]]
+    ) -> List[List[int]]:
+        """
+        Agrupa los mensajes de un lote cuyo contenido renderizado es idéntico
+        
+        Returns:
+            List[List[int]]: Posiciones de los mensajes de cada sobre, respetando
+            el límite de destinatarios por sobre
+        """
+        max_recipients = max(1, settings.TITAN_SMTP_MAX_RCPT_PER_ENVELOPE)
+        groups: Dict[Any, List[int]] = {}
+        envelopes: List[List[int]] = []
+        
+        for index, (email_data, attachment_parts) in enumerate(zip(messages, message_parts)):
+            # Los mensajes con copia o copia oculta se envían por separado: sus
+            # encabezados no pueden compartirse
+            if email_data.cc_recipients or email_data.bcc_recipients or (email_data.attachments and attachment_parts is None):
+                envelopes.append([index])
+                continue
             
+            is_html = email_data.body_type.upper() == "HTML"
+            content = apply_template_variables(
+                email_data.body, email_data.template_variables, escape=is_html and settings.TEMPLATE_ESCAPE_HTML
+            )
+            key = (
+                email_data.subject,
+                is_html,
+                email_data.importance,
+                content,
+                tuple((part.attachment_id, part.filename, part.content_type) for part in attachment_parts or ())
+            )
+            groups.setdefault(key, []).append(index)
+        
+        for indices in groups.values():
+            envelope: List[int] = []
+            recipient_count = 0
+            for index in indices:
+                count = len(messages[index].to_recipients)
+                if envelope and recipient_count + count > max_recipients:
+                    envelopes.append(envelope)
+                    envelope, recipient_count = [], 0
+                envelope.append(index)
+                recipient_count += count
+            if envelope:
+                envelopes.append(envelope)
+        return envelopes
+    
+    async def _send_envelope(
+        self,
+        messages: List[EmailRequest],
+        attachment_parts: Optional[List[AttachmentPart]] = None,
+        assembler: Optional[BulkMimeAssembler] = None
+    ) -> List[EmailResponse]:
+        """
+        Entrega varios mensajes idénticos en un solo sobre SMTP y reparte el resultado
+        
+        Args:
+            messages: Mensajes con el mismo contenido renderizado
+            attachment_parts: Partes MIME de los adjuntos ya procesadas (opcional)
+            assembler: Partes comunes del lote ya serializadas (opcional)
+        
+        Returns:
+            List[EmailResponse]: Resultado de cada mensaje, en el mismo orden
+        """
+        if len(messages) == 1:
+            return [await self._send(messages[0], attachment_parts, assembler)]
+        
+        recipients = [recipient for email_data in messages for recipient in email_data.to_recipients]
+        merged = messages[0].model_copy(update={"to_recipients": recipients})
+        logger.info(
+            "Enviando correo con asunto: %s a %d destinatarios en un solo sobre", merged.subject, len(recipients), extra=SAMPLED
+        )
+        
+        try:
+            refused = await self._deliver_with_rate_limit(merged, attachment_parts, undisclosed=True, assembler=assembler)
+        except SMTPRecipientsRefused as e:
+            refused = e.recipients
+        except Exception as e:
+            logger.exception("Error al enviar correo: %s", e)
+            return [
+                EmailResponse(success=False, message=f"Error al enviar correo: {str(e)}")
+                for _ in messages
+            ]
+        
+        return [
+            self._build_response({
+                recipient.email: refused[recipient.email]
+                for recipient in email_data.to_recipients
+                if recipient.email in refused
+            }, len(email_data.to_recipients))
+            for email_data in messages
+        ]
+    
+    async def _send(
+        self,
+        email_data: EmailRequest,
+        attachment_parts: Optional[List[AttachmentPart]] = None,
+        assembler: Optional[BulkMimeAssembler] = None
+    ) -> EmailResponse:
+        """
+        Envía un correo en el pool de hilos del proveedor
+        
+        Args:
+            email_data: Datos del correo a enviar
+            attachment_parts: Partes MIME de los adjuntos ya procesadas (opcional)
+            assembler: Partes comunes del lote ya serializadas (opcional)
+        
         Returns:
             EmailResponse: Resultado del envío
         """
         try:
-            # Crear el mensaje MIME
-            msg = self._create_mime_message(email_data)
+            logger.info("Enviando correo con asunto: %s", email_data.subject, extra=SAMPLED)
             
-            # Obtener la conexión SMTP
-            smtp_conn = self.auth.get_smtp_connection()
+            refused = await self._deliver_with_rate_limit(email_data, attachment_parts, assembler=assembler)
             
-            try:
-                # Enviar el correo
-                logger.info(f"Enviando correo con asunto: {email_data.subject}")
-                
-                # Lista de destinatarios para el envío SMTP
-                recipient_emails = [r.email for r in email_data.to_recipients]
-                
-                if email_data.cc_recipients:
-                    recipient_emails.extend([r.email for r in email_data.cc_recipients])
-                
-                if email_data.bcc_recipients:
-                    recipient_emails.extend([r.email for r in email_data.bcc_recipients])
-                
-                # Enviar el mensaje
-                smtp_conn.send_message(msg)
-                
-                logger.info("Correo enviado exitosamente")
-                
-                return EmailResponse(
-                    success=True,
-                    message="Correo enviado exitosamente",
-                    email_id=None
-                )
+            logger.info("Correo enviado exitosamente", extra=SAMPLED)
             
-            finally:
-                # Cerrar la conexión SMTP
-                smtp_conn.quit()
+            return self._build_response(refused, _count_recipients(email_data))
+        
+        except SMTPRecipientsRefused as e:
+            logger.error("Todos los destinatarios fueron rechazados: %s", ', '.join(e.recipients))
+            return self._build_response(e.recipients, _count_recipients(email_data))
         
         except Exception as e:
-            logger.exception(f"Error al enviar correo: {str(e)}")
+            logger.exception("Error al enviar correo: %s", e)
             return EmailResponse(
                 success=False,
-                message=f"Error al enviar correo: {str(e)}"
+                message=f"Error al enviar correo: {str(e)}",
+                retryable=False if _is_permanent(e) else None
             )
     
-    def _create_mime_message(self, email_data: EmailRequest) -> MIMEMultipart:
+    async def _deliver_with_rate_limit(
+        self,
+        email_data: EmailRequest,
+        attachment_parts: Optional[List[AttachmentPart]] = None,
+        undisclosed: bool = False,
+        assembler: Optional[BulkMimeAssembler] = None
+    ) -> Dict[str, Tuple[int, bytes]]:
         """
-        Crea un mensaje MIME a partir de los datos del correo
+        Entrega un mensaje en el pool de hilos respetando el límite de envíos de la
+        cuenta. Las respuestas SMTP 4xx (limitación o error temporal) reducen la
+        tasa de envío y el mensaje se reintenta tras la pausa.
+        
+        Returns:
+            Dict[str, Tuple[int, bytes]]: Destinatarios rechazados por el servidor
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire()
+            try:
+                # Con el contexto actual, para que las métricas del hilo conserven la plantilla
+                refused = await loop.run_in_executor(
+                    self._executor, contextvars.copy_context().run,
+                    self._deliver, email_data, attachment_parts, undisclosed, assembler
+                )
+            except SMTPException as e:
+                if not _is_transient(e) or attempt >= settings.RATE_LIMIT_MAX_RETRIES:
+                    raise
+                attempt += 1
+                self.rate_limiter.on_throttle()
+                logger.warning("Respuesta temporal del servidor SMTP, reintento %s: %s", attempt, e)
+                continue
+            self.rate_limiter.on_success()
+            return refused
+    
+    @staticmethod
+    def _build_response(refused: Dict[str, Tuple[int, bytes]], recipient_count: int) -> EmailResponse:
+        """
+        Crea la respuesta de un envío a partir de los destinatarios rechazados
         
         Args:
-            email_data: Datos del correo
-            
+            refused: Destinatarios rechazados con el código y la respuesta del servidor
+            recipient_count: Número de destinatarios del mensaje
+        """
+        if not refused:
+            return EmailResponse(
+                success=True,
+                message="Correo enviado exitosamente",
+                email_id=None
+            )
+        
+        refused_recipients = [
+            RefusedRecipient(
+                email=email,
+                code=code,
+                message=response.decode("utf-8", errors="replace") if isinstance(response, bytes) else str(response)
+            )
+            for email, (code, response) in refused.items()
+        ]
+        if len(refused) >= recipient_count:
+            return EmailResponse(
+                success=False,
+                message="Error al enviar correo: el servidor rechazó todos los destinatarios",
+                refused_recipients=refused_recipients,
+                # Los rechazos 5xx son definitivos: reintentar no cambiará la respuesta
+                retryable=False if all(code >= 500 for code, _ in refused.values()) else None
+            )
+        return EmailResponse(
+            success=True,
+            message=f"Correo enviado exitosamente ({len(refused)} destinatarios rechazados)",
+            refused_recipients=refused_recipients
+        )
+    
+    def _deliver(
+        self,
+        email_data: EmailRequest,
+        attachment_parts: Optional[List[AttachmentPart]] = None,
+        undisclosed: bool = False,
+        assembler: Optional[BulkMimeAssembler] = None
+    ) -> Dict[str, Tuple[int, bytes]]:
+        """
+        Construye y envía el mensaje de forma síncrona.
+        Se ejecuta en el pool de hilos del proveedor.
+        
+        Args:
+            email_data: Datos del correo a enviar
+            attachment_parts: Partes MIME de los adjuntos ya procesadas (opcional)
+            undisclosed: Ocultar los destinatarios en el encabezado To (envíos agrupados)
+            assembler: Partes comunes del lote ya serializadas (opcional)
+        
         Returns:
-            MIMEMultipart: Mensaje MIME completo
+            Dict[str, Tuple[int, bytes]]: Destinatarios rechazados por el servidor
+        
+        Raises:
+            SMTPRecipientsRefused: Si el servidor rechaza todos los destinatarios
         """
         # Crear el mensaje MIME
-        msg = MIMEMultipart('mixed')
+        with metrics.stage(metrics.STAGE_BUILD, "titan"):
+            msg = self._create_mime_message(email_data, attachment_parts, undisclosed=undisclosed, assembler=assembler)
         
+        # Lista de destinatarios para el envío SMTP (sobre), incluidos los ocultos
+        recipient_emails = [r.email for r in email_data.to_recipients]
+        
+        if email_data.cc_recipients:
+            recipient_emails.extend([r.email for r in email_data.cc_recipients])
+        
+        if email_data.bcc_recipients:
+            recipient_emails.extend([r.email for r in email_data.bcc_recipients])
+        
+        # Enviar el mensaje reutilizando una sesión SMTP del pool; se serializa
+        # por bloques directamente en DATA (de nuevo en cada reintento)
+        with metrics.stage(metrics.STAGE_TRANSPORT, "titan"):
+            refused = self.pool.execute(
+                lambda smtp_conn: send_streaming(smtp_conn, self.sender_email, recipient_emails, msg.iter_bytes())
+            )
+        if refused:
+            logger.warning("Destinatarios rechazados por el servidor: %s", ', '.join(refused))
+        return refused
+    
+    def _create_mime_message(
+        self,
+        email_data: EmailRequest,
+        attachment_parts: Optional[List[AttachmentPart]] = None,
+        undisclosed: bool = False,
+        assembler: Optional[BulkMimeAssembler] = None
+    ) -> MimePart:
+        """
+        Crea un mensaje MIME a partir de los datos del correo.
+        
+        El mensaje no se materializa: se serializa por bloques al enviarlo y los
+        adjuntos se leen ya codificados del almacén, de modo que la memoria usada
+        no depende de su tamaño. Con un ensamblador de lote solo se serializan
+        los encabezados y el cuerpo propios del mensaje.
+        
+        Args:
+            email_data: Datos del correo
+            attachment_parts: Partes MIME de los adjuntos ya procesadas (opcional)
+            undisclosed: Ocultar los destinatarios en el encabezado To (envíos agrupados)
+            assembler: Partes comunes del lote ya serializadas (opcional)
+        
+        Returns:
+            MimePart: Mensaje MIME completo
+        """
         # Configurar los encabezados
-        msg['Subject'] = email_data.subject
+        headers = [('Subject', email_data.subject)]
         
         # Formatear correctamente la dirección del remitente
         from_addr = formataddr((self.sender_name, self.sender_email)) if self.sender_name else self.sender_email
-        msg['From'] = from_addr
+        headers.append(('From', from_addr))
         
         # Configurar destinatarios
-        to_addresses = []
-        for recipient in email_data.to_recipients:
-            to_addresses.append(formataddr((recipient.name, recipient.email)) if recipient.name else recipient.email)
-        
-        msg['To'] = ", ".join(to_addresses)
+        if undisclosed:
+            # Un mismo mensaje para todo el sobre: ningún destinatario ve a los demás
+            headers.append(('To', 'undisclosed-recipients:;'))
+        else:
+            to_addresses = []
+            for recipient in email_data.to_recipients:
+                to_addresses.append(formataddr((recipient.name, recipient.email)) if recipient.name else recipient.email)
+            
+            headers.append(('To', ", ".join(to_addresses)))
         
         # Configurar CC
         if email_data.cc_recipients:
@@ -109,86 +485,109 @@ class TitanEmailProvider(BaseEmailProvider):
             for recipient in email_data.cc_recipients:
                 cc_addresses.append(formataddr((recipient.name, recipient.email)) if recipient.name else recipient.email)
             
-            msg['Cc'] = ", ".join(cc_addresses)
+            headers.append(('Cc', ", ".join(cc_addresses)))
         
         # Configurar importancia/prioridad
         if email_data.importance == "high":
-            msg['Importance'] = 'high'
-            msg['X-Priority'] = '1'
+            headers.append(('Importance', 'high'))
+            headers.append(('X-Priority', '1'))
         elif email_data.importance == "low":
-            msg['Importance'] = 'low'
-            msg['X-Priority'] = '5'
+            headers.append(('Importance', 'low'))
+            headers.append(('X-Priority', '5'))
+        
+        parts: List[MimePart] = []
         
         # Procesar el contenido (HTML o texto)
         if email_data.body_type.upper() == "HTML":
-            # Si hay variables de plantilla, aplicarlas
-            content = email_data.body
-            if email_data.template_variables:
-                for key, value in email_data.template_variables.items():
-                    content = content.replace(f"{{{key}}}", str(value))
-            
-            # Crear parte HTML
-            html_part = MIMEText(content, 'html', 'utf-8')
+            # La plantilla compilada (y su versión en texto plano) se reutiliza
+            # entre todos los mensajes con el mismo cuerpo
+            with metrics.stage(metrics.STAGE_RENDER, "titan"):
+                compiled = compile_template(email_data.body)
+                content = compiled.render(email_data.template_variables, escape=settings.TEMPLATE_ESCAPE_HTML)
+                
+                # Crear también una parte de texto plano como alternativa
+                text_content = compiled.render_text(email_data.template_variables)
             
-            # Crear también una parte de texto plano como alternativa
-            # Versión simple: eliminar etiquetas HTML y mantener el texto
-            import re
-            text_content = re.sub('<[^<]+?>', '', content)
-            text_part = MIMEText(text_content, 'plain', 'utf-8')
+            if assembler is not None:
+                return assembler.assemble(headers, text_content, content)
             
             # Crear una parte alternativa para contenido de texto/html
-            alternative = MIMEMultipart('alternative')
-            alternative.attach(text_part)
-            alternative.attach(html_part)
-            
-            msg.attach(alternative)
+            parts.append(MultipartPart('alternative', [TextPart(text_content, 'plain'), TextPart(content, 'html')]))
         else:
             # Texto plano
-            content = email_data.body
-            if email_data.template_variables:
-                for key, value in email_data.template_variables.items():
-                    content = content.replace(f"{{{key}}}", str(value))
-            
-            text_part = MIMEText(content, 'plain', 'utf-8')
-            msg.attach(text_part)
+            with metrics.stage(metrics.STAGE_RENDER, "titan"):
+                content = apply_template_variables(email_data.body, email_data.template_variables)
+            if assembler is not None:
+                return assembler.assemble(headers, content)
+            parts.append(TextPart(content, 'plain'))
         
         # Procesar adjuntos
         if email_data.attachments:
-            for attachment_part in self.process_attachments(email_data.attachments):
-                msg.attach(attachment_part)
+            if attachment_parts is None:
+                attachment_parts = self.process_attachments(email_data.attachments)
+            parts.extend(attachment_parts)
         
-        return msg
+        return MultipartPart('mixed', parts, headers=headers)
     
-    def process_attachments(self, attachments: List[Attachment]) -> List[Any]:
+    def process_attachments(self, attachments: List[Attachment]) -> List[AttachmentPart]:
         """
         Procesa los archivos adjuntos para el mensaje MIME
         
         Args:
             attachments: Lista de archivos adjuntos
-            
+        
         Returns:
-            List[Any]: Lista de partes MIME para los adjuntos
+            List[AttachmentPart]: Lista de partes MIME para los adjuntos
         """
         attachment_parts = []
         
         for attachment in attachments:
-            # Decodificar el contenido base64
-            content = base64.b64decode(attachment.content)
+            # Los adjuntos se leen ya codificados en base64 MIME desde el almacén al
+            # enviar; el contenido en línea se guarda allí la primera vez que se recibe
+            attachment_id = attachment.attachment_id or self.attachment_store.put_base64(attachment.content)
+            if not self.attachment_store.exists(attachment_id):
+                raise FileNotFoundError(f"Adjunto '{attachment_id}' no encontrado")
             
             # Determinar el tipo MIME
             content_type = attachment.content_type
             if not content_type:
                 content_type = mimetypes.guess_type(attachment.filename)[0] or 'application/octet-stream'
             
-            # Crear la parte MIME según el tipo de contenido
-            if content_type.startswith('image/'):
-                part = MIMEImage(content, maintype='image', subtype=content_type.split('/')[1])
-            else:
-                part = MIMEApplication(content)
+            # Los tipos que no son imágenes se envían como binario genérico
+            if not content_type.startswith('image/'):
+                content_type = 'application/octet-stream'
             
-            # Configurar encabezados para el adjunto
-            part.add_header('Content-Disposition', 'attachment', filename=attachment.filename)
-            
-            attachment_parts.append(part)
+            attachment_parts.append(
+                AttachmentPart(self.attachment_store, attachment_id, attachment.filename, content_type)
+            )
         
-        return attachment_parts
\ No newline at end of file
+        return attachment_parts
+
+def _count_recipients(email_data: EmailRequest) -> int:
+    """Número de destinatarios del sobre de un correo"""
+    return (
+        len(email_data.to_recipients)
+        + len(email_data.cc_recipients or [])
+        + len(email_data.bcc_recipients or [])
+    )
+
+def _is_transient(error: SMTPException) -> bool:
+    """Indica si un error SMTP es temporal (4xx), como las limitaciones de envío"""
+    if isinstance(error, SMTPRecipientsRefused):
+        # Solo si todos los rechazos son temporales
+        return bool(error.recipients) and all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, SMTPResponseException) and 400 <= error.smtp_code < 500
+
+def _is_permanent(error: Exception) -> bool:
+    """
+    Indica si un error de envío es definitivo: datos del mensaje no válidos o
+    respuesta SMTP 5xx. Los errores de autenticación no cuentan como definitivos,
+    porque dependen de la cuenta y no del mensaje.
+    """
+    if is_permanent_error(error):
+        return True
+    return (
+        isinstance(error, SMTPResponseException)
+        and not isinstance(error, SMTPAuthenticationError)
+        and error.smtp_code >= 500
+    )
@@ -0,0 +1,345 @@
+import base64
+import secrets
+from email import policy
+from functools import lru_cache
+from email.message import EmailMessage
+from smtplib import SMTP, SMTPDataError, SMTPRecipientsRefused, SMTPSenderRefused
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.attachment_store import AttachmentStore
+
+# Los encabezados se codifican (RFC 2047/2231) y pliegan con la política SMTP de `email`
+_POLICY = policy.SMTP
+_CRLF = b"\r\n"
+# Bloques de texto codificados de una vez: múltiplo de 57 bytes (una línea base64 MIME)
+_TEXT_CHUNK_SIZE = 57 * 1024
+# Tamaño mínimo de cada escritura en el socket durante DATA
+_SEND_BUFFER_SIZE = 64 * 1024
+
+def _header_block(headers: Sequence[Tuple[str, str, Dict[str, str]]]) -> bytes:
+    """
+    Serializa un bloque de encabezados terminado en línea en blanco
+    
+    Args:
+        headers: Tuplas (nombre, valor, parámetros) en orden
+    """
+    holder = EmailMessage(policy=_POLICY)
+    for name, value, params in headers:
+        holder.add_header(name, value, **params)
+    serialized = holder.as_bytes()
+    # Sin cuerpo asignado, el generador añade un esqueleto vacío tras los encabezados
+    return serialized[:serialized.index(b"\r\n\r\n") + 4]
+
+@lru_cache(maxsize=None)
+def _text_part_header(subtype: str) -> bytes:
+    """Encabezados de una parte de texto: son los mismos en todos los mensajes"""
+    return _header_block([
+        ("Content-Type", f"text/{subtype}", {"charset": "utf-8"}),
+        ("Content-Transfer-Encoding", "base64", {}),
+    ])
+
+def _new_boundary() -> str:
+    # Los delimitadores empiezan por "=_", que no puede aparecer al inicio de una línea base64
+    return "=_" + secrets.token_hex(16)
+
+class _DotSafe(bytes):
+    """
+    Bloque ya preparado para DATA: termina en CRLF y tiene aplicado el escape de
+    puntos, de modo que `dot_stuff` lo deja pasar sin recorrerlo
+    """
+    __slots__ = ()
+
+class MimePart:
+    """Parte MIME que se serializa por bloques"""
+    
+    __slots__ = ()
+    
+    def iter_bytes(self) -> Iterator[bytes]:
+        """Recorre la parte serializada (encabezados y cuerpo) con finales de línea CRLF"""
+        raise NotImplementedError
+
+class TextPart(MimePart):
+    """Parte de texto (plain o html) codificada en base64 UTF-8"""
+    
+    __slots__ = ("content", "subtype")
+    
+    def __init__(self, content: str, subtype: str = "plain"):
+        self.content = content
+        self.subtype = subtype
+    
+    def iter_bytes(self) -> Iterator[bytes]:
+        yield _text_part_header(self.subtype)
+        data = self.content.encode("utf-8")
+        for start in range(0, len(data), _TEXT_CHUNK_SIZE):
+            yield base64.encodebytes(data[start:start + _TEXT_CHUNK_SIZE]).replace(b"\n", _CRLF)
+
+class AttachmentPart(MimePart):
+    """Adjunto leído por bloques del almacén, ya codificado en base64"""
+    
+    __slots__ = ("store", "attachment_id", "filename", "content_type")
+    
+    def __init__(self, store: AttachmentStore, attachment_id: str, filename: str, content_type: str):
+        self.store = store
+        self.attachment_id = attachment_id
+        self.filename = filename
+        self.content_type = content_type
+    
+    def encoded_size(self) -> int:
+        """Tamaño aproximado del adjunto codificado en base64 MIME"""
+        return self.store.get(self.attachment_id).encoded_path.stat().st_size
+    
+    def iter_bytes(self) -> Iterator[bytes]:
+        yield _header_block([
+            ("Content-Type", self.content_type, {}),
+            ("Content-Transfer-Encoding", "base64", {}),
+            ("Content-Disposition", "attachment", {"filename": self.filename}),
+        ])
+        # El almacén guarda las líneas con "\n"; no hay "\r" que pueda quedar partido entre bloques
+        for chunk in self.store.iter_mime_base64(self.attachment_id):
+            yield chunk.replace(b"\n", _CRLF)
+
+class MultipartPart(MimePart):
+    """Contenedor multipart (mixed, alternative...)"""
+    
+    __slots__ = ("subtype", "parts", "headers", "boundary")
+    
+    def __init__(
+        self,
+        subtype: str,
+        parts: List[MimePart],
+        headers: Optional[List[Tuple[str, str]]] = None
+    ):
+        """
+        Args:
+            subtype: Subtipo multipart
+            parts: Partes contenidas
+            headers: Encabezados adicionales (solo en el mensaje de nivel superior)
+        """
+        self.subtype = subtype
+        self.parts = parts
+        self.headers = headers or []
+        self.boundary = _new_boundary()
+    
+    def iter_bytes(self) -> Iterator[bytes]:
+        header_list = [(name, value, {}) for name, value in self.headers]
+        if self.headers:
+            header_list.append(("MIME-Version", "1.0", {}))
+        header_list.append(("Content-Type", f"multipart/{self.subtype}", {"boundary": self.boundary}))
+        yield _header_block(header_list)
+        
+        delimiter = f"--{self.boundary}\r\n".encode("ascii")
+        for part in self.parts:
+            yield delimiter
+            yield from part.iter_bytes()
+            # Cada parte termina en CRLF; el que precede al delimitador pertenece a él
+            yield _CRLF
+        yield f"--{self.boundary}--\r\n".encode("ascii")
+
+class PreparedPart(MimePart):
+    """Parte serializada de antemano, lista para escribirse tal cual en DATA"""
+    
+    __slots__ = ("data",)
+    
+    def __init__(self, part: MimePart):
+        data = b"".join(part.iter_bytes())
+        if data.startswith(b"."):
+            data = b"." + data
+        self.data = _DotSafe(data.replace(b"\n.", b"\n.."))
+    
+    def iter_bytes(self) -> Iterator[bytes]:
+        yield self.data
+
+class BulkMimeAssembler:
+    """
+    Ensamblador de mensajes para los envíos masivos que comparten adjuntos.
+    
+    Las partes invariables (adjuntos codificados, delimitadores y encabezados
+    de las partes) se serializan una sola vez; cada mensaje solo codifica sus
+    encabezados propios y su cuerpo renderizado, así que su coste depende de
+    los bytes personalizados y no del tamaño de los adjuntos. Los adjuntos que
+    no caben en `max_prepared_bytes` se siguen leyendo por bloques del almacén.
+    """
+    
+    def __init__(self, attachment_parts: Sequence[MimePart] = (), max_prepared_bytes: int = 0):
+        """
+        Args:
+            attachment_parts: Adjuntos comunes a todos los mensajes
+            max_prepared_bytes: Memoria máxima para los adjuntos serializados
+        """
+        mixed_boundary = _new_boundary()
+        alternative_boundary = _new_boundary()
+        self._mixed_delimiter = f"--{mixed_boundary}\r\n".encode("ascii")
+        self._mixed_end = _DotSafe(f"--{mixed_boundary}--\r\n".encode("ascii"))
+        self._alternative_delimiter = f"--{alternative_boundary}\r\n".encode("ascii")
+        self._alternative_end = f"--{alternative_boundary}--\r\n".encode("ascii")
+        self._alternative_header = _header_block([
+            ("Content-Type", "multipart/alternative", {"boundary": alternative_boundary}),
+        ])
+        # Encabezados finales del mensaje; los anteriores (asunto, destinatarios...) van por mensaje
+        self._top_header_tail = _header_block([
+            ("MIME-Version", "1.0", {}),
+            ("Content-Type", "multipart/mixed", {"boundary": mixed_boundary}),
+        ])
+        self._header_lines: Dict[Tuple[str, str], bytes] = {}
+        
+        self.attachment_parts: List[MimePart] = []
+        budget = max_prepared_bytes
+        for part in attachment_parts:
+            size = part.encoded_size() if isinstance(part, AttachmentPart) else 0
+            if size <= budget:
+                budget -= size
+                part = PreparedPart(part)
+            self.attachment_parts.append(part)
+    
+    def assemble(self, headers: Sequence[Tuple[str, str]], text: Optional[str], html: Optional[str] = None) -> MimePart:
+        """
+        Crea un mensaje con la misma estructura que `MultipartPart`
+        (mixed > [alternative > [plain, html] | plain], adjuntos)
+        
+        Args:
+            headers: Encabezados propios del mensaje (Subject, From, To...)
+            text: Cuerpo en texto plano
+            html: Cuerpo HTML (None si el mensaje es solo texto)
+        """
+        header_block = b"".join(self._header_line(name, value) for name, value in headers) + self._top_header_tail
+        return _AssembledMessage(self, header_block, text or "", html)
+    
+    def _header_line(self, name: str, value: str) -> bytes:
+        """Serializa un encabezado; los repetidos en todo el envío (asunto, remitente) solo una vez"""
+        line = self._header_lines.get((name, value))
+        if line is None:
+            line = _header_block([(name, value, {})])[:-2]
+            self._header_lines[(name, value)] = line
+        return line
+
+class _AssembledMessage(MimePart):
+    """Mensaje de un envío masivo: partes propias más las compartidas del ensamblador"""
+    
+    __slots__ = ("assembler", "header_block", "text", "html")
+    
+    def __init__(self, assembler: BulkMimeAssembler, header_block: bytes, text: str, html: Optional[str]):
+        self.assembler = assembler
+        self.header_block = header_block
+        self.text = text
+        self.html = html
+    
+    def iter_bytes(self) -> Iterator[bytes]:
+        shared = self.assembler
+        yield self.header_block
+        yield shared._mixed_delimiter
+        if self.html is None:
+            yield from TextPart(self.text, "plain").iter_bytes()
+        else:
+            yield shared._alternative_header
+            yield shared._alternative_delimiter
+            yield from TextPart(self.text, "plain").iter_bytes()
+            yield _CRLF
+            yield shared._alternative_delimiter
+            yield from TextPart(self.html, "html").iter_bytes()
+            yield _CRLF
+            yield shared._alternative_end
+        yield _CRLF
+        for part in shared.attachment_parts:
+            yield shared._mixed_delimiter
+            yield from part.iter_bytes()
+            yield _CRLF
+        yield shared._mixed_end
+
+def dot_stuff(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Aplica el escape de puntos de SMTP (RFC 5321, 4.5.2) a un flujo de bloques
+    y garantiza que termina en CRLF
+    """
+    at_line_start = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if at_line_start and type(chunk) is _DotSafe:
+            # Preparado de antemano: empieza y termina en límite de línea
+            yield chunk
+            continue
+        if at_line_start and chunk[:1] == b".":
+            chunk = b"." + chunk
+        chunk = chunk.replace(b"\n.", b"\n..")
+        at_line_start = chunk.endswith(b"\n")
+        yield chunk
+    if not at_line_start:
+        yield _CRLF
+
+def send_streaming(
+    smtp: SMTP,
+    from_addr: str,
+    recipients: Sequence[str],
+    chunks: Iterable[bytes]
+) -> Dict[str, Tuple[int, bytes]]:
+    """
+    Envía un mensaje escribiéndolo por bloques en DATA, sin tenerlo entero en memoria.
+    Sigue la semántica de `SMTP.sendmail`.
+    
+    Args:
+        smtp: Sesión SMTP autenticada
+        from_addr: Remitente del sobre (MAIL FROM)
+        recipients: Destinatarios del sobre (RCPT TO), incluidos los ocultos
+        chunks: Mensaje serializado con finales de línea CRLF
+    
+    Returns:
+        Dict[str, Tuple[int, bytes]]: Destinatarios rechazados con el código y la respuesta del servidor
+    
+    Raises:
+        SMTPSenderRefused: Si el servidor rechaza el remitente
+        SMTPRecipientsRefused: Si el servidor rechaza todos los destinatarios
+        SMTPDataError: Si el servidor rechaza el mensaje
+    """
+    smtp.ehlo_or_helo_if_needed()
+    code, response = smtp.mail(from_addr)
+    if code != 250:
+        _abort(smtp, code)
+        raise SMTPSenderRefused(code, response, from_addr)
+    
+    refused: Dict[str, Tuple[int, bytes]] = {}
+    for recipient in recipients:
+        code, response = smtp.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+        if code == 421:
+            smtp.close()
+            raise SMTPRecipientsRefused(refused)
+    if len(refused) == len(recipients):
+        smtp.rset()
+        raise SMTPRecipientsRefused(refused)
+    
+    smtp.putcmd("data")
+    code, response = smtp.getreply()
+    if code != 354:
+        _abort(smtp, code)
+        raise SMTPDataError(code, response)
+    
+    # Se agrupan los bloques pequeños para no hacer una escritura por encabezado
+    buffer = bytearray()
+    for chunk in dot_stuff(chunks):
+        if len(chunk) >= _SEND_BUFFER_SIZE:
+            # Los bloques grandes (adjuntos preparados) se escriben sin copiarlos al búfer
+            if buffer:
+                smtp.send(bytes(buffer))
+                buffer.clear()
+            smtp.send(chunk)
+            continue
+        buffer += chunk
+        if len(buffer) >= _SEND_BUFFER_SIZE:
+            smtp.send(bytes(buffer))
+            buffer.clear()
+    buffer += b"." + _CRLF
+    smtp.send(bytes(buffer))
+    
+    code, response = smtp.getreply()
+    if code != 250:
+        _abort(smtp, code)
+        raise SMTPDataError(code, response)
+    return refused
+
+def _abort(smtp: SMTP, code: int) -> None:
+    """Deja la sesión lista para otra transacción, o la cierra si el servidor la terminó"""
+    if code == 421:
+        smtp.close()
+    else:
+        smtp.rset()
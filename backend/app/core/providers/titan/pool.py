@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from smtplib import (
+    SMTP,
+    SMTPDataError,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPSenderRefused,
+    SMTPServerDisconnected,
+)
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Errores de protocolo tras los cuales la sesión SMTP sigue siendo utilizable
+# (el servidor rechazó el remitente, algún destinatario o los datos, pero no cerró la conexión)
+_RECOVERABLE_ERRORS = (SMTPRecipientsRefused, SMTPSenderRefused, SMTPDataError)
+
+
+class _PooledConnection:
+    """Conexión SMTP junto con el instante de su último uso"""
+    
+    __slots__ = ("smtp", "last_used")
+    
+    def __init__(self, smtp: SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Pool acotado de sesiones SMTP autenticadas reutilizables.
+    
+    Las conexiones se validan con RSET antes de reutilizarse, se descartan y
+    reconectan si el servidor las cerró, y se cierran tras permanecer inactivas
+    más de `idle_timeout` segundos.
+    """
+    
+    def __init__(self, connect: Callable[[], SMTP], max_size: int = 5, idle_timeout: float = 60.0):
+        """
+        Args:
+            connect: Función que devuelve una nueva conexión SMTP autenticada
+            max_size: Número máximo de sesiones abiertas simultáneamente
+            idle_timeout: Segundos tras los cuales se cierra una sesión inactiva
+        """
+        self._connect = connect
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self._idle: Deque[_PooledConnection] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._in_use = 0
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+        self._closed = False
+        self._stop_reaper = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+    
+    @contextmanager
+    def connection(self) -> Iterator[SMTP]:
+        """
+        Presta una sesión SMTP autenticada durante el bloque `with`.
+        
+        Si el bloque lanza un error de conexión la sesión se descarta; en caso
+        contrario se devuelve al pool para su reutilización.
+        """
+        if self._closed:
+            raise RuntimeError("El pool de conexiones SMTP está cerrado")
+        
+        self._slots.acquire()
+        pooled = None
+        try:
+            pooled = self._checkout()
+            with self._lock:
+                self._in_use += 1
+            try:
+                yield pooled.smtp
+            except _RECOVERABLE_ERRORS:
+                self._checkin(pooled)
+                raise
+            except BaseException:
+                self._discard(pooled)
+                raise
+            else:
+                self._checkin(pooled)
+            finally:
+                with self._lock:
+                    self._in_use -= 1
+        finally:
+            self._slots.release()
+    
+    def execute(self, operation: Callable[[SMTP], T], retries: int = 1) -> T:
+        """
+        Ejecuta una operación sobre una sesión del pool, reconectando si el
+        servidor cerró la conexión entre la validación y el uso.
+        
+        Args:
+            operation: Función que recibe la conexión SMTP
+            retries: Reintentos permitidos ante desconexión del servidor
+        
+        Returns:
+            T: Resultado de la operación
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.connection() as smtp:
+                    return operation(smtp)
+            except (SMTPServerDisconnected, ConnectionError) as e:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                logger.warning("Conexión SMTP perdida (%s), reintentando con una nueva sesión", e)
+    
+    def warm_up(self, count: int) -> int:
+        """
+        Abre sesiones por adelantado y las deja inactivas en el pool, para que
+        los primeros envíos no paguen la conexión, STARTTLS y el login
+        
+        Args:
+            count: Sesiones a abrir (limitado al tamaño del pool)
+        
+        Returns:
+            int: Sesiones inactivas disponibles tras el calentamiento
+        """
+        with self._lock:
+            missing = min(count, self.max_size) - len(self._idle) - self._in_use
+        for _ in range(max(0, missing)):
+            if self._closed:
+                break
+            smtp = self._connect()
+            with self._lock:
+                self._created += 1
+            self._ensure_reaper()
+            self._checkin(_PooledConnection(smtp))
+        with self._lock:
+            return len(self._idle)
+    
+    def close(self) -> None:
+        """Cierra todas las sesiones inactivas y detiene el cierre por inactividad"""
+        self._closed = True
+        self._stop_reaper.set()
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._close_connection(pooled.smtp)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve estadísticas del pool"""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "created": self._created,
+                "reused": self._reused,
+                "discarded": self._discarded,
+            }
+    
+    def _checkout(self) -> _PooledConnection:
+        """Obtiene una sesión válida del pool o abre una nueva"""
+        self._reap_idle()
+        
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                break
+            if self._is_alive(pooled.smtp):
+                with self._lock:
+                    self._reused += 1
+                return pooled
+            self._discard(pooled)
+        
+        smtp = self._connect()
+        with self._lock:
+            self._created += 1
+        self._ensure_reaper()
+        return _PooledConnection(smtp)
+    
+    def _checkin(self, pooled: _PooledConnection) -> None:
+        """Devuelve una sesión al pool"""
+        if self._closed:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+    
+    def _discard(self, pooled: _PooledConnection) -> None:
+        """Cierra y descarta una sesión"""
+        with self._lock:
+            self._discarded += 1
+        self._close_connection(pooled.smtp)
+    
+    def _is_alive(self, smtp: SMTP) -> bool:
+        """Comprueba con RSET que la sesión sigue abierta y limpia su estado"""
+        try:
+            code, _ = smtp.rset()
+            return code == 250
+        except (SMTPException, OSError):
+            return False
+    
+    def _reap_idle(self) -> None:
+        """Cierra las sesiones que llevan inactivas más de `idle_timeout`"""
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            # Las sesiones más antiguas quedan a la izquierda de la cola
+            while self._idle and self._idle[0].last_used < deadline:
+                expired.append(self._idle.popleft())
+        for pooled in expired:
+            logger.info("Cerrando conexión SMTP inactiva")
+            self._close_connection(pooled.smtp)
+    
+    def _ensure_reaper(self) -> None:
+        """Arranca el hilo que cierra las sesiones inactivas"""
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reaper_loop, name="smtp-pool-reaper", daemon=True)
+            self._reaper.start()
+    
+    def _reaper_loop(self) -> None:
+        interval = max(1.0, self.idle_timeout / 2)
+        while not self._stop_reaper.wait(interval):
+            self._reap_idle()
+    
+    @staticmethod
+    def _close_connection(smtp: SMTP) -> None:
+        try:
+            smtp.quit()
+        except (SMTPException, OSError):
+            smtp.close()
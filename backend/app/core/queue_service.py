@@ -0,0 +1,398 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Set
+
+from pydantic import ValidationError
+
+from app.config import get_settings
+from app.logging_config import SAMPLED
+from app.core import metrics
+from app.schemas.email import EmailRequest, EmailResponse, EmailJobStatus
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo de envío
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_RETRYING = "retrying"
+STATUS_SENT = "sent"
+STATUS_DEAD = "dead"
+
+# Segundos entre revisiones de trabajos abandonados y purgas de trabajos enviados
+_MAINTENANCE_INTERVAL = 60.0
+
+class EmailQueue:
+    """
+    Cola persistente de correos respaldada por SQLite.
+    
+    Los correos encolados se guardan en disco y un pool de workers asíncronos
+    los entrega con reintentos y backoff exponencial. Los trabajos que agotan
+    sus intentos, o cuyo error no es temporal, pasan a la cola de mensajes
+    muertos (`dead`). Los enviados se eliminan cuando superan `QUEUE_SENT_RETENTION`.
+    
+    Varios procesos pueden compartir la cola: cada trabajo en curso guarda el
+    proceso que lo reclamó y un plazo (lease) que ese proceso renueva mientras
+    sigue vivo. Solo se reanudan los trabajos cuyo plazo venció, de modo que un
+    proceso que arranca no reenvía los que otro tiene en curso.
+    """
+    
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path or settings.QUEUE_DB_PATH)
+        self.worker_count = max(1, settings.QUEUE_WORKERS)
+        self.max_attempts = max(1, settings.QUEUE_MAX_ATTEMPTS)
+        self.retry_base_delay = settings.QUEUE_RETRY_BASE_DELAY
+        self.retry_max_delay = settings.QUEUE_RETRY_MAX_DELAY
+        self.poll_interval = settings.QUEUE_POLL_INTERVAL
+        self.sent_retention = settings.QUEUE_SENT_RETENTION
+        self.lease_timeout = settings.QUEUE_LEASE_TIMEOUT
+        # Identificador de este proceso en los trabajos que reclama
+        self.owner = uuid.uuid4().hex
+        self._last_maintenance = 0.0
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._init_db()
+        
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._lease_task: Optional[asyncio.Task] = None
+        self._email_service = None
+    
+    def _init_db(self) -> None:
+        """Crea el esquema de la cola si no existe"""
+        with self._db_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS email_jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_email_jobs_ready ON email_jobs (status, next_attempt_at)"
+            )
+            # Colas creadas antes de los leases
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in self._conn.execute("PRAGMA table_info(email_jobs)")}
+                if "owner" not in columns:
+                    self._conn.execute("ALTER TABLE email_jobs ADD COLUMN owner TEXT")
+                if "lease_expires_at" not in columns:
+                    self._conn.execute("ALTER TABLE email_jobs ADD COLUMN lease_expires_at REAL")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    async def start(self, email_service) -> None:
+        """
+        Arranca los workers que drenan la cola
+        
+        Args:
+            email_service: Servicio usado para entregar cada correo
+        """
+        if self._workers:
+            return
+        self._email_service = email_service
+        self._wakeup = asyncio.Event()
+        
+        recovered = await asyncio.to_thread(self._recover_interrupted, time.time())
+        if recovered:
+            logger.info("Reanudando %s trabajos interrumpidos en la cola de correos", recovered)
+        
+        self._lease_task = asyncio.create_task(self._renew_leases(), name="email-queue-leases")
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"email-queue-worker-{index}")
+            for index in range(self.worker_count)
+        ]
+        logger.info("Cola de correos iniciada con %s workers", self.worker_count)
+    
+    async def stop(self) -> None:
+        """Detiene los workers y devuelve a la cola los trabajos que este proceso tenía en curso"""
+        tasks = self._workers + ([self._lease_task] if self._lease_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._lease_task = None
+        await asyncio.to_thread(self._release_owned)
+        with self._db_lock:
+            self._conn.close()
+        logger.info("Cola de correos detenida")
+    
+    async def enqueue(self, email_data: EmailRequest) -> EmailJobStatus:
+        """
+        Guarda un correo en la cola persistente para su envío en segundo plano
+        
+        Args:
+            email_data: Datos del correo a enviar
+        
+        Returns:
+            EmailJobStatus: Estado inicial del trabajo
+        """
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, email_data.model_dump_json())
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return await self.get_job(job_id)
+    
+    async def get_job(self, job_id: str) -> Optional[EmailJobStatus]:
+        """
+        Obtiene el estado de un trabajo
+        
+        Args:
+            job_id: Identificador del trabajo
+        
+        Returns:
+            Optional[EmailJobStatus]: Estado del trabajo, o None si no existe
+        """
+        row = await asyncio.to_thread(self._fetch, job_id)
+        if row is None:
+            return None
+        _, _, status, attempts, next_attempt_at, last_error, result, created_at, updated_at = row
+        return EmailJobStatus(
+            job_id=job_id,
+            status=status,
+            attempts=attempts,
+            max_attempts=self.max_attempts,
+            next_attempt_at=datetime.fromtimestamp(next_attempt_at).isoformat() if status == STATUS_RETRYING else None,
+            last_error=last_error,
+            result=EmailResponse.model_validate_json(result) if result else None,
+            created_at=datetime.fromtimestamp(created_at).isoformat(),
+            updated_at=datetime.fromtimestamp(updated_at).isoformat()
+        )
+    
+    async def _worker(self, index: int) -> None:
+        """Bucle de un worker: reclama trabajos listos y los entrega"""
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim_next)
+                if job is None:
+                    await self._wait_for_work()
+                    continue
+                await self._process(*job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error inesperado en el worker %s de la cola de correos", index)
+                await asyncio.sleep(self.poll_interval)
+    
+    async def _renew_leases(self) -> None:
+        """Renueva el plazo de los trabajos en curso de este proceso mientras sigue vivo"""
+        while True:
+            await asyncio.sleep(self.lease_timeout / 3)
+            try:
+                await asyncio.to_thread(self._renew_owned, time.time())
+            except Exception:
+                logger.exception("Error al renovar los trabajos en curso de la cola de correos")
+    
+    async def _wait_for_work(self) -> None:
+        """Espera a que se encole un trabajo o venza el intervalo de sondeo (reintentos programados)"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _process(self, job_id: str, payload: str, attempts: int, queue_wait: float) -> None:
+        """Entrega un trabajo y registra su resultado"""
+        metrics.observe_stage(metrics.STAGE_QUEUE_WAIT, settings.EMAIL_PROVIDER, queue_wait)
+        try:
+            email_data = EmailRequest.model_validate_json(payload)
+            result = await self._email_service.send_email(email_data)
+        except ValidationError as e:
+            result = EmailResponse(success=False, message=f"Correo encolado no válido: {str(e)}", retryable=False)
+        except Exception as e:
+            result = EmailResponse(success=False, message=f"Error inesperado al enviar correo: {str(e)}")
+        
+        if result.success:
+            await asyncio.to_thread(self._mark_sent, job_id, result)
+            logger.info("Trabajo %s enviado en el intento %d", job_id, attempts, extra=SAMPLED)
+            return
+        
+        if result.retryable is False:
+            # Destinatario o datos no válidos: reintentar daría el mismo error
+            await asyncio.to_thread(self._mark_dead, job_id, result)
+            logger.error("Trabajo %s movido a mensajes muertos por un error no recuperable: %s", job_id, result.message)
+            return
+        
+        if attempts >= self.max_attempts:
+            await asyncio.to_thread(self._mark_dead, job_id, result)
+            logger.error("Trabajo %s movido a mensajes muertos tras %s intentos: %s", job_id, attempts, result.message)
+            return
+        
+        delay = min(self.retry_base_delay * (2 ** (attempts - 1)), self.retry_max_delay)
+        await asyncio.to_thread(self._schedule_retry, job_id, result, delay)
+        logger.warning("Trabajo %s falló (intento %s), reintento en %.0fs: %s", job_id, attempts, delay, result.message)
+    
+    def referenced_attachment_ids(self) -> Set[str]:
+        """Identificadores del almacén de adjuntos que usan los trabajos sin terminar"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM email_jobs WHERE status IN (?, ?, ?)",
+                (STATUS_PENDING, STATUS_PROCESSING, STATUS_RETRYING)
+            ).fetchall()
+        attachment_ids = set()
+        for (payload,) in rows:
+            try:
+                attachments = json.loads(payload).get("attachments") or []
+            except (ValueError, AttributeError):
+                continue
+            attachment_ids.update(
+                attachment["attachment_id"]
+                for attachment in attachments
+                if isinstance(attachment, dict) and attachment.get("attachment_id")
+            )
+        return attachment_ids
+    
+    # Operaciones sobre la base de datos (se ejecutan fuera del event loop)
+    
+    def _insert(self, job_id: str, payload: str) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO email_jobs (id, payload, status, attempts, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, 0, ?, ?, ?)",
+                (job_id, payload, STATUS_PENDING, now, now, now)
+            )
+    
+    def _fetch(self, job_id: str):
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT id, payload, status, attempts, next_attempt_at, last_error, result, created_at, updated_at "
+                "FROM email_jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+    
+    def _claim_next(self):
+        """Marca como en curso el siguiente trabajo listo y lo devuelve"""
+        now = time.time()
+        self._maintain(now)
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, payload, attempts, next_attempt_at FROM email_jobs "
+                    "WHERE status IN (?, ?) AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at LIMIT 1",
+                    (STATUS_PENDING, STATUS_RETRYING, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, payload, attempts, ready_at = row
+                self._conn.execute(
+                    "UPDATE email_jobs SET status = ?, attempts = ?, owner = ?, lease_expires_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (STATUS_PROCESSING, attempts + 1, self.owner, now + self.lease_timeout, now, job_id)
+                )
+                self._conn.execute("COMMIT")
+                return job_id, payload, attempts + 1, max(0.0, now - ready_at)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def _mark_sent(self, job_id: str, result: EmailResponse) -> None:
+        self._update_status(job_id, STATUS_SENT, result, clear_payload=True)
+    
+    def _mark_dead(self, job_id: str, result: EmailResponse) -> None:
+        self._update_status(job_id, STATUS_DEAD, result)
+    
+    def _schedule_retry(self, job_id: str, result: EmailResponse, delay: float) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE email_jobs SET status = ?, next_attempt_at = ?, last_error = ?, owner = NULL, "
+                "lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (STATUS_RETRYING, now + delay, result.message, now, job_id)
+            )
+    
+    def _update_status(self, job_id: str, status: str, result: EmailResponse, clear_payload: bool = False) -> None:
+        now = time.time()
+        last_error = None if result.success else result.message
+        with self._db_lock:
+            if clear_payload:
+                # El contenido ya no es necesario una vez entregado (puede incluir adjuntos pesados)
+                self._conn.execute(
+                    "UPDATE email_jobs SET status = ?, result = ?, last_error = ?, payload = '', owner = NULL, "
+                    "lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                    (status, result.model_dump_json(), last_error, now, job_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE email_jobs SET status = ?, result = ?, last_error = ?, owner = NULL, "
+                    "lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                    (status, result.model_dump_json(), last_error, now, job_id)
+                )
+    
+    def _recover_interrupted(self, now: float) -> int:
+        """
+        Devuelve a la cola los trabajos en curso cuyo plazo venció: el proceso que
+        los reclamó se detuvo sin terminarlos y ya no los renueva
+        """
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE email_jobs SET status = ?, owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at <= ?)",
+                (STATUS_PENDING, now, STATUS_PROCESSING, now)
+            )
+            return cursor.rowcount
+    
+    def _renew_owned(self, now: float) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE email_jobs SET lease_expires_at = ? WHERE status = ? AND owner = ?",
+                (now + self.lease_timeout, STATUS_PROCESSING, self.owner)
+            )
+    
+    def _release_owned(self) -> None:
+        """Devuelve a la cola los trabajos en curso de este proceso al detenerlo"""
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE email_jobs SET status = ?, owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE status = ? AND owner = ?",
+                (STATUS_PENDING, time.time(), STATUS_PROCESSING, self.owner)
+            )
+    
+    def _maintain(self, now: float) -> None:
+        """
+        Como mucho una vez por minuto, reanuda los trabajos abandonados por otros
+        procesos y elimina los enviados más antiguos que la retención
+        """
+        with self._db_lock:
+            if now - self._last_maintenance < _MAINTENANCE_INTERVAL:
+                return
+            self._last_maintenance = now
+        recovered = self._recover_interrupted(now)
+        if recovered:
+            logger.warning("Reanudando %s trabajos abandonados en la cola de correos", recovered)
+        self._purge_sent(now)
+    
+    def _purge_sent(self, now: float) -> None:
+        """Elimina los trabajos enviados más antiguos que la retención"""
+        with self._db_lock:
+            deleted = self._conn.execute(
+                "DELETE FROM email_jobs WHERE status = ? AND updated_at <= ?",
+                (STATUS_SENT, now - self.sent_retention)
+            ).rowcount
+        if deleted:
+            logger.info("%s trabajos enviados eliminados de la cola de correos", deleted)
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+class AdaptiveRateLimiter:
+    """
+    Limitador de envíos de tipo token bucket con tasa adaptativa.
+    
+    Cada envío consume tokens que se reponen a `rate` por segundo hasta `burst`.
+    Cuando el servidor limita (HTTP 429, `Retry-After` o respuestas SMTP 4xx) la
+    tasa se reduce de forma multiplicativa y los envíos se pausan el tiempo
+    indicado; cada envío correcto la recupera de forma aditiva hasta la tasa
+    configurada. Así los envíos masivos se mantienen cerca del máximo que la
+    cuenta admite en lugar de fallar.
+    """
+    
+    def __init__(self, name: str, rate: float, burst: int, enabled: bool = True):
+        """
+        Args:
+            name: Nombre del limitador (proveedor y cuenta) para los logs
+            rate: Envíos por segundo configurados (tasa máxima)
+            burst: Envíos que pueden hacerse seguidos sin esperar
+            enabled: Si es False, `acquire` no espera nunca
+        """
+        self.name = name
+        self.enabled = enabled and rate > 0
+        self.max_rate = max(rate, 1e-3)
+        self.min_rate = self.max_rate * settings.RATE_LIMIT_MIN_FACTOR
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        # Instante desde el que se reponen tokens; en el futuro mientras dura una pausa
+        self._updated = time.monotonic()
+        self._acquired = 0
+        self._waited = 0.0
+        self._throttled = 0
+    
+    async def acquire(self, tokens: float = 1) -> float:
+        """
+        Espera hasta poder realizar un envío
+        
+        Args:
+            tokens: Envíos que se van a realizar (p. ej. peticiones de un lote)
+        
+        Returns:
+            float: Segundos esperados
+        """
+        if not self.enabled:
+            return 0.0
+        
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Los tokens se reservan de inmediato; el déficit se traduce en espera,
+            # de modo que los envíos concurrentes quedan espaciados a la tasa actual
+            self._tokens -= tokens
+            wait = max(0.0, self._updated - now) + max(0.0, -self._tokens) / self.rate
+            self._acquired += 1
+            self._waited += wait
+        
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+    
+    def on_success(self) -> None:
+        """Registra un envío aceptado: recupera parte de la tasa perdida"""
+        if not self.enabled or self.rate >= self.max_rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = min(self.max_rate, self.rate + self.max_rate * settings.RATE_LIMIT_RECOVERY_STEP)
+    
+    def on_throttle(self, retry_after: Optional[float] = None) -> float:
+        """
+        Registra una limitación del servidor: reduce la tasa y pausa los envíos
+        
+        Args:
+            retry_after: Segundos indicados por el servidor (None para la pausa por defecto)
+        
+        Returns:
+            float: Segundos de pausa aplicados
+        """
+        delay = settings.RATE_LIMIT_DEFAULT_BACKOFF if retry_after is None else max(0.0, retry_after)
+        if not self.enabled:
+            return delay
+        
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Los envíos ya reservados mantienen su turno a la tasa anterior; los
+            # nuevos esperan a que terminen ellos y la pausa, y siguen a la tasa reducida
+            reserved = max(0.0, self._updated - now) + max(0.0, -self._tokens) / self.rate
+            self.rate = max(self.min_rate, self.rate * settings.RATE_LIMIT_BACKOFF_FACTOR)
+            self._tokens = 0.0
+            self._updated = now + max(reserved, delay)
+            self._throttled += 1
+        
+        logger.warning("Envíos limitados por el servidor (%s): pausa de %.1fs, tasa reducida a %.2f/s", self.name, delay, self.rate)
+        return delay
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve el estado del limitador"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "enabled": self.enabled,
+                "rate": round(self.rate, 3),
+                "max_rate": round(self.max_rate, 3),
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(max(0.0, self._updated - now), 2),
+                "acquired": self._acquired,
+                "waited_seconds": round(self._waited, 2),
+                "throttled": self._throttled
+            }
+    
+    def _refill(self, now: float) -> None:
+        if now <= self._updated:
+            return
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+# Limitadores compartidos, uno por (proveedor, cuenta)
+_limiters: Dict[Tuple[str, str], AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str, account: str) -> AdaptiveRateLimiter:
+    """
+    Obtiene el limitador de una cuenta de un proveedor, creándolo con la
+    configuración del proveedor (`<PROVEEDOR>_RATE_LIMIT_PER_SECOND` y `_BURST`)
+    
+    Args:
+        provider: Nombre del proveedor (`titan`, `outlook`)
+        account: Cuenta remitente
+    """
+    key = (provider, account)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            prefix = provider.upper()
+            limiter = AdaptiveRateLimiter(
+                name=f"{provider}:{account}",
+                rate=getattr(settings, f"{prefix}_RATE_LIMIT_PER_SECOND"),
+                burst=getattr(settings, f"{prefix}_RATE_LIMIT_BURST"),
+                enabled=settings.RATE_LIMIT_ENABLED
+            )
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,164 @@
+import html
+import re
+import weakref
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.utils.html_text import html_to_text
+
+# Cualquier texto entre llaves es un posible marcador; solo se sustituye si hay
+# una variable con ese nombre, igual que el antiguo `str.replace("{key}", ...)`
+_PLACEHOLDER_RE = re.compile(r"\{([^{}\r\n]+)\}")
+# Marcadores que se consideran variables de la plantilla (descarta bloques CSS, etc.)
+_VARIABLE_NAME_RE = re.compile(r"^[A-Za-z_][\w.\-]*$")
+
+_MISSING = object()
+
+class MissingTemplateVariablesError(ValueError):
+    """Error lanzado al renderizar en modo estricto sin todas las variables de la plantilla"""
+    
+    def __init__(self, missing: Set[str]):
+        self.missing = sorted(missing)
+        super().__init__(f"Faltan variables de plantilla: {', '.join(self.missing)}")
+
+class CompiledTemplate:
+    """
+    Plantilla compilada en una lista de segmentos.
+    
+    El texto se divide una sola vez en literales y marcadores `{nombre}` con sus
+    posiciones precalculadas, de modo que cada renderizado es un único `join`
+    lineal en lugar de un `str.replace` por variable.
+    
+    Para las plantillas HTML, la versión en texto plano se obtiene convirtiendo
+    la plantilla (con sus marcadores) una sola vez; cada destinatario renderiza
+    después su texto igual que el HTML.
+    """
+    
+    __slots__ = ("source", "variables", "_parts", "_slots", "_text_template", "__weakref__")
+    
+    def __init__(self, source: str):
+        self.source = source
+        parts: List[Optional[str]] = []
+        slots: List[Tuple[int, str]] = []
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(source):
+            parts.append(source[position:match.start()])
+            slots.append((len(parts), match.group(1)))
+            parts.append(None)
+            position = match.end()
+        parts.append(source[position:])
+        
+        self._parts = parts
+        self._slots = slots
+        self._text_template: Optional["CompiledTemplate"] = None
+        self.variables: FrozenSet[str] = frozenset(
+            name for _, name in slots if _VARIABLE_NAME_RE.match(name)
+        )
+    
+    @property
+    def text_template(self) -> "CompiledTemplate":
+        """Plantilla de texto plano equivalente, convertida del HTML la primera vez"""
+        if self._text_template is None:
+            self._text_template = CompiledTemplate(html_to_text(self.source))
+        return self._text_template
+    
+    def render_text(self, variables: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Renderiza la versión en texto plano de una plantilla HTML
+        
+        Args:
+            variables: Valores de las variables (sin escapar: el texto no es HTML)
+        
+        Returns:
+            str: Texto renderizado
+        """
+        return self.text_template.render(variables)
+    
+    def missing_variables(self, variables: Optional[Dict[str, Any]] = None) -> Set[str]:
+        """
+        Devuelve las variables de la plantilla que no están en `variables`
+        
+        Args:
+            variables: Variables disponibles
+        
+        Returns:
+            Set[str]: Nombres de las variables sin valor
+        """
+        if not variables:
+            return set(self.variables)
+        return {name for name in self.variables if name not in variables}
+    
+    def render(
+        self,
+        variables: Optional[Dict[str, Any]] = None,
+        escape: bool = False,
+        strict: bool = False
+    ) -> str:
+        """
+        Renderiza la plantilla con las variables indicadas
+        
+        Args:
+            variables: Valores de las variables
+            escape: Escapar los valores como HTML
+            strict: Lanzar un error si falta alguna variable de la plantilla
+        
+        Returns:
+            str: Contenido renderizado; los marcadores sin valor se dejan tal cual
+        
+        Raises:
+            MissingTemplateVariablesError: Si `strict` y falta alguna variable
+        """
+        if strict:
+            missing = self.missing_variables(variables)
+            if missing:
+                raise MissingTemplateVariablesError(missing)
+        
+        if not variables or not self._slots:
+            return self.source
+        
+        parts = self._parts.copy()
+        for index, name in self._slots:
+            value = variables.get(name, _MISSING)
+            if value is _MISSING:
+                parts[index] = "{" + name + "}"
+            elif escape:
+                parts[index] = html.escape(str(value))
+            else:
+                parts[index] = str(value)
+        return "".join(parts)
+
+# Plantillas compiladas registradas, por contenido. Solo viven mientras alguien
+# las retiene (la caché de TemplateService, un envío masivo en curso), así que la
+# memoria la acota esa caché y no este registro
+_registered: "weakref.WeakValueDictionary[str, CompiledTemplate]" = weakref.WeakValueDictionary()
+
+def register_template(source: str) -> CompiledTemplate:
+    """
+    Compila una plantilla y la registra para que `compile_template` reutilice
+    la compilación con el mismo contenido mientras el llamador la retenga
+    
+    Args:
+        source: Contenido de la plantilla
+    
+    Returns:
+        CompiledTemplate: Plantilla compilada (la ya registrada si existe)
+    """
+    compiled = _registered.get(source)
+    if compiled is None:
+        compiled = CompiledTemplate(source)
+        _registered[source] = compiled
+    return compiled
+
+def compile_template(source: str) -> CompiledTemplate:
+    """
+    Compila una plantilla, reutilizando la compilación registrada con el mismo
+    contenido. Los contenidos no registrados (cuerpos libres de `/emails/send`)
+    se compilan sin guardarse
+    
+    Args:
+        source: Contenido de la plantilla
+    
+    Returns:
+        CompiledTemplate: Plantilla compilada
+    """
+    compiled = _registered.get(source)
+    return compiled if compiled is not None else CompiledTemplate(source)
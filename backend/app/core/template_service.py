@@ -1,16 +1,29 @@
 #/core/template_service.py
 import os
+import sys
 import logging
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, NamedTuple
 from datetime import datetime
 
 from app.config import get_settings
 from app.schemas.template import TemplateInfo, TemplateListResponse
+from app.core.template_engine import CompiledTemplate, register_template
+from app.core.catalog import CatalogEntry, FileCatalog
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+class _CachedTemplate(NamedTuple):
+    """Plantilla en caché junto con los datos del archivo usados para invalidarla"""
+    content: str
+    compiled: CompiledTemplate
+    mtime_ns: int
+    size: int
+    nbytes: int
+
 class TemplateService:
     """Servicio para la gestión de plantillas HTML"""
     
@@ -18,39 +31,168 @@ class TemplateService:
         self.templates_dir = settings.TEMPLATES_DIR
         # Asegurar que el directorio existe
         self.templates_dir.mkdir(exist_ok=True)
+        
+        # Caché LRU de plantillas (contenido y compilada) acotada por tamaño total
+        self.cache_max_bytes = settings.TEMPLATE_CACHE_MAX_BYTES
+        self._cache: "OrderedDict[str, _CachedTemplate]" = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        
+        # Índice de las plantillas del directorio para los listados
+        self.catalog = FileCatalog("templates", self.templates_dir, suffix=".html")
+        self.catalog.start()
+    
+    def close(self) -> None:
+        """Detiene la revisión del directorio de plantillas"""
+        self.catalog.close()
     
-    def list_templates(self) -> TemplateListResponse:
-        """Lista todas las plantillas disponibles"""
-        templates = []
-        
-        for file_path in self.templates_dir.glob("*.html"):
-            if file_path.is_file():
-                # Obtener estadísticas del archivo
-                stats = file_path.stat()
-                template_info = TemplateInfo(
-                    name=file_path.stem,
-                    path=str(file_path.relative_to(settings.BASE_DIR)),
-                    size=stats.st_size,
-                    last_modified=datetime.fromtimestamp(stats.st_mtime).isoformat()
-                )
-                templates.append(template_info)
-        
-        return TemplateListResponse(templates=templates)
+    def warm_up(self) -> int:
+        """
+        Lee y compila por adelantado las plantillas del directorio, empezando
+        por las modificadas más recientemente, hasta llenar la caché
+        
+        Returns:
+            int: Plantillas compiladas
+        """
+        compiled = 0
+        for entry in self.catalog.query(sort_by="mtime", order="desc").entries:
+            # Sin desalojar las ya precompiladas (estimación como en `_cache_template`)
+            with self._cache_lock:
+                if self._cache_bytes + entry.size * 2 > self.cache_max_bytes:
+                    break
+            try:
+                self._get_cached_template(entry.name[:-len(".html")])
+                compiled += 1
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning("No se pudo precompilar la plantilla %s: %s", entry.name, e)
+        return compiled
+    
+    def list_templates(
+        self,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        sort_by: str = "name",
+        order: str = "asc",
+        cursor: Optional[str] = None
+    ) -> TemplateListResponse:
+        """
+        Lista las plantillas disponibles a partir del índice
+        
+        Args:
+            limit: Número máximo de resultados (None para todas)
+            prefix: Filtrar por prefijo del nombre
+            sort_by: Criterio de ordenación (`name`, `size` o `mtime`)
+            order: `asc` o `desc`
+            cursor: Cursor devuelto por la página anterior
+        
+        Raises:
+            ValueError: Si el criterio de ordenación o el cursor no son válidos
+        """
+        page = self.catalog.query(limit=limit, prefix=prefix, sort_by=sort_by, order=order, cursor=cursor)
+        relative_dir = self.templates_dir.relative_to(settings.BASE_DIR)
+        
+        templates = [
+            TemplateInfo(
+                name=entry.name[:-len(".html")],
+                path=str(relative_dir / entry.name),
+                size=entry.size,
+                last_modified=_isoformat(entry)
+            )
+            for entry in page.entries
+        ]
+        return TemplateListResponse(templates=templates, next_cursor=page.next_cursor)
     
     def get_template_content(self, template_name: str) -> str:
         """Obtiene el contenido de una plantilla"""
+        return self._get_cached_template(template_name).content
+    
+    def _get_cached_template(self, template_name: str) -> _CachedTemplate:
+        """
+        Obtiene una plantilla de la caché, leyéndola del disco si no está
+        o si el archivo cambió (distinto mtime o tamaño)
+        """
         template_path = self.templates_dir / f"{template_name}.html"
         
-        if not template_path.exists():
-            logger.error(f"Plantilla no encontrada: {template_name}")
+        try:
+            stats = template_path.stat()
+        except FileNotFoundError:
+            self._invalidate(template_name)
+            logger.error("Plantilla no encontrada: %s", template_name)
             raise FileNotFoundError(f"Plantilla '{template_name}' no encontrada")
         
+        with self._cache_lock:
+            entry = self._cache.get(template_name)
+            if entry and entry.mtime_ns == stats.st_mtime_ns and entry.size == stats.st_size:
+                self._cache.move_to_end(template_name)
+                self._hits += 1
+                return entry
+            self._misses += 1
+        
         try:
             with open(template_path, "r", encoding="utf-8") as f:
-                return f.read()
+                content = f.read()
         except Exception as e:
-            logger.exception(f"Error al leer la plantilla {template_name}: {str(e)}")
+            logger.exception("Error al leer la plantilla %s: %s", template_name, e)
             raise
+        
+        return self._cache_template(template_name, content, stats)
+    
+    def _cache_template(self, template_name: str, content: str, stats: os.stat_result) -> _CachedTemplate:
+        """Compila una plantilla y la guarda en la caché respetando el límite de tamaño"""
+        # Registrada mientras siga en la caché: los proveedores reutilizan esta compilación
+        compiled = register_template(content)
+        # La versión en texto plano se prepara aquí, una vez por plantilla, y no en cada envío
+        compiled.text_template
+        # El contenido compilado (HTML y texto) son segmentos del original: se estima el doble de memoria
+        entry = _CachedTemplate(
+            content=content,
+            compiled=compiled,
+            mtime_ns=stats.st_mtime_ns,
+            size=stats.st_size,
+            nbytes=sys.getsizeof(content) * 2
+        )
+        
+        with self._cache_lock:
+            previous = self._cache.pop(template_name, None)
+            if previous:
+                self._cache_bytes -= previous.nbytes
+            
+            if entry.nbytes > self.cache_max_bytes:
+                # Plantilla mayor que toda la caché: se sirve sin guardarla
+                return entry
+            
+            self._cache[template_name] = entry
+            self._cache_bytes += entry.nbytes
+            while self._cache_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+                self._evictions += 1
+        
+        return entry
+    
+    def _invalidate(self, template_name: str) -> None:
+        """Elimina una plantilla de la caché"""
+        with self._cache_lock:
+            entry = self._cache.pop(template_name, None)
+            if entry:
+                self._cache_bytes -= entry.nbytes
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Devuelve las estadísticas de la caché de plantillas"""
+        with self._cache_lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._cache),
+                "bytes": self._cache_bytes,
+                "max_bytes": self.cache_max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0
+            }
     
     def save_template(self, template_name: str, content: bytes) -> TemplateInfo:
         """Guarda una nueva plantilla o actualiza una existente"""
@@ -62,6 +204,14 @@ class TemplateService:
             
             # Obtener estadísticas actualizadas
             stats = template_path.stat()
+            self.catalog.upsert(template_path.name, stats)
+            
+            # Actualizar la caché con el nuevo contenido
+            try:
+                self._cache_template(template_name, content.decode("utf-8"), stats)
+            except UnicodeDecodeError:
+                self._invalidate(template_name)
+            
             return TemplateInfo(
                 name=template_name,
                 path=str(template_path.relative_to(settings.BASE_DIR)),
@@ -69,7 +219,7 @@ class TemplateService:
                 last_modified=datetime.fromtimestamp(stats.st_mtime).isoformat()
             )
         except Exception as e:
-            logger.exception(f"Error al guardar la plantilla {template_name}: {str(e)}")
+            logger.exception("Error al guardar la plantilla %s: %s", template_name, e)
             raise
     
     def delete_template(self, template_name: str) -> bool:
@@ -77,24 +227,34 @@ class TemplateService:
         template_path = self.templates_dir / f"{template_name}.html"
         
         if not template_path.exists():
-            logger.warning(f"Intento de eliminar plantilla inexistente: {template_name}")
+            logger.warning("Intento de eliminar plantilla inexistente: %s", template_name)
             return False
         
         try:
             template_path.unlink()
-            logger.info(f"Plantilla eliminada: {template_name}")
+            self.catalog.remove(template_path.name)
+            self._invalidate(template_name)
+            logger.info("Plantilla eliminada: %s", template_name)
             return True
         except Exception as e:
-            logger.exception(f"Error al eliminar la plantilla {template_name}: {str(e)}")
+            logger.exception("Error al eliminar la plantilla %s: %s", template_name, e)
             raise
     
+    def get_compiled_template(self, template_name: str) -> CompiledTemplate:
+        """Obtiene una plantilla compilada lista para renderizar"""
+        return self._get_cached_template(template_name).compiled
+    
     def render_template(self, template_name: str, variables: Optional[Dict[str, Any]] = None) -> str:
         """Renderiza una plantilla con variables"""
-        content = self.get_template_content(template_name)
+        compiled = self.get_compiled_template(template_name)
         
         # Aplicar variables si están disponibles
-        if variables:
-            for key, value in variables.items():
-                content = content.replace(f"{{{key}}}", str(value))
-        
-        return content
\ No newline at end of file
+        return compiled.render(
+            variables,
+            escape=settings.TEMPLATE_ESCAPE_HTML,
+            strict=settings.TEMPLATE_STRICT_VARIABLES
+        )
+
+def _isoformat(entry: CatalogEntry) -> str:
+    """Fecha de modificación de una entrada del catálogo en formato ISO"""
+    return datetime.fromtimestamp(entry.mtime_ns / 1e9).isoformat()
@@ -0,0 +1,165 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Marca de los registros de alto volumen (uno o varios por correo enviado), que
+# se muestrean con LOG_SAMPLE_RATE: `logger.info("...", valor, extra=SAMPLED)`
+SAMPLED: Dict[str, Any] = {"sampled": True}
+
+# Atributos propios de LogRecord; el resto son campos añadidos con `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName", "sampled"}
+# Tipos de argumentos que no cambian entre la llamada y el formateo en el hilo de escritura
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None), bytes)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos añadidos mediante `extra`"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar solo una fracción de los registros marcados con SAMPLED por debajo de WARNING"""
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola los registros sin bloquear al hilo que escribe el log (el event loop).
+    
+    A diferencia de `QueueHandler`, no formatea el mensaje al encolarlo: se
+    formatea en el hilo de escritura, salvo si algún argumento es mutable y
+    podría cambiar antes. Si la cola está llena (el disco no da abasto), el
+    registro se descarta y se cuenta; el hilo de escritura avisa después.
+    """
+    
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in _iter_args(record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _DropReportingListener(logging.handlers.QueueListener):
+    """Escribe los registros en el hilo de escritura e informa de los descartados por cola llena"""
+    
+    def __init__(self, log_queue, queue_handler: NonBlockingQueueHandler, *handlers: logging.Handler):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self._reported = 0
+    
+    def handle(self, record: logging.LogRecord) -> None:
+        dropped = self.queue_handler.dropped
+        if dropped != self._reported:
+            warning = logging.makeLogRecord({
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": "%d registros de log descartados: la cola de escritura estaba llena",
+                "args": (dropped - self._reported,),
+            })
+            self._reported = dropped
+            super().handle(warning)
+        super().handle(record)
+    
+    def enqueue_sentinel(self) -> None:
+        # Al detenerse se espera a que haya sitio: los registros pendientes se escriben
+        self.queue.put(self._sentinel)
+
+def setup_logging() -> None:
+    """
+    Configura el log de la aplicación: los registros se encolan en el hilo que
+    los emite y un hilo aparte los formatea y escribe en la consola y en
+    `logs/app.log` (JSON, con rotación por tamaño). Se puede llamar varias veces.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        
+        console = logging.StreamHandler(sys.stderr)
+        if settings.LOG_CONSOLE_FORMAT == "json":
+            console.setFormatter(JsonFormatter())
+        else:
+            console.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        
+        settings.LOGS_DIR.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            settings.LOGS_DIR / "app.log",
+            maxBytes=settings.LOG_FILE_MAX_BYTES,
+            backupCount=settings.LOG_FILE_BACKUP_COUNT,
+            encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=settings.LOG_QUEUE_MAX_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        # El muestreo se aplica antes de encolar: los registros descartados no cuestan nada más
+        queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
+        
+        root = logging.getLogger()
+        root.setLevel(settings.LOG_LEVEL)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        
+        _listener = _DropReportingListener(log_queue, queue_handler, console, file_handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+def shutdown_logging() -> None:
+    """Escribe los registros pendientes y detiene el hilo de escritura"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_listener.queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def _iter_args(args: Any):
+    return args.values() if isinstance(args, dict) else args
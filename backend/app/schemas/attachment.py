@@ -8,10 +8,12 @@ class AttachmentInfo(BaseModel):
     content_type: str
     size: int
     path: str
+    attachment_id: Optional[str] = None  # SHA-256 del contenido, usable en los envíos
 
 class AttachmentListResponse(BaseModel):
     """Respuesta con la lista de archivos adjuntos disponibles"""
     attachments: List[AttachmentInfo]
+    next_cursor: Optional[str] = None  # cursor para pedir la página siguiente
 
 class AttachmentUploadResponse(BaseModel):
     """Respuesta para la subida de un archivo adjunto"""
@@ -1,5 +1,5 @@
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, model_validator
 
 class EmailRecipient(BaseModel):
     """Modelo para un destinatario de correo electrónico"""
@@ -10,7 +10,15 @@ class Attachment(BaseModel):
     """Modelo para un archivo adjunto"""
     filename: str
     content_type: Optional[str] = None
-    content: str  # Base64 encoded content
+    content: Optional[str] = None  # Base64 encoded content
+    attachment_id: Optional[str] = None  # Identificador de un adjunto ya subido (SHA-256)
+    
+    @model_validator(mode="after")
+    def check_content_or_id(self) -> "Attachment":
+        """Exige el contenido en base64 o la referencia a un adjunto ya subido"""
+        if not self.content and not self.attachment_id:
+            raise ValueError("Se requiere 'content' (base64) o 'attachment_id'")
+        return self
 
 class EmailRequest(BaseModel):
     """Modelo para una solicitud de envío de correo electrónico"""
@@ -25,11 +33,32 @@ class EmailRequest(BaseModel):
     save_to_sent_items: bool = True
     template_variables: Optional[Dict[str, Any]] = None
 
+class RefusedRecipient(BaseModel):
+    """Destinatario rechazado por el servidor de correo"""
+    email: str
+    code: int
+    message: str
+
 class EmailResponse(BaseModel):
     """Modelo para una respuesta de envío de correo electrónico"""
     success: bool
     message: str
     email_id: Optional[str] = None
+    job_id: Optional[str] = None  # Identificador del trabajo cuando el envío se encola
+    refused_recipients: Optional[List[RefusedRecipient]] = None  # Rechazados por el servidor (SMTP)
+    retryable: Optional[bool] = None  # False si reintentar no resolverá el error (destinatario o datos no válidos)
+
+class EmailJobStatus(BaseModel):
+    """Estado de un correo encolado para su envío en segundo plano"""
+    job_id: str
+    status: str  # "pending", "processing", "retrying", "sent", "dead"
+    attempts: int
+    max_attempts: int
+    next_attempt_at: Optional[str] = None
+    last_error: Optional[str] = None
+    result: Optional[EmailResponse] = None
+    created_at: str
+    updated_at: str
 
 class TemplateEmailRequest(BaseModel):
     """Modelo para una solicitud de envío de correo electrónico usando una plantilla"""
@@ -40,4 +69,35 @@ class TemplateEmailRequest(BaseModel):
     bcc_recipients: Optional[str] = None
     importance: str = "normal"
     template_variables: Optional[Dict[str, Any]] = None
-    save_to_sent_items: bool = True
\ No newline at end of file
+    save_to_sent_items: bool = True
+
+class BulkRecipient(BaseModel):
+    """Destinatario de un envío masivo con sus variables de plantilla personalizadas"""
+    email: EmailStr
+    name: Optional[str] = None
+    template_variables: Optional[Dict[str, Any]] = None
+
+class BulkEmailRequest(BaseModel):
+    """Modelo para una solicitud de envío masivo usando una plantilla"""
+    template_name: str
+    subject: str
+    recipients: List[BulkRecipient] = []  # Vacío si los destinatarios llegan como NDJSON
+    importance: str = "normal"
+    template_variables: Optional[Dict[str, Any]] = None  # Variables comunes a todos los destinatarios
+    attachments: Optional[List[Attachment]] = None
+    save_to_sent_items: bool = True
+
+class BulkRecipientResult(BaseModel):
+    """Resultado del envío a un destinatario de un envío masivo"""
+    email: str
+    success: bool
+    message: str
+    email_id: Optional[str] = None
+
+class BulkEmailResponse(BaseModel):
+    """Modelo para la respuesta de un envío masivo"""
+    job_id: str
+    total: int
+    sent: int
+    failed: int
+    results: List[BulkRecipientResult]
@@ -11,6 +11,7 @@ class TemplateInfo(BaseModel):
 class TemplateListResponse(BaseModel):
     """Respuesta con la lista de plantillas disponibles"""
     templates: List[TemplateInfo]
+    next_cursor: Optional[str] = None  # cursor para pedir la página siguiente
 
 class TemplateUploadResponse(BaseModel):
     """Respuesta para la subida de una plantilla"""
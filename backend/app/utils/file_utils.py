@@ -1,6 +1,7 @@
 import os
 import base64
 import mimetypes
+import tempfile
 from pathlib import Path
 from typing import List, Optional, Tuple
 
@@ -90,4 +91,29 @@ def get_safe_filename(filename: str) -> str:
     safe_name = re.sub(r'[^\w\-\.]', '_', filename)
     # Eliminar múltiples guiones bajos consecutivos
     safe_name = re.sub('_+', '_', safe_name)
-    return safe_name
\ No newline at end of file
+    return safe_name
+
+def atomic_write_text(file_path: Path, content: str, encoding: str = "utf-8") -> None:
+    """
+    Escribe un archivo de texto de forma atómica: el contenido se escribe en un
+    archivo temporal del mismo directorio y luego se renombra sobre el destino,
+    de modo que los lectores nunca ven un archivo a medio escribir
+    
+    Args:
+        file_path: Ruta del archivo destino
+        content: Contenido a escribir
+        encoding: Codificación del texto
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
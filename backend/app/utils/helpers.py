@@ -2,6 +2,8 @@ import json
 import logging
 from typing import Dict, List, Optional, Union, Any
 
+from app.core.template_engine import compile_template
+
 logger = logging.getLogger(__name__)
 
 def parse_comma_separated_emails(emails_str: str) -> List[str]:
@@ -40,16 +42,17 @@ def safe_json_loads(json_str: str) -> Optional[Dict[str, Any]]:
     try:
         return json.loads(json_str)
     except json.JSONDecodeError as e:
-        logger.error(f"Error al decodificar JSON: {str(e)}")
+        logger.error("Error al decodificar JSON: %s", e)
         return None
 
-def apply_template_variables(content: str, variables: Dict[str, Any]) -> str:
+def apply_template_variables(content: str, variables: Dict[str, Any], escape: bool = False) -> str:
     """
     Aplica variables a una plantilla
     
     Args:
         content: Contenido de la plantilla
         variables: Diccionario con las variables a aplicar
+        escape: Escapar los valores como HTML
     
     Returns:
         str: Contenido con las variables aplicadas
@@ -57,12 +60,8 @@ def apply_template_variables(content: str, variables: Dict[str, Any]) -> str:
     if not variables:
         return content
     
-    result = content
-    for key, value in variables.items():
-        placeholder = "{" + key + "}"
-        result = result.replace(placeholder, str(value))
-    
-    return result
+    # La plantilla compilada se reutiliza entre llamadas con el mismo contenido
+    return compile_template(content).render(variables, escape=escape)
 
 def format_size_human_readable(size_bytes: int) -> str:
     """
@@ -0,0 +1,184 @@
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+# Elementos cuyo contenido no se muestra como texto
+_SKIPPED_TAGS = frozenset({"head", "title", "script", "style", "noscript", "template", "svg", "object", "iframe"})
+# Bloques separados por una línea en blanco
+_PARAGRAPH_TAGS = frozenset({
+    "p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "ul", "ol", "dl", "table",
+    "pre", "figure", "form", "fieldset", "address",
+})
+# Bloques separados por un salto de línea
+_LINE_TAGS = frozenset({
+    "div", "section", "article", "header", "footer", "nav", "aside", "main", "center",
+    "tr", "li", "dt", "dd", "figcaption", "caption", "tbody", "thead", "tfoot",
+})
+# Celdas: se separan con un espacio dentro de la fila
+_CELL_TAGS = frozenset({"td", "th"})
+# Esquemas de enlace que no se listan como referencia
+_IGNORED_LINK_PREFIXES = ("#", "javascript:", "mailto:", "tel:")
+
+_WHITESPACE_RE = re.compile(r"[ \t\r\n\f]+")
+# Caracteres invisibles usados para rellenar el preencabezado de los correos
+_INVISIBLE_RE = re.compile("[\u00ad\u034f\u200b-\u200f\u2060\ufeff]+")
+
+class HtmlToTextConverter(HTMLParser):
+    """
+    Conversor incremental de HTML a texto plano para la parte alternativa de
+    los correos.
+    
+    Respeta la estructura de bloques (párrafos, listas, filas de tablas),
+    colapsa los espacios como lo haría un navegador, descarta `<head>`,
+    `<style>` y `<script>` y sustituye los enlaces por referencias numeradas
+    (`texto [1]`) listadas al final. El HTML puede entregarse por bloques con
+    `feed()`; `close()` devuelve el texto.
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._out: List[str] = []
+        self._pending_newlines = 0
+        self._at_line_start = True
+        self._skip_depth = 0
+        self._pre_depth = 0
+        self._lists: List[List[int]] = []  # contador de cada lista abierta (-1 si no es ordenada)
+        self._links: Dict[str, int] = {}
+        self._open_links: List[Tuple[Optional[str], int]] = []  # (href, posición del texto del enlace)
+    
+    def close(self) -> str:
+        """Termina la conversión y devuelve el texto"""
+        super().close()
+        text = "\n".join(line.rstrip(" ") for line in "".join(self._out).split("\n")).strip("\n")
+        if self._links:
+            references = "\n".join(f"[{index}] {href}" for href, index in self._links.items())
+            text = f"{text}\n\n{references}" if text else references
+        return text + "\n" if text else ""
+    
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        
+        if tag in _PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in _LINE_TAGS:
+            self._break(1)
+        elif tag in _CELL_TAGS:
+            self._space()
+        
+        if tag == "br":
+            self._newline()
+        elif tag == "hr":
+            self._break(2)
+            self._write("-" * 20)
+            self._break(2)
+        elif tag == "pre":
+            self._pre_depth += 1
+        elif tag in ("ul", "ol"):
+            self._lists.append([0 if tag == "ol" else -1])
+        elif tag == "li":
+            marker = "-"
+            if self._lists and self._lists[-1][0] >= 0:
+                self._lists[-1][0] += 1
+                marker = f"{self._lists[-1][0]}."
+            self._write("  " * max(0, len(self._lists) - 1) + marker + " ")
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            self._open_links.append((href.strip() if href else None, len(self._out)))
+        elif tag == "img":
+            alt = dict(attrs).get("alt")
+            if alt and alt.strip():
+                self.handle_data(alt)
+    
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in ("br", "hr", "img"):
+            self.handle_endtag(tag)
+    
+    def handle_endtag(self, tag: str) -> None:
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth:
+            return
+        
+        if tag == "pre":
+            self._pre_depth = max(0, self._pre_depth - 1)
+        elif tag in ("ul", "ol"):
+            if self._lists:
+                self._lists.pop()
+        elif tag == "a" and self._open_links:
+            href, start = self._open_links.pop()
+            self._close_link(href, "".join(self._out[start:]).strip())
+        
+        if tag in _PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in _LINE_TAGS:
+            self._break(1)
+    
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth or not data:
+            return
+        if self._pre_depth:
+            self._write(data)
+            return
+        
+        data = _WHITESPACE_RE.sub(" ", _INVISIBLE_RE.sub("", data).replace("\xa0", " "))
+        if self._at_line_start or self._pending_newlines or (self._out and self._out[-1].endswith(" ")):
+            data = data.lstrip(" ")
+        if data:
+            self._write(data)
+    
+    def _close_link(self, href: Optional[str], label: str) -> None:
+        """Añade la referencia de un enlace tras su texto"""
+        if not href or href.startswith(_IGNORED_LINK_PREFIXES) or href == label:
+            return
+        index = self._links.setdefault(href, len(self._links) + 1)
+        if label:
+            # Pegada al texto del enlace, aunque haya un salto de bloque pendiente
+            self._out.append(f" [{index}]")
+            self._at_line_start = False
+        else:
+            self._write(f"[{index}]")
+    
+    def _write(self, text: str) -> None:
+        if self._pending_newlines:
+            if self._out:
+                # Los espacios al final de la línea no aportan nada
+                if self._out[-1].endswith(" "):
+                    self._out[-1] = self._out[-1].rstrip(" ")
+                self._out.append("\n" * self._pending_newlines)
+            self._pending_newlines = 0
+        self._out.append(text)
+        self._at_line_start = text.endswith("\n")
+    
+    def _break(self, newlines: int) -> None:
+        """Solicita un salto de bloque; se materializa antes del siguiente texto"""
+        if self._out and not self._at_line_start:
+            self._pending_newlines = max(self._pending_newlines, newlines)
+        elif self._out:
+            self._pending_newlines = max(self._pending_newlines, newlines - 1)
+    
+    def _newline(self) -> None:
+        self._write("\n")
+    
+    def _space(self) -> None:
+        if self._out and not self._at_line_start and not self._pending_newlines and not self._out[-1].endswith(" "):
+            self._out.append(" ")
+
+def html_to_text(content: str) -> str:
+    """
+    Convierte HTML en texto plano legible
+    
+    Args:
+        content: Documento o fragmento HTML
+    
+    Returns:
+        str: Texto con la estructura de bloques y los enlaces como referencias
+    """
+    converter = HtmlToTextConverter()
+    converter.feed(content)
+    return converter.close()
@@ -0,0 +1,121 @@
+from typing import AsyncIterator, Dict, List, Optional
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+class MultipartFileStream:
+    """
+    Lee un archivo de una petición multipart/form-data a medida que llega el cuerpo.
+    
+    A diferencia de `request.form()`, que recibe el cuerpo completo y lo guarda en
+    un temporal antes de que el endpoint lo vea, aquí el archivo se entrega por
+    bloques según se recibe, de modo que quien lo consume puede aplicar límites
+    de tamaño y abandonar la lectura en cuanto se superan.
+    
+    Solo se lee el primer archivo del campo indicado; el resto de partes se ignora.
+    """
+    
+    def __init__(self, request: Request, field_name: str):
+        """
+        Args:
+            request: Petición con el cuerpo multipart
+            field_name: Nombre del campo del archivo
+        
+        Raises:
+            ValueError: Si el cuerpo no es multipart/form-data
+        """
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+            raise ValueError("Se esperaba un cuerpo multipart/form-data")
+        
+        self.field_name = field_name
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self._body = request.stream().__aiter__()
+        self._chunks: List[bytes] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_finished = False
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+    
+    async def open(self) -> None:
+        """
+        Lee el cuerpo hasta las cabeceras del archivo (nombre y tipo)
+        
+        Raises:
+            ValueError: Si el cuerpo termina sin el archivo o no es válido
+        """
+        while self.filename is None:
+            if not await self._feed():
+                raise ValueError(f"Falta el archivo '{self.field_name}'")
+    
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """
+        Recorre el contenido del archivo por bloques según llega el cuerpo
+        
+        Raises:
+            ValueError: Si el cuerpo termina antes que el archivo
+        """
+        while True:
+            if self._chunks:
+                chunks, self._chunks = self._chunks, []
+                for chunk in chunks:
+                    yield chunk
+            if self._file_finished:
+                return
+            if not await self._feed():
+                raise ValueError("El cuerpo multipart terminó antes que el archivo")
+    
+    async def _feed(self) -> bool:
+        """Pasa al parser el siguiente bloque del cuerpo; False si no quedan"""
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            self._parser.finalize()
+            return False
+        self._parser.write(chunk)
+        return True
+    
+    # Callbacks del parser (se ejecutan dentro de `write`)
+    
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+    
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+    
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+    
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+    
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        self._in_file = self.filename is None and name == self.field_name and filename is not None
+        if self._in_file:
+            self.filename = filename.decode("utf-8", errors="replace")
+            self.content_type = self._headers.get(b"content-type", b"").decode("latin-1") or None
+    
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._chunks.append(bytes(data[start:end]))
+    
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_finished = True
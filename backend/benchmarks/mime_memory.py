@@ -0,0 +1,123 @@
+"""
+Benchmark de memoria del envío SMTP: compara el pico de memoria al enviar un
+mensaje con un adjunto grande (25 MB por defecto) construyéndolo con
+`MIMEMultipart` + `send_message`, como se hacía antes, y con el serializador
+por bloques de `app/core/providers/titan/mime.py`.
+
+El servidor SMTP se sustituye por una sesión que descarta los datos, de modo
+que solo se mide la construcción y serialización del mensaje.
+
+Uso (desde el directorio backend):
+    python benchmarks/mime_memory.py [--size-mb 25]
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+from smtplib import SMTP
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from app.core.attachment_store import AttachmentStore  # noqa: E402
+from app.core.providers.titan.mime import AttachmentPart, MultipartPart, TextPart, send_streaming  # noqa: E402
+
+SENDER = "benchmark@example.com"
+RECIPIENTS = ["destino@example.com"]
+BODY = "<p>Mensaje de prueba con un adjunto grande</p>"
+
+class NullSMTP(SMTP):
+    """Sesión SMTP que acepta todos los comandos y descarta los datos"""
+    
+    def __init__(self):
+        super().__init__()
+        self.bytes_sent = 0
+        self._replies = []
+    
+    def ehlo_or_helo_if_needed(self):
+        pass
+    
+    def mail(self, sender, options=()):
+        return 250, b"OK"
+    
+    def rcpt(self, recip, options=()):
+        return 250, b"OK"
+    
+    def putcmd(self, cmd, args=""):
+        if cmd == "data":
+            self._replies += [(354, b"Go ahead"), (250, b"OK")]
+    
+    def getreply(self):
+        return self._replies.pop(0)
+    
+    def send(self, s):
+        self.bytes_sent += len(s)
+
+def legacy_send(content_b64: str) -> int:
+    """Envío anterior: árbol MIMEMultipart con el adjunto decodificado y `send_message`"""
+    msg = MIMEMultipart("mixed")
+    msg["Subject"] = "Benchmark"
+    msg["From"] = SENDER
+    msg["To"] = ", ".join(RECIPIENTS)
+    msg.attach(MIMEText(BODY, "html", "utf-8"))
+    
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(base64.b64decode(content_b64))
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", "attachment", filename="adjunto.bin")
+    msg.attach(part)
+    
+    smtp = NullSMTP()
+    smtp.send_message(msg)
+    return smtp.bytes_sent
+
+def streaming_send(store: AttachmentStore, attachment_id: str) -> int:
+    """Envío actual: mensaje serializado por bloques leyendo el adjunto del almacén"""
+    msg = MultipartPart(
+        "mixed",
+        [
+            TextPart(BODY, "html"),
+            AttachmentPart(store, attachment_id, "adjunto.bin", "application/octet-stream"),
+        ],
+        headers=[("Subject", "Benchmark"), ("From", SENDER), ("To", ", ".join(RECIPIENTS))]
+    )
+    smtp = NullSMTP()
+    send_streaming(smtp, SENDER, RECIPIENTS, msg.iter_bytes())
+    return smtp.bytes_sent
+
+def measure(label: str, function, *args) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    sent = function(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<26} pico {peak / 2**20:8.2f} MiB  enviados {sent / 2**20:7.2f} MiB  {elapsed:6.2f} s")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=25, help="Tamaño del adjunto en MB")
+    args = parser.parse_args()
+    
+    content = os.urandom(int(args.size_mb * 1024 * 1024))
+    content_b64 = base64.b64encode(content).decode("ascii")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        store = AttachmentStore(Path(directory))
+        attachment_id = store.put_bytes(content)
+        del content
+        
+        print(f"Adjunto de {args.size_mb:g} MB (los datos de entrada no se cuentan en el pico)")
+        measure("MIMEMultipart", legacy_send, content_b64)
+        measure("Serializador por bloques", streaming_send, store, attachment_id)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Servidores locales para los benchmarks de extremo a extremo: un sumidero SMTP
+que acepta la autenticación y descarta los mensajes, y un sustituto de
+Microsoft Graph que responde a `sendMail` y `$batch` sin hacer nada.
+
+Ambos se ejecutan en hilos del propio proceso y escuchan en 127.0.0.1 en un
+puerto libre, de modo que los benchmarks no necesitan red.
+"""
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Sesión SMTP mínima: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP y QUIT"""
+    
+    def handle(self) -> None:
+        self._reply(b"220 benchmark ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self._reply(b"250-benchmark\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 104857600")
+            elif command == b"HELO":
+                self._reply(b"250 benchmark")
+            elif command == b"AUTH":
+                self._reply(b"235 2.7.0 Authentication successful")
+            elif command == b"DATA":
+                self._reply(b"354 End data with <CR><LF>.<CR><LF>")
+                size = self._read_data()
+                if self.server.data_delay:
+                    # Servidor lento: la respuesta a DATA tarda en llegar
+                    time.sleep(self.server.data_delay)
+                self.server.messages += 1
+                self.server.bytes_received += size
+                self._reply(b"250 2.0.0 OK")
+            elif command == b"QUIT":
+                self._reply(b"221 2.0.0 Bye")
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self._reply(b"250 2.0.0 OK")
+    
+    def _read_data(self) -> int:
+        size = 0
+        for line in self.rfile:
+            if line == b".\r\n":
+                break
+            size += len(line)
+        return size
+    
+    def _reply(self, response: bytes) -> None:
+        self.wfile.write(response + b"\r\n")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Servidor SMTP que acepta todos los mensajes y solo cuenta lo recibido.
+    Con `data_delay` responde a cada DATA tras esa pausa, como un servidor lento.
+    """
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, data_delay: float = 0.0):
+        super().__init__((host, port), _SMTPSinkHandler)
+        self.data_delay = data_delay
+        self.messages = 0
+        self.bytes_received = 0
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+    
+    def start(self) -> "SMTPSink":
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+class _GraphHandler(BaseHTTPRequestHandler):
+    """Respuestas de Graph usadas por el proveedor de Outlook"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.bytes_received += len(body)
+        path = self.path.split("?", 1)[0]
+        
+        if path.endswith("/me/sendMail"):
+            self.server.messages += 1
+            self._respond(202)
+        elif path.endswith("/$batch"):
+            requests = json.loads(body)["requests"]
+            self.server.batch_calls.append([request["id"] for request in requests])
+            if self.server.batch_responder is not None:
+                responses = self.server.batch_responder(requests)
+            else:
+                responses = [{"id": request["id"], "status": 202} for request in requests]
+            self.server.messages += sum(1 for response in responses if response.get("status") == 202)
+            self._respond(200, {"responses": responses})
+        else:
+            self._respond(404, {"error": {"code": "NotFound", "message": f"Ruta no simulada: {path}"}})
+    
+    def _respond(self, status: int, payload: Optional[dict] = None) -> None:
+        data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+class GraphStandIn(ThreadingHTTPServer):
+    """
+    Sustituto local de la API de Microsoft Graph (`/v1.0/me/sendMail` y `/v1.0/$batch`).
+    Por defecto acepta todas las peticiones de `$batch`; `batch_responder` recibe
+    las peticiones de cada llamada y devuelve sus respuestas, y `batch_calls`
+    guarda los ids enviados en cada llamada.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        batch_responder: Optional[Callable[[List[dict]], List[dict]]] = None
+    ):
+        super().__init__((host, port), _GraphHandler)
+        self.batch_responder = batch_responder
+        self.batch_calls: List[List[str]] = []
+        self.messages = 0
+        self.bytes_received = 0
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1.0"
+    
+    def start(self) -> "GraphStandIn":
+        self._thread = threading.Thread(target=self.serve_forever, name="graph-stand-in", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,545 @@
+"""
+Suite de benchmarks reproducible y sin red. Mide las etapas del envío y los
+endpoints completos, y guarda los resultados en JSON para compararlos entre
+commits.
+
+Etapas (microbenchmarks):
+    template_render      `TemplateService.render_template`
+    apply_variables      `apply_template_variables`
+    titan_mime           `TitanEmailProvider._create_mime_message` serializado completo
+    outlook_body         `OutlookEmailProvider._create_message_body`
+    attachment_base64    codificación base64 MIME del almacén, `contentBytes` de
+                         Graph y lectura por bloques para SMTP
+
+De extremo a extremo (`/emails/send`, `/emails/send-template` y
+`/emails/send-bulk`), con Titan contra un sumidero SMTP local y con Outlook
+contra un sustituto local de Graph (ver `servers.py`). Las peticiones pasan
+por la aplicación FastAPI completa (validación, idempotencia, servicios y
+proveedor) sin servidor HTTP delante. Con Titan, el envío masivo falla si
+algún mensaje no se construye con las partes comunes de su lote.
+
+Los parámetros varían el número de destinatarios, el tamaño de la plantilla y
+el del adjunto. Las bases de datos, plantillas y adjuntos se crean en un
+directorio temporal, el límite de envíos se desactiva y los registros de
+nivel INFO se silencian.
+
+Uso (desde el directorio backend):
+    python benchmarks/suite.py [--quick] [--only titan_mime,e2e_titan]
+                               [--output resultados.json] [--compare anterior.json]
+
+Sin `--output`, los resultados se guardan en `benchmarks/results/` con la
+fecha y el commit en el nombre. Con `--compare` se muestra la variación de
+cada caso respecto a otro resultado y el proceso termina con código 1 si
+alguno empeora más de `--max-regression`.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx  # noqa: E402
+
+from app.api import deps  # noqa: E402
+from app.api.api import create_application  # noqa: E402
+from app.config import get_settings  # noqa: E402
+from app.core.attachment_store import AttachmentStore, get_attachment_store  # noqa: E402
+from app.core.providers.outlook.email_provider import OutlookEmailProvider  # noqa: E402
+from app.core.providers.titan.email_provider import TitanEmailProvider  # noqa: E402
+from app.core.providers.titan.mime import dot_stuff  # noqa: E402
+from app.core.template_engine import CompiledTemplate, register_template  # noqa: E402
+from app.core.template_service import TemplateService  # noqa: E402
+from app.schemas.email import EmailRequest  # noqa: E402
+from app.utils.helpers import apply_template_variables  # noqa: E402
+from benchmarks.servers import GraphStandIn, SMTPSink  # noqa: E402
+from benchmarks.template_render import build_template  # noqa: E402
+
+RESULTS_DIR = BACKEND_DIR / "benchmarks" / "results"
+BASE_TEMPLATE_PATH = BACKEND_DIR / "templates" / "beryllium-email.html"
+SENDER = "benchmark@example.com"
+# Destinatarios de cada petición de `/emails/send-bulk`
+BULK_RECIPIENTS = 50
+
+# Parámetros de cada modo: completo y rápido (`--quick`)
+MATRIX = {
+    "full": {
+        "recipients": [1, 10, 50],
+        "template_kb": [2, 16, 128],
+        "attachment_kb": [0, 100, 2048],
+        "variables": 20,
+        "target_seconds": 0.5,
+        "requests": 100,
+        "concurrency": 8,
+    },
+    "quick": {
+        "recipients": [1, 10],
+        "template_kb": [2, 16],
+        "attachment_kb": [0, 100],
+        "variables": 20,
+        "target_seconds": 0.1,
+        "requests": 40,
+        "concurrency": 4,
+    },
+}
+
+settings = get_settings()
+
+class Context:
+    """Recursos compartidos por los benchmarks: directorio temporal, plantillas y adjuntos"""
+    
+    def __init__(self, root: Path, matrix: Dict[str, Any]):
+        self.root = root
+        self.matrix = matrix
+        self.templates: Dict[int, str] = {}
+        self.attachments: Dict[int, bytes] = {}
+        self.variables = {f"VAR_{index}": f"valor {index}" for index in range(matrix["variables"])}
+        
+        base = BASE_TEMPLATE_PATH.read_text(encoding="utf-8")
+        for size_kb in matrix["template_kb"]:
+            content = (base * (size_kb * 1024 // len(base) + 1))[:size_kb * 1024]
+            self.templates[size_kb] = build_template(content, matrix["variables"])
+            (settings.TEMPLATES_DIR / f"{template_name(size_kb)}.html").write_text(
+                self.templates[size_kb], encoding="utf-8"
+            )
+        # Contenido pseudoaleatorio reproducible: el mismo adjunto en todas las ejecuciones
+        generator = random.Random(0)
+        for size_kb in matrix["attachment_kb"]:
+            self.attachments[size_kb] = generator.randbytes(size_kb * 1024)
+
+def template_name(size_kb: int) -> str:
+    return f"benchmark-{size_kb}kb"
+
+def configure(root: Path, sink: SMTPSink, graph: GraphStandIn) -> None:
+    """
+    Apunta la configuración a los servidores locales y al directorio temporal.
+    Debe llamarse antes de crear cualquier servicio o proveedor.
+    """
+    for name in ("templates", "store", "data"):
+        (root / name).mkdir()
+    settings.TEMPLATES_DIR = root / "templates"
+    settings.ATTACHMENT_STORE_DIR = root / "store"
+    settings.QUEUE_DB_PATH = root / "data" / "email_queue.db"
+    settings.IDEMPOTENCY_DB_PATH = root / "data" / "idempotency.db"
+    settings.CATALOG_DB_PATH = root / "data" / "catalog.db"
+    
+    settings.TITAN_SMTP_SERVER = "127.0.0.1"
+    settings.TITAN_SMTP_PORT = sink.port
+    settings.TITAN_SMTP_STARTTLS = False
+    settings.TITAN_SENDER_EMAIL = SENDER
+    settings.TITAN_SENDER_PASSWORD = "benchmark"
+    settings.MS_GRAPH_ENDPOINT = graph.endpoint
+    settings.OUTLOOK_HTTP2 = False
+    
+    settings.RATE_LIMIT_ENABLED = False
+    settings.WARMUP_ENABLED = False
+
+def measure(function: Callable[[], Any], target_seconds: float, repeat: int = 5) -> Dict[str, float]:
+    """
+    Mide una operación repitiéndola hasta ocupar `target_seconds` por ronda
+    
+    Returns:
+        Dict[str, float]: Tiempo por operación (mínimo y mediana de las rondas) en µs
+    """
+    started = time.perf_counter()
+    function()
+    single = max(time.perf_counter() - started, 1e-7)
+    number = max(1, int(target_seconds / single))
+    
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - started) / number * 1e6)
+    return {"min_us": round(min(rounds), 3), "median_us": round(statistics.median(rounds), 3), "number": number}
+
+def _recipients(count: int) -> List[Dict[str, str]]:
+    return [{"email": f"destino{index}@example.com", "name": f"Destino {index}"} for index in range(count)]
+
+def _email_payload(ctx: Context, recipients: int, template_kb: int, attachment_kb: int) -> Dict[str, Any]:
+    payload = {
+        "subject": "Benchmark",
+        "body": ctx.templates[template_kb],
+        "body_type": "HTML",
+        "to_recipients": _recipients(recipients),
+        "template_variables": ctx.variables,
+    }
+    if attachment_kb:
+        payload["attachments"] = [{
+            "filename": "adjunto.pdf",
+            "content": base64.b64encode(ctx.attachments[attachment_kb]).decode("ascii"),
+        }]
+    return payload
+
+def _bulk_payload(ctx: Context, template_kb: int, attachment_kb: int) -> Dict[str, Any]:
+    payload = {
+        "template_name": template_name(template_kb),
+        "subject": "Benchmark",
+        "template_variables": ctx.variables,
+        "recipients": [
+            {**recipient, "template_variables": {"VAR_0": recipient["name"]}}
+            for recipient in _recipients(BULK_RECIPIENTS)
+        ],
+    }
+    if attachment_kb:
+        payload["attachments"] = _email_payload(ctx, 1, template_kb, attachment_kb)["attachments"]
+    return payload
+
+def _email_request(ctx: Context, recipients: int, template_kb: int, attachment_kb: int):
+    """Correo con el adjunto ya subido al almacén, como tras `/attachments`"""
+    payload = _email_payload(ctx, recipients, template_kb, 0)
+    if attachment_kb:
+        attachment_id = get_attachment_store().put_bytes(ctx.attachments[attachment_kb])
+        payload["attachments"] = [{"filename": "adjunto.pdf", "attachment_id": attachment_id}]
+    return EmailRequest.model_validate(payload)
+
+def _register_templates(ctx: Context) -> List[CompiledTemplate]:
+    """
+    Registra las plantillas como lo hace TemplateService al leerlas: las etapas
+    por mensaje se miden con la plantilla ya compilada. Hay que retener el
+    resultado mientras dure la medición
+    """
+    return [register_template(content) for content in ctx.templates.values()]
+
+def bench_template_render(ctx: Context) -> List[Dict[str, Any]]:
+    
+    service = TemplateService()
+    try:
+        return [
+            _result("template_render", {"template_kb": size_kb}, measure(
+                lambda: service.render_template(template_name(size_kb), ctx.variables), ctx.matrix["target_seconds"]
+            ))
+            for size_kb in ctx.matrix["template_kb"]
+        ]
+    finally:
+        service.close()
+
+def bench_apply_variables(ctx: Context) -> List[Dict[str, Any]]:
+    
+    registered = _register_templates(ctx)  # noqa: F841
+    return [
+        _result("apply_variables", {"template_kb": size_kb}, measure(
+            lambda: apply_template_variables(ctx.templates[size_kb], ctx.variables), ctx.matrix["target_seconds"]
+        ))
+        for size_kb in ctx.matrix["template_kb"]
+    ]
+
+def bench_titan_mime(ctx: Context) -> List[Dict[str, Any]]:
+    
+    provider = TitanEmailProvider()
+    registered = _register_templates(ctx)  # noqa: F841
+    results = []
+    for recipients, template_kb, attachment_kb in _grid(ctx):
+        email_data = _email_request(ctx, recipients, template_kb, attachment_kb)
+        
+        def build() -> int:
+            # Se recorre el mensaje entero: se serializa al enviarlo
+            message = provider._create_mime_message(email_data)
+            return sum(len(chunk) for chunk in dot_stuff(message.iter_bytes()))
+        
+        results.append(_result(
+            "titan_mime",
+            {"recipients": recipients, "template_kb": template_kb, "attachment_kb": attachment_kb},
+            measure(build, ctx.matrix["target_seconds"]),
+            message_bytes=build()
+        ))
+    return results
+
+def bench_outlook_body(ctx: Context) -> List[Dict[str, Any]]:
+    
+    provider = OutlookEmailProvider(account=SENDER)
+    registered = _register_templates(ctx)  # noqa: F841
+    results = []
+    for recipients, template_kb, attachment_kb in _grid(ctx):
+        email_data = _email_request(ctx, recipients, template_kb, attachment_kb)
+        results.append(_result(
+            "outlook_body",
+            {"recipients": recipients, "template_kb": template_kb, "attachment_kb": attachment_kb},
+            measure(lambda: provider._create_message_body(email_data), ctx.matrix["target_seconds"])
+        ))
+    return results
+
+def bench_attachment_base64(ctx: Context) -> List[Dict[str, Any]]:
+    
+    store = AttachmentStore()
+    # Sin caché en memoria: se mide la lectura y codificación desde disco
+    store.cache_max_bytes = 0
+    results = []
+    for size_kb in ctx.matrix["attachment_kb"]:
+        if not size_kb:
+            continue
+        content = ctx.attachments[size_kb]
+        attachment_id = store.put_bytes(content)
+        raw_path = store.get(attachment_id).raw_path
+        cases = {
+            # Al subirlo: el almacén lo guarda codificado en base64 MIME una sola vez
+            "store_encode": lambda: AttachmentStore._encode_file(raw_path, io.BytesIO()),
+            # `contentBytes` de Graph (base64 sin saltos de línea)
+            "graph_content_bytes": lambda: store.get_base64(attachment_id),
+            # Lectura por bloques del adjunto ya codificado para DATA
+            "smtp_stream": lambda: sum(len(chunk) for chunk in store.iter_mime_base64(attachment_id)),
+        }
+        for operation, function in cases.items():
+            results.append(_result(
+                "attachment_base64",
+                {"operation": operation, "attachment_kb": size_kb},
+                measure(function, ctx.matrix["target_seconds"])
+            ))
+    return results
+
+async def _run_requests(
+    client: httpx.AsyncClient,
+    path: str,
+    payload: Dict[str, Any],
+    requests: int,
+    concurrency: int,
+    server: Any
+) -> Dict[str, float]:
+    """
+    Lanza `requests` peticiones con `concurrency` simultáneas y resume las
+    latencias y los mensajes que llegaron al servidor local
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} respondió {response.status_code}: {response.text[:200]}")
+    
+    # Primera petición fuera de la medición (conexiones, compilación de la plantilla)
+    await client.post(path, json=payload)
+    received = server.messages
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1e3, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1e3, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1e3, 3),
+        "requests_per_second": round(requests / elapsed, 2),
+        "requests": requests,
+        "concurrency": concurrency,
+        "messages_received": server.messages - received,
+    }
+
+async def _bench_e2e(ctx: Context, provider: str, server: Any) -> List[Dict[str, Any]]:
+    
+    settings.EMAIL_PROVIDER = provider
+    application = create_application()
+    results = []
+    async with application.router.lifespan_context(application):
+        email_provider = deps.get_email_service().provider
+        if provider == "outlook":
+            # Token ficticio: el sustituto de Graph no lo comprueba
+            email_provider.auth._cache_token({"access_token": "benchmark", "expires_in": 3600})
+        
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for recipients, template_kb, attachment_kb in _grid(ctx):
+                stats = await _run_requests(
+                    client,
+                    f"{settings.API_V1_STR}/emails/send",
+                    _email_payload(ctx, recipients, template_kb, attachment_kb),
+                    ctx.matrix["requests"],
+                    ctx.matrix["concurrency"],
+                    server
+                )
+                results.append(_result(
+                    "e2e_send",
+                    {"provider": provider, "recipients": recipients, "template_kb": template_kb, "attachment_kb": attachment_kb},
+                    stats
+                ))
+            
+            for recipients, template_kb in itertools.product(ctx.matrix["recipients"], ctx.matrix["template_kb"]):
+                payload = {
+                    "template_name": template_name(template_kb),
+                    "subject": "Benchmark",
+                    "to_recipients": ",".join(recipient["email"] for recipient in _recipients(recipients)),
+                    "template_variables": ctx.variables,
+                }
+                stats = await _run_requests(
+                    client,
+                    f"{settings.API_V1_STR}/emails/send-template",
+                    payload,
+                    ctx.matrix["requests"],
+                    ctx.matrix["concurrency"],
+                    server
+                )
+                results.append(_result(
+                    "e2e_send_template",
+                    {"provider": provider, "recipients": recipients, "template_kb": template_kb},
+                    stats
+                ))
+            
+            for template_kb, attachment_kb in itertools.product(ctx.matrix["template_kb"], ctx.matrix["attachment_kb"]):
+                shared_before = email_provider.get_stats().get("bulk_shared_parts_messages", 0)
+                stats = await _run_requests(
+                    client,
+                    f"{settings.API_V1_STR}/emails/send-bulk",
+                    _bulk_payload(ctx, template_kb, attachment_kb),
+                    max(1, ctx.matrix["requests"] // 10),
+                    ctx.matrix["concurrency"],
+                    server
+                )
+                results.append(_result(
+                    "e2e_send_bulk",
+                    {
+                        "provider": provider,
+                        "recipients": BULK_RECIPIENTS,
+                        "template_kb": template_kb,
+                        "attachment_kb": attachment_kb
+                    },
+                    stats
+                ))
+                if provider == "titan":
+                    # Sin partes comunes serializadas, cada mensaje vuelve a codificar los adjuntos
+                    shared = email_provider.get_stats()["bulk_shared_parts_messages"] - shared_before
+                    if shared < stats["messages_received"]:
+                        raise RuntimeError(
+                            f"Solo {shared} de {stats['messages_received']} mensajes masivos usaron las partes comunes del lote"
+                        )
+    return results
+
+def _grid(ctx: Context):
+    return itertools.product(ctx.matrix["recipients"], ctx.matrix["template_kb"], ctx.matrix["attachment_kb"])
+
+def _result(name: str, params: Dict[str, Any], stats: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+    result = {"name": name, "params": params, **stats, **extra}
+    metric = _headline(result)
+    print(f"{name:<20} {_format_params(params):<62} {metric}={result[metric]}", flush=True)
+    return result
+
+def _headline(result: Dict[str, Any]) -> str:
+    """Métrica usada para comparar resultados: mediana por operación o p50 de las peticiones"""
+    return "median_us" if "median_us" in result else "p50_ms"
+
+def _format_params(params: Dict[str, Any]) -> str:
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+def _case_key(result: Dict[str, Any]) -> str:
+    return f"{result['name']} {_format_params(result['params'])}"
+
+def compare(current: List[Dict[str, Any]], baseline_path: Path, max_regression: float) -> int:
+    """
+    Compara los resultados con los de otra ejecución
+    
+    Returns:
+        int: Número de casos que empeoran más de `max_regression`
+    """
+    baseline = {_case_key(result): result for result in json.loads(baseline_path.read_text())["results"]}
+    regressions = 0
+    print(f"\nComparación con {baseline_path.name}:")
+    for result in current:
+        previous = baseline.get(_case_key(result))
+        if previous is None:
+            continue
+        metric = _headline(result)
+        ratio = result[metric] / previous[metric] if previous[metric] else float("inf")
+        regressed = ratio > 1 + max_regression
+        regressions += regressed
+        marker = "  << EMPEORA" if regressed else ""
+        print(f"{_case_key(result):<84} {previous[metric]:>12} -> {result[metric]:>12} ({ratio:5.2f}x){marker}")
+    return regressions
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+MICRO_BENCHMARKS = {
+    "template_render": bench_template_render,
+    "apply_variables": bench_apply_variables,
+    "titan_mime": bench_titan_mime,
+    "outlook_body": bench_outlook_body,
+    "attachment_base64": bench_attachment_base64,
+}
+E2E_BENCHMARKS = ("e2e_titan", "e2e_outlook")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Menos parámetros y rondas más cortas")
+    parser.add_argument(
+        "--only",
+        help=f"Benchmarks a ejecutar, separados por comas ({', '.join([*MICRO_BENCHMARKS, *E2E_BENCHMARKS])})"
+    )
+    parser.add_argument("--output", type=Path, help="Archivo JSON de resultados")
+    parser.add_argument("--compare", type=Path, help="Resultados anteriores con los que comparar")
+    parser.add_argument(
+        "--max-regression", type=float, default=0.15, help="Empeoramiento tolerado al comparar (0.15 = 15%%)"
+    )
+    args = parser.parse_args()
+    
+    selected = set(args.only.split(",")) if args.only else {*MICRO_BENCHMARKS, *E2E_BENCHMARKS}
+    unknown = selected - {*MICRO_BENCHMARKS, *E2E_BENCHMARKS}
+    if unknown:
+        parser.error(f"Benchmarks desconocidos: {', '.join(sorted(unknown))}")
+    mode = "quick" if args.quick else "full"
+    logging.disable(logging.INFO)
+    
+    results: List[Dict[str, Any]] = []
+    sink = SMTPSink().start()
+    graph = GraphStandIn().start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="smart-emails-bench-") as directory:
+            configure(Path(directory), sink, graph)
+            ctx = Context(Path(directory), MATRIX[mode])
+            
+            for name, benchmark in MICRO_BENCHMARKS.items():
+                if name in selected:
+                    results.extend(benchmark(ctx))
+            if "e2e_titan" in selected:
+                results.extend(asyncio.run(_bench_e2e(ctx, "titan", sink)))
+            if "e2e_outlook" in selected:
+                results.extend(asyncio.run(_bench_e2e(ctx, "outlook", graph)))
+    finally:
+        sink.stop()
+        graph.stop()
+    
+    commit = _git_commit()
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "mode": mode,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "matrix": MATRIX[mode],
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'sin-commit'}-{mode}.json"
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultados guardados en {output}")
+    
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark del renderizado de plantillas: compara la plantilla compilada con el
+bucle `str.replace` que se usaba antes, sobre `templates/beryllium-email.html`.
+
+Uso (desde el directorio backend):
+    python benchmarks/template_render.py [--variables 20] [--number 2000]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from app.core.template_engine import CompiledTemplate, compile_template  # noqa: E402
+
+TEMPLATE_PATH = BACKEND_DIR / "templates" / "beryllium-email.html"
+
+def legacy_render(content: str, variables: dict) -> str:
+    """Renderizado anterior: un `str.replace` por variable"""
+    for key, value in variables.items():
+        content = content.replace(f"{{{key}}}", str(value))
+    return content
+
+def build_template(base: str, variable_count: int) -> str:
+    """Inserta marcadores `{VAR_n}` repartidos a lo largo de la plantilla"""
+    step = max(1, len(base) // (variable_count + 1))
+    chunks = []
+    for index in range(variable_count):
+        chunks.append(base[index * step:(index + 1) * step])
+        chunks.append(f"{{VAR_{index}}}")
+    chunks.append(base[variable_count * step:])
+    return "".join(chunks)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variables", type=int, default=20, help="Número de variables de la plantilla")
+    parser.add_argument("--number", type=int, default=2000, help="Renderizados por medición")
+    args = parser.parse_args()
+    
+    content = build_template(TEMPLATE_PATH.read_text(encoding="utf-8"), args.variables)
+    variables = {f"VAR_{index}": f"valor {index}" for index in range(args.variables)}
+    
+    compiled = compile_template(content)
+    assert compiled.render(variables) == legacy_render(content, variables)
+    
+    legacy = min(timeit.repeat(lambda: legacy_render(content, variables), number=args.number, repeat=5))
+    fast = min(timeit.repeat(lambda: compiled.render(variables), number=args.number, repeat=5))
+    compile_time = min(timeit.repeat(lambda: CompiledTemplate(content), number=100, repeat=5)) / 100
+    
+    print(f"Plantilla: {TEMPLATE_PATH.name} ({len(content)} caracteres, {args.variables} variables)")
+    print(f"str.replace por variable: {legacy / args.number * 1e6:8.2f} µs/render")
+    print(f"Plantilla compilada:      {fast / args.number * 1e6:8.2f} µs/render ({legacy / fast:.1f}x)")
+    print(f"Compilación (una vez):    {compile_time * 1e6:8.2f} µs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Los servidores locales de los benchmarks se reutilizan en las pruebas
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.config import get_settings  # noqa: E402
+
+settings = get_settings()
+
+@pytest.fixture
+def local_settings(tmp_path, monkeypatch):
+    """Apunta los directorios y bases de datos de la aplicación a un directorio temporal"""
+    for name in ("templates", "attachments", "store", "data"):
+        (tmp_path / name).mkdir()
+    monkeypatch.setattr(settings, "BASE_DIR", tmp_path)
+    monkeypatch.setattr(settings, "TEMPLATES_DIR", tmp_path / "templates")
+    monkeypatch.setattr(settings, "ATTACHMENTS_DIR", tmp_path / "attachments")
+    monkeypatch.setattr(settings, "ATTACHMENT_STORE_DIR", tmp_path / "store")
+    monkeypatch.setattr(settings, "QUEUE_DB_PATH", tmp_path / "data" / "email_queue.db")
+    monkeypatch.setattr(settings, "IDEMPOTENCY_DB_PATH", tmp_path / "data" / "idempotency.db")
+    monkeypatch.setattr(settings, "CATALOG_DB_PATH", tmp_path / "data" / "catalog.db")
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(settings, "WARMUP_ENABLED", False)
+    return settings
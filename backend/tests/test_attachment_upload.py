@@ -0,0 +1,74 @@
+import asyncio
+import hashlib
+
+import httpx
+
+from app.api.api import create_application
+
+BOUNDARY = "limite-de-prueba"
+CHUNK_SIZE = 64 * 1024
+
+def _multipart_chunks(filename: str, size: int, consumed: list):
+    """Cuerpo multipart por bloques; `consumed` cuenta los bloques leídos por el servidor"""
+    async def body():
+        head = (
+            f"--{BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        consumed.append(len(head))
+        yield head
+        sent = 0
+        while sent < size:
+            chunk = b"x" * min(CHUNK_SIZE, size - sent)
+            sent += len(chunk)
+            consumed.append(len(chunk))
+            yield chunk
+        tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+        consumed.append(len(tail))
+        yield tail
+    return body()
+
+def _upload(filename: str, size: int):
+    consumed = []
+    
+    async def scenario():
+        app = create_application()
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post(
+                    "/api/attachments/upload",
+                    content=_multipart_chunks(filename, size, consumed),
+                    headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+                )
+    return asyncio.run(scenario()), sum(consumed)
+
+def test_upload_is_streamed_to_disk(local_settings):
+    response, _ = _upload("informe.bin", 300 * 1024)
+    
+    assert response.status_code == 200
+    attachment = response.json()["attachment"]
+    assert attachment["size"] == 300 * 1024
+    assert attachment["attachment_id"] == hashlib.sha256(b"x" * 300 * 1024).hexdigest()
+    assert (local_settings.ATTACHMENTS_DIR / "informe.bin").read_bytes() == b"x" * 300 * 1024
+
+def test_oversized_upload_is_rejected_while_streaming(local_settings, monkeypatch):
+    # Sin Content-Length: solo el límite aplicado durante la copia puede detenerlo
+    monkeypatch.setattr(local_settings, "MAX_ATTACHMENT_SIZE", 256 * 1024)
+    response, consumed = _upload("enorme.bin", 10 * 1024 * 1024)
+    
+    assert response.status_code == 413
+    # El servidor dejó de leer poco después de superar el límite
+    assert consumed < 512 * 1024
+    assert not any(local_settings.ATTACHMENTS_DIR.iterdir())
+
+def test_upload_without_file_field_is_rejected(local_settings):
+    async def scenario():
+        app = create_application()
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/api/attachments/upload", data={"otro": "valor"}, files={"otro_archivo": ("a.txt", b"a")})
+    
+    assert asyncio.run(scenario()).status_code == 400
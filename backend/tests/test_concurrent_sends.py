@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.api.api import create_application
+from benchmarks.servers import SMTPSink
+
+# Pausa del servidor SMTP al recibir cada mensaje
+DATA_DELAY = 0.5
+CONCURRENT_SENDS = 5
+
+@pytest.fixture
+def slow_smtp(local_settings, monkeypatch):
+    sink = SMTPSink(data_delay=DATA_DELAY).start()
+    monkeypatch.setattr(local_settings, "EMAIL_PROVIDER", "titan")
+    monkeypatch.setattr(local_settings, "TITAN_SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(local_settings, "TITAN_SMTP_PORT", sink.port)
+    monkeypatch.setattr(local_settings, "TITAN_SMTP_STARTTLS", False)
+    monkeypatch.setattr(local_settings, "TITAN_SENDER_EMAIL", "pruebas@example.com")
+    monkeypatch.setattr(local_settings, "TITAN_SENDER_PASSWORD", "pruebas")
+    yield sink
+    sink.stop()
+
+def test_health_answers_while_sends_are_in_flight(slow_smtp):
+    async def scenario():
+        app = create_application()
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                payload = {
+                    "subject": "Prueba",
+                    "body": "<p>Hola</p>",
+                    "to_recipients": [{"email": "destino@example.com"}]
+                }
+                started = time.perf_counter()
+                sends = [
+                    asyncio.create_task(client.post("/api/emails/send", json=payload))
+                    for _ in range(CONCURRENT_SENDS)
+                ]
+                
+                # Mientras el servidor SMTP retiene los envíos, /health sigue respondiendo al momento
+                await asyncio.sleep(DATA_DELAY / 5)
+                health_latencies = []
+                while not all(send.done() for send in sends):
+                    health_started = time.perf_counter()
+                    health = await client.get("/health")
+                    health_latencies.append(time.perf_counter() - health_started)
+                    assert health.status_code == 200
+                    await asyncio.sleep(0.02)
+                
+                responses = await asyncio.gather(*sends)
+                elapsed = time.perf_counter() - started
+        return responses, health_latencies, elapsed
+    
+    responses, health_latencies, elapsed = asyncio.run(scenario())
+    
+    assert all(response.status_code == 200 and response.json()["success"] for response in responses)
+    assert slow_smtp.messages == CONCURRENT_SENDS
+    assert elapsed >= DATA_DELAY
+    # Varias comprobaciones respondieron mientras los envíos seguían en curso
+    assert len(health_latencies) >= 3
+    assert max(health_latencies) < DATA_DELAY / 2
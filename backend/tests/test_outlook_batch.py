@@ -0,0 +1,80 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.core.providers.outlook.email_provider import OutlookEmailProvider
+from app.schemas.email import EmailRequest
+from benchmarks.servers import GraphStandIn
+
+@pytest.fixture
+def graph(local_settings, monkeypatch):
+    stand_in = GraphStandIn().start()
+    monkeypatch.setattr(local_settings, "MS_GRAPH_ENDPOINT", stand_in.endpoint)
+    monkeypatch.setattr(local_settings, "OUTLOOK_HTTP2", False)
+    monkeypatch.setattr(local_settings, "OUTLOOK_BATCH_RETRY_DELAY", 0.01)
+    yield stand_in
+    stand_in.stop()
+
+def _messages(count: int):
+    return [
+        EmailRequest(subject=f"Prueba {index}", body="<p>Hola</p>", to_recipients=[{"email": f"destino{index}@example.com"}])
+        for index in range(count)
+    ]
+
+def _send_batch(messages):
+    async def scenario():
+        # Cuenta propia en cada prueba: limitador nuevo, sin estado de otras pruebas
+        provider = OutlookEmailProvider(account=f"pruebas-{uuid.uuid4().hex}")
+        provider.auth._cache_token({"access_token": "pruebas", "expires_in": 3600})
+        try:
+            return await provider.send_batch(messages)
+        finally:
+            await provider.shutdown()
+    return asyncio.run(scenario())
+
+def test_sub_responses_are_mapped_by_id(graph):
+    # Respuestas en orden inverso; el mensaje 2 se rechaza de forma definitiva
+    def responder(requests):
+        return [
+            {"id": request["id"], "status": 400 if request["id"] == "2" else 202,
+             "body": {"error": {"code": "ErrorInvalidRecipients", "message": "destinatario no válido"}}}
+            for request in reversed(requests)
+        ]
+    graph.batch_responder = responder
+    
+    results = _send_batch(_messages(4))
+    
+    assert [result.success for result in results] == [True, True, False, True]
+    assert "destinatario no válido" in results[2].message
+    assert results[2].retryable is False
+    # Los rechazos definitivos no se reintentan
+    assert graph.batch_calls == [["0", "1", "2", "3"]]
+
+def test_only_failed_sub_requests_are_retried(graph):
+    def responder(requests):
+        first_call = len(graph.batch_calls) == 1
+        return [
+            {"id": request["id"], "status": 503 if first_call and request["id"] in ("1", "3") else 202}
+            for request in requests
+        ]
+    graph.batch_responder = responder
+    
+    results = _send_batch(_messages(4))
+    
+    assert all(result.success for result in results)
+    assert graph.batch_calls == [["0", "1", "2", "3"], ["1", "3"]]
+    assert graph.messages == 4
+
+def test_unknown_sub_response_ids_fail_without_aborting_the_batch(graph):
+    def responder(requests):
+        responses = [{"id": request["id"], "status": 202} for request in requests[:2]]
+        return responses + [{"status": 202}, {"id": "abc", "status": 202}]
+    graph.batch_responder = responder
+    
+    results = _send_batch(_messages(4))
+    
+    assert [result.success for result in results] == [True, True, False, False]
+    assert "id desconocido" in results[2].message
+    # Sin saber si se enviaron, las peticiones sin respuesta no se reintentan
+    assert len(graph.batch_calls) == 1
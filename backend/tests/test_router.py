@@ -0,0 +1,60 @@
+import asyncio
+from typing import List
+
+from app.core.providers.base import BaseEmailProvider
+from app.core.providers.router import RoutingEmailProvider, _Route
+from app.schemas.email import EmailRequest, EmailResponse
+
+class _StubProvider(BaseEmailProvider):
+    """Proveedor que devuelve siempre la misma respuesta y cuenta los envíos"""
+    
+    def __init__(self, response: EmailResponse):
+        self.response = response
+        self.calls = 0
+    
+    async def send_email(self, email_data: EmailRequest) -> EmailResponse:
+        self.calls += 1
+        return self.response.model_copy()
+
+def _email() -> EmailRequest:
+    return EmailRequest(subject="Prueba", body="<p>Hola</p>", to_recipients=[{"email": "destino@ejemplo.com"}])
+
+def _router(*providers: BaseEmailProvider) -> RoutingEmailProvider:
+    return RoutingEmailProvider([_Route(f"ruta-{index}", provider, 1) for index, provider in enumerate(providers)])
+
+def test_permanent_error_does_not_fail_over_or_open_circuit():
+    permanent = EmailResponse(success=False, message="Error al enviar correo: 400 - mensaje no válido", retryable=False)
+    first, second = _StubProvider(permanent), _StubProvider(permanent)
+    router = _router(first, second)
+    
+    for _ in range(router.routes[0].breaker.failure_threshold + 2):
+        result = asyncio.run(router.send_email(_email()))
+        assert not result.success
+        assert result.retryable is False
+    
+    # Cada envío va a una sola ruta y ningún circuito se abre
+    assert first.calls + second.calls == router.routes[0].breaker.failure_threshold + 2
+    assert all(route.breaker.state == "closed" for route in router.routes)
+    assert all(route.failovers == 0 for route in router.routes)
+
+def test_permanent_error_in_batch_is_not_retried_elsewhere():
+    permanent = EmailResponse(success=False, message="Error al enviar correo: 550", retryable=False)
+    first, second = _StubProvider(permanent), _StubProvider(permanent)
+    router = _router(first, second)
+    
+    results: List[EmailResponse] = asyncio.run(router.send_batch([_email() for _ in range(4)]))
+    
+    assert [result.retryable for result in results] == [False] * 4
+    assert first.calls + second.calls == 4
+    assert all(route.breaker.state == "closed" for route in router.routes)
+
+def test_backend_error_fails_over_to_next_route():
+    failing = _StubProvider(EmailResponse(success=False, message="Error al enviar correo: conexión rechazada"))
+    healthy = _StubProvider(EmailResponse(success=True, message="Correo enviado exitosamente"))
+    router = _router(failing, healthy)
+    
+    results = [asyncio.run(router.send_email(_email())) for _ in range(4)]
+    
+    assert all(result.success for result in results)
+    assert failing.calls >= 1
+    assert router.routes[0].failovers == failing.calls